@@ -0,0 +1,169 @@
+"""Sample Powernap application used by the benchmarks.
+
+Everything runs in process: an in-memory SQLite database, Flask's test
+client, and by default in-memory rate limit storage.  Users are looked up by
+the `X-Auth` header where the token is the name of a user in `USERS`.
+"""
+
+import os
+import tempfile
+
+from flask import Flask
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer, String
+
+from powernap.architect.blueprints import Architect
+from powernap.http_codes import empty_success_code, success_code
+from powernap.mixins import PowernapFormMixin, PowernapMixin
+
+
+db = SQLAlchemy()
+
+# Token: (user id, number of items owned).
+USERS = {
+    "small": (1, 10),
+    "medium": (2, 1000),
+    "large": (3, 50000),
+    "writer": (4, 0),
+}
+
+DECORATORS = [
+    "powernap.decorators.format_",
+    "powernap.decorators.safe",
+    "powernap.decorators.permission",
+    "powernap.decorators.login",
+    "powernap.decorators.public",
+]
+
+
+class User(UserMixin):
+    is_admin = False
+
+    def __init__(self, id):
+        self.id = id
+
+    def has_permission(self, permission):
+        return True
+
+
+def load_user(token):
+    if token in USERS:
+        return User(USERS[token][0])
+    return None
+
+
+class Item(PowernapMixin, db.Model):
+    exposed_fields = ["id", "user_id", "name", "value"]
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    name = Column(String(255))
+    value = Column(Integer)
+
+    def api_response(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "value": self.value,
+        }
+
+
+class SimpleForm(object):
+    """Minimal stand in for a WTForms form."""
+    def __init__(self, formdata):
+        self.formdata = formdata
+        self.data = {}
+        self.errors = {}
+
+    def validate(self):
+        name = self.formdata.get("name")
+        if not isinstance(name, str) or not 0 < len(name) <= 255:
+            self.errors["name"] = ["Must be a string of 1 to 255 chars."]
+        try:
+            value = int(self.formdata.get("value"))
+        except (TypeError, ValueError):
+            self.errors["value"] = ["Must be an integer."]
+        if not self.errors:
+            self.data = {"name": name, "value": value}
+        return not self.errors
+
+    def populate_obj(self, obj):
+        for k, v in self.data.items():
+            setattr(obj, k, v)
+
+
+class ItemForm(PowernapFormMixin, SimpleForm):
+    model = Item
+
+
+# Name: STORAGE_BACKEND.  "redis" needs a Redis server on localhost.
+STORAGES = {
+    "memory": "powernap.storage.MemoryStorage",
+    "sqlite": "powernap.storage.SQLiteStorage",
+    "redis": "powernap.storage.RedisStorage",
+}
+
+
+def seed():
+    rows = []
+    for user_id, count in USERS.values():
+        rows.extend({
+            "user_id": user_id,
+            "name": "item-{}".format(i),
+            "value": i,
+        } for i in range(count))
+    db.session.bulk_insert_mappings(Item, rows)
+    db.session.commit()
+
+
+def register_views(architect):
+    bp = architect.sub_blueprint("bench", url_prefix="/bench", public=True)
+
+    @bp.route("/empty", methods=["GET"])
+    def empty():
+        return empty_success_code
+
+    @bp.route("/html", methods=["GET"])
+    def html():
+        return [{
+            "id": i,
+            "name": "<b>item {}</b>".format(i),
+            "description": "<script>alert({})</script> text".format(i),
+        } for i in range(100)], success_code
+
+    items = architect.sub_blueprint("items", url_prefix="/items", public=True)
+    items.crudify("", Item, ItemForm)
+
+
+def create_app(storage="memory"):
+    """Return a seeded app storing rate limits in `STORAGES[storage]`."""
+    base_dir = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI="sqlite://",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        API_URL_PREFIX="/api/v{version}",
+        DB_ENTRY_ATTR="user_id",
+        PAGINATION_PAGE="page",
+        PAGINATION_PER_PAGE="per_page",
+        RATE_LIMIT_EXPIRATION=3600,
+        REQUESTS_PER_HOUR=10 ** 9,
+        AUTHENTICATED_REQUESTS_PER_HOUR=10 ** 9,
+        REDIS={},
+        STORAGE_BACKEND=STORAGES[storage],
+        STORAGE_SQLITE_PATH=os.path.join(base_dir, "storage.db"),
+        DEBUG=False,
+    )
+    db.init_app(app)
+    architect = Architect(
+        user_loader="benchmarks.app.load_user",
+        decorators=DECORATORS,
+        base_dir=base_dir,
+    )
+    with app.app_context():
+        register_views(architect)
+        architect.init_app(app)
+        db.create_all()
+        seed()
+    return app
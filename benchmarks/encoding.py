@@ -0,0 +1,85 @@
+"""Compare JSON and MessagePack encoding of API responses.
+
+Usage:
+
+    python -m benchmarks.encoding
+
+Encodes and decodes lists of sample models with the `APIEncoder` and prints
+the microseconds per list and the payload size of each format as JSON.
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import msgpack
+
+from powernap.architect.responses import APIEncoder
+from powernap.encoding import unpack_ext
+
+
+class Item(object):
+    """Ints and strings, like the benchmark app's items."""
+    def __init__(self, i):
+        self.id = i
+        self.name = "item-{}".format(i)
+        self.value = i
+
+    def api_response(self):
+        return {"id": self.id, "name": self.name, "value": self.value}
+
+
+class Order(object):
+    """Decimals, datetimes, and nested lists."""
+    def __init__(self, i):
+        self.id = i
+        self.total = Decimal(i) / 100
+        self.created = datetime(2020, 1, 1) + timedelta(minutes=i)
+        self.tags = ["tag-{}".format(i % 7), "tag-{}".format(i % 11)]
+
+    def api_response(self):
+        return {"id": self.id, "total": self.total, "created": self.created,
+                "tags": self.tags}
+
+
+def timed(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func()
+    return result, (time.perf_counter() - start) / iterations * 10 ** 6
+
+
+def run(rows=1000, iterations=50):
+    results = {}
+    encoder = APIEncoder()
+    for model in (Item, Order):
+        items = [model(i) for i in range(rows)]
+        packed, pack_us = timed(lambda: encoder.pack(items), iterations)
+        dumped, dump_us = timed(
+            lambda: json.dumps(items, cls=APIEncoder), iterations)
+        _, unpack_us = timed(lambda: msgpack.unpackb(
+            packed, ext_hook=unpack_ext), iterations)
+        _, load_us = timed(lambda: json.loads(dumped), iterations)
+        results[model.__name__] = {
+            "json": {"encode_us": dump_us, "decode_us": load_us,
+                     "bytes": len(dumped.encode())},
+            "msgpack": {"encode_us": pack_us, "decode_us": unpack_us,
+                        "bytes": len(packed)},
+        }
+    return {"rows": rows, "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="Number of models in each list.")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.rows, args.iterations), indent=2,
+                     sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
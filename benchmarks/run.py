@@ -0,0 +1,137 @@
+"""Benchmark the Powernap request pipeline.
+
+Usage:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --compare results.json
+    python -m benchmarks.run --storage sqlite --compare results.json
+
+Results are written as JSON with the requests/sec, p50, and p99 latency of
+each scenario.  `--compare` prints the change against an earlier run, which
+also compares rate limit storage backends.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from benchmarks.app import STORAGES, create_app
+
+
+# Name: (method, url, X-Auth token, json body, iterations).
+SCENARIOS = [
+    ("empty_format", "GET", "/api/v1/bench/empty", "small", None, 2000),
+    ("crudify_list_10", "GET", "/api/v1/items", "small", None, 1000),
+    ("crudify_list_1k", "GET", "/api/v1/items", "medium", None, 100),
+    ("crudify_list_1k_msgpack", "GET", "/api/v1/items", "medium", None, 100),
+    ("crudify_list_50k", "GET", "/api/v1/items", "large", None, 3),
+    ("crudify_get_one", "GET", "/api/v1/items/1", "small", None, 1000),
+    ("crudify_post", "POST", "/api/v1/items", "writer",
+     {"name": "new item", "value": 7}, 500),
+    ("safe_sanitize", "GET", "/api/v1/bench/html", "small", None, 200),
+    ("construct_query_filters", "GET",
+     "/api/v1/items?$name__icontains=item-1&$value__gte=10&$value__lt=900"
+     "&$order_by=-id&$page=1&$per_page=25", "medium", None, 500),
+]
+
+
+# Name: extra request headers.
+SCENARIO_HEADERS = {
+    "crudify_list_1k_msgpack": {"Accept": "application/msgpack"},
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(client, method, url, token, body, iterations, warmup,
+                 headers=None):
+    kwargs = {"headers": dict(headers or {}, **{"X-Auth": token})}
+    if body is not None:
+        kwargs["data"] = json.dumps(body)
+        kwargs["content_type"] = "application/json"
+    for _ in range(warmup):
+        client.open(url, method=method, **kwargs)
+
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        res = client.open(url, method=method, **kwargs)
+        samples.append(time.perf_counter() - start)
+        if res.status_code >= 400:
+            raise RuntimeError("{} {} returned {}: {}".format(
+                method, url, res.status_code, res.data[:200]))
+    return {
+        "requests": iterations,
+        "rps": iterations / sum(samples),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def run(scale=1.0, only=None, storage="memory"):
+    app = create_app(storage)
+    client = app.test_client()
+    results = {}
+    for name, method, url, token, body, iterations in SCENARIOS:
+        if only and name not in only:
+            continue
+        iterations = max(1, int(iterations * scale))
+        results[name] = run_scenario(
+            client, method, url, token, body, iterations,
+            warmup=max(1, iterations // 10), headers=SCENARIO_HEADERS.get(name))
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "storage": storage,
+        "results": results,
+    }
+
+
+def compare(old, new):
+    """Return lines describing the change of each scenario from `old`."""
+    lines = ["{:<26} {:>10} {:>10} {:>10}".format(
+        "scenario", "rps", "p50", "p99")]
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if not before:
+            continue
+        change = lambda key: "{:+.1f}%".format(
+            (result[key] - before[key]) / before[key] * 100)
+        lines.append("{:<26} {:>10} {:>10} {:>10}".format(
+            name, change("rps"), change("p50_ms"), change("p99_ms")))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="Write the JSON results here.")
+    parser.add_argument("--compare", help="JSON results of an earlier run.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply the iterations of every scenario.")
+    parser.add_argument("--scenario", action="append",
+                        help="Only run this scenario. Can be repeated.")
+    parser.add_argument("--storage", choices=sorted(STORAGES),
+                        default="memory", help="Rate limit storage backend.")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, args.scenario, args.storage)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), results)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
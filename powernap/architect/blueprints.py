@@ -2,19 +2,23 @@ import inspect
 from copy import deepcopy
 
 from flask import Blueprint, current_app, request
-from flask_graphql import GraphQLView
 from flask_login import LoginManager
 
 from powernap.architect.loaders import init_view_modules
-from powernap.auth.rate_limit import check_rate_limit
+from powernap.architect.responses import error_response, log_bad_admin_request
+from powernap.auth.rate_limit import check_rate_limit, recorded_headers
 from powernap.auth.token import (
     user_from_redis_token_wrapper,
     request_user_wrapper,
 )
+from powernap.batch import register_batch_view
 from powernap.cors import init_cors
-from powernap.decorators import format_
+from powernap.events import event_stream_response
 from powernap.exceptions import ApiError
-from powernap.helpers import load_from_string
+from powernap.helpers import load_from_string, run_async
+from powernap.instrumentation import init_instrumentation, timed
+from powernap.profiler import RequestProfiler, register_profiler_views
+from powernap.slow_requests import SlowRequestLog, register_slow_request_views
 from powernap.http_codes import (
     empty_success_code,
     error_code,
@@ -24,15 +28,24 @@ from powernap.http_codes import (
 from powernap.query.transformer import construct_query
 
 
-@format_
 def api_error(e):
-    """Error handler that returns error dict with error msg."""
-    desc = e.description
-    if isinstance(desc, dict):
-        content = desc
-    else:
-        content = {"errors": [desc]}
-    return content, e.code
+    """Error handler that returns error dict with error msg.
+
+    Does not use `format_`: rate limit headers are only added when the
+    request was counted, so errors like the 404s of unknown urls cost no
+    storage round trips.
+    """
+    resp = error_response(e.description, e.code, recorded_headers())
+    log_bad_admin_request(e.code, e.description)
+    return resp
+
+
+def raw_route_options(decorator_names):
+    """Route options for views that return their own `Response`, for the
+    decorators named `decorator_names`.
+    """
+    options = {"format_": False, "safe": True}
+    return {k: v for k, v in options.items() if k in decorator_names}
 
 
 class Architect:
@@ -53,7 +66,10 @@ class Architect:
         request_class="powernap.architect.requests.ApiRequest",
         api_encoder="powernap.architect.responses.APIEncoder",
         before_request_funcs=["powernap.auth.rate_limit.check_rate_limit"],
-        after_request_funcs=[], permissions=None, graphql_session_func=None):
+        after_request_funcs=[], permissions=None, graphql_session_func=None,
+        instrumentation=False, metrics_sink=None, profiler=False,
+        profiler_permission="powernap.profile", slow_request_log=False,
+        slow_request_permission="powernap.slow_requests", batch=False):
         """
         :param version: (int): version number for endpoints registerd with this
             architect.
@@ -71,7 +87,7 @@ class Architect:
         :param user_class: (string): Path to class that `user_from_redis_token`
             should return an instance of for the `current_user`.
         :param user_loader: (string): Path to function for
-            `login_manager.set_loader`.
+            `login_manager.set_loader`.  May be an `async def` function.
         :param login_manager: (string): Path to class used to used to set
             current_user value.
         :param response_blueprint: (string): import string for class used for
@@ -81,9 +97,9 @@ class Architect:
         :param api_encoder: (string): Path to Json encoder to be used by the
             application.
         :param before_request_funcs: (list): List of function paths to run
-            before requests.
+            before requests.  May be `async def` functions.
         :param after_request_funcs: (list): List of function paths to run
-            after requests.
+            after requests.  May be `async def` functions.
         :param permissions: (dict): Dictionary where keys are permission strings
             and values are human readable equivalents. Permissions strings
             are . seperated values.  e.g. "device" or "device.edit".  Perms are
@@ -91,6 +107,20 @@ class Architect:
             have the "device" permission.
         :param graphql_session_func: (string): Path to Func when executed
             returns a SqlAlchemy session to be used with graphql views.
+        :param instrumentation: (bool): Record per request stage timings,
+            SQL counts, and Redis counts.  See `powernap.instrumentation`.
+        :param metrics_sink: (string): Path to a `MetricsSink` subclass that
+            receives the instrumentation metrics.
+        :param profiler: (bool): Route admin only profiling endpoints.  See
+            `powernap.profiler`.
+        :param profiler_permission: (string): Permission required for the
+            profiling endpoints.
+        :param slow_request_log: (bool): Log slow requests and route an admin
+            only endpoint listing them.  See `powernap.slow_requests`.
+        :param slow_request_permission: (string): Permission required for the
+            slow request endpoint.
+        :param batch: (bool): Route `POST /batch` which runs several requests
+            in one round trip.  See `powernap.batch`.
         """
         self.blueprints = []
         self.version = version
@@ -111,12 +141,24 @@ class Architect:
                                     for path in before_request_funcs]
         self.after_request_funcs = [load_from_string(path)
                                     for path in after_request_funcs]
-        self.permissions = permissions or []
+        self.permissions = permissions or {}
 
         self.graphql_session_func = graphql_session_func
         if self.graphql_session_func:
             self.graphql_session_func = load_from_string(graphql_session_func)
 
+        self.instrumentation = instrumentation
+        self.metrics_sink = metrics_sink
+        if self.metrics_sink:
+            self.metrics_sink = load_from_string(metrics_sink)()
+
+        self.profiler = RequestProfiler() if profiler else None
+        self.profiler_permission = profiler_permission
+
+        self.slow_request_log = SlowRequestLog() if slow_request_log else None
+        self.slow_request_permission = slow_request_permission
+        self.batch = batch
+
     def _init_login_manager(self, login_manager, user_loader, user_class):
         """Loads the flask_login manager with the user retrieval function."""
         if not user_loader and not user_class:
@@ -132,11 +174,24 @@ class Architect:
         with app.app_context():
             app.json_encoder = self.api_encoder
             self.login_manager.init_app(app)
+            if self.profiler:
+                register_profiler_views(
+                    self, self.profiler, permission=self.profiler_permission)
+                self.profiler.init_app(app)
+            if self.slow_request_log:
+                register_slow_request_views(
+                    self, self.slow_request_log,
+                    permission=self.slow_request_permission)
+                self.slow_request_log.init_app(app)
+            if self.batch:
+                register_batch_view(self)
             app.register_blueprint(self)
             app.request_class = self.request_class
             app.register_error_handler(ApiError, api_error)
             app.register_error_handler(404, api_error)
             init_cors(app)
+            if self.instrumentation:
+                init_instrumentation(app, self.metrics_sink)
 
     @property
     def prefix(self):
@@ -170,13 +225,33 @@ class Architect:
             name, self.decorators, default_options=default_options,
             permissions=self.permissions, **kwargs)
         for func in self.before_request_funcs:
-            blueprint.before_request(func)
+            blueprint.before_request(
+                run_async(func) if inspect.iscoroutinefunction(func) else func)
         for func in self.after_request_funcs:
-            blueprint.after_request(func)
+            blueprint.after_request(
+                run_async(func) if inspect.iscoroutinefunction(func) else func)
         self.blueprints.append(blueprint)
         return blueprint
 
-    def register(self, app, options, first_registration):
+    def admin_blueprint(self, name, url_prefix, permission, description):
+        """Sub blueprint only available to admins with `permission`.
+
+        `permission` is added to the Architect's permissions with the human
+        readable `description`.
+        """
+        if not {"public", "permission"} <= set(self.decorator_names):
+            raise Exception('Admin blueprints require the "public" and '
+                            '"permission" decorators.')
+        self.permissions.setdefault(permission, description)
+        return self.sub_blueprint(name, url_prefix=url_prefix, public=False,
+                                  permission=permission)
+
+    @property
+    def raw_route_options(self):
+        """Route options for views that return their own `Response`."""
+        return raw_route_options(self.decorator_names)
+
+    def register(self, app, options, first_registration=False):
         """Register all the sub blueprints with the app."""
         init_view_modules(self.base_dir)
         for blueprint in self.blueprints:
@@ -217,7 +292,11 @@ class ResponseBlueprint(Blueprint):
         self.graphql_session_func = graphql_session_func
 
     def route(self, rule, **options):
-        """Wrap view with api response decorators, make `self.link`."""
+        """Wrap view with api response decorators, make `self.link`.
+
+        Views may be `async def` functions.  The decorators then await the
+        view and the response headers are read with the async Redis client.
+        """
         link = {'url': self.url_prefix + rule}
         link.update(options)
         self.links.append(link)
@@ -231,21 +310,67 @@ class ResponseBlueprint(Blueprint):
 
         def decorator(f):
             endpoint = options.pop("endpoint", f.__name__)
+            f = timed(f, 'view')
             for decorator in self.decorators:
                 v = options.pop(decorator.__name__, None)
                 args = [f] if v is None else [f, v]
                 f = decorator(*args)
+            if inspect.iscoroutinefunction(f):
+                f = run_async(f)
+            f.required_permission = permission
             options.update(self.default_route_options)
             self.add_url_rule(rule, endpoint, f, **options)
             return f
         return decorator
 
-    def graphql_view(self, rule, schema, session=None, **options):
-        session = session or self.graphql_session_func()
-        view = GraphQLView.as_view(
-            rule, schema=schema, graphiql=True, context={'session': session})
+    def graphql_view(self, rule, schema, session=None, batching=True,
+                     graphiql=True, max_depth=None, max_complexity=None,
+                     list_multiplier=10, cache_size=1000, **options):
+        """Route a graphql endpoint for `schema`.
+
+        :param session: A SqlAlchemy session used for every request.  If not
+            provided `graphql_session_func` is called to create a new
+            session for each request.
+        :param batching: Batch relationship loads so nested lists cost a
+            constant number of queries.
+        :param graphiql: Serve graphiql to browsers.
+        :param max_depth: Maximum query depth. Defaults to the
+            `GRAPHQL_MAX_DEPTH` setting.
+        :param max_complexity: Maximum query complexity. Defaults to the
+            `GRAPHQL_MAX_COMPLEXITY` setting.
+        :param list_multiplier: Complexity multiplier for list fields.
+        :param cache_size: Number of parsed documents and persisted queries
+            cached for this view.
+        """
+        from powernap.architect.graphql_views import (
+            PowernapGraphQLBackend,
+            PowernapGraphQLView,
+        )
+
+        backend = PowernapGraphQLBackend(
+            max_depth=max_depth, max_complexity=max_complexity,
+            list_multiplier=list_multiplier, cache_size=cache_size)
+        view = PowernapGraphQLView.as_view(
+            rule, schema=schema, graphiql=graphiql, session=session,
+            session_func=self.graphql_session_func, batching=batching,
+            backend=backend)
         self.route(rule, methods=['GET', 'POST'], format_=False, **options)(view)
 
+    def event_stream(self, rule, model, **options):
+        """Route a Server-Sent Events stream of changes to `model`.
+
+        Users receive the events of the rows they own, admins every event.
+        The model must set `publish_events`, see :mod:`powernap.events`.
+        """
+        def stream():
+            return event_stream_response(model)
+        stream.__name__ = "events_{}".format(model.__name__)
+        # The body is an endless stream, it can not be formatted or bleached.
+        # The events are bleached when they are published instead.
+        names = [decorator.__name__ for decorator in self.decorators]
+        options = dict(raw_route_options(names), **options)
+        self.route(rule, methods=['GET'], **options)(stream)
+
     def options(self, options):
         """Return a complete list of options for route and decorators."""
         complete = deepcopy(self.default_options)
@@ -279,11 +404,11 @@ class ResponseBlueprint(Blueprint):
             update_form = create_form
 
         def get_func():
-            return construct_query(model), success_code
+            return construct_query(model, api_rows=True, export=True), \
+                success_code
 
         def get_one_func(id):
-            instance = model.query.get_or_404(id)
-            instance.confirm_owner()
+            instance = model.get_owned_or_404(id)
             return instance, success_code
 
         def post_func():
@@ -294,8 +419,7 @@ class ResponseBlueprint(Blueprint):
             return form.format_errors(), error_code
 
         def put_func(id):
-            instance = model.query.get_or_404(id)
-            instance.confirm_owner()
+            instance = model.get_owned_or_404(id, write=True)
             form = update_form(request.jsonform, instance=instance)
             if form.validate():
                 instance = form.update_obj(instance)
@@ -303,8 +427,7 @@ class ResponseBlueprint(Blueprint):
             return form.format_errors(), error_code
 
         def delete_func(id):
-            instance = model.query.get_or_404(id)
-            instance.confirm_owner()
+            instance = model.get_owned_or_404(id, write=True)
             instance.delete()
             return empty_success_code
 
@@ -325,7 +448,7 @@ class ResponseBlueprint(Blueprint):
         """Adds the crudify methods as actual routes to the blueprint."""
         method_url = url
         func.__name__ = "{}_{}".format(method, model.__name__)
-        if inspect.getargspec(func).args:
+        if inspect.getfullargspec(func).args:
             method_url += "/<int:id>"
         methods = [method.split(' ')[0]]
         kwargs["methods"] = methods
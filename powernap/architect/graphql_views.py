@@ -0,0 +1,315 @@
+"""GraphQL view used by :meth:`ResponseBlueprint.graphql_view`."""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import sqlalchemy
+from flask import current_app, g, request
+from flask_graphql import GraphQLView
+from graphene.utils.str_converters import to_camel_case
+from graphql import execute, parse, validate
+from graphql.backend import GraphQLBackend, GraphQLDocument
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult
+from graphql.language import ast
+from graphql.type.definition import GraphQLList, GraphQLNonNull, get_named_type
+from graphql_server import HttpQueryError
+from promise import Promise
+from promise.dataloader import DataLoader
+from sqlalchemy.orm import Session, selectinload
+
+
+class RelationshipLoader(DataLoader):
+    """Loads one relationship for every parent resolved in a request.
+
+    Parents are re-selected by primary key with a `selectinload` of the
+    relationship, so any number of parents costs two statements.
+    """
+    cache = False
+
+    def __init__(self, relationship, *args, **kwargs):
+        self.relationship = relationship
+        super(RelationshipLoader, self).__init__(*args, **kwargs)
+
+    def batch_load_fn(self, parents):
+        model = self.relationship.parent.class_
+        pk = sqlalchemy.inspect(model).primary_key[0]
+        ids = [getattr(parent, pk.key) for parent in parents]
+        Session.object_session(parents[0]).query(model) \
+            .filter(pk.in_(ids)) \
+            .options(selectinload(getattr(model, self.relationship.key))) \
+            .all()
+        return Promise.resolve(parents)
+
+
+class RelationshipBatchMiddleware(object):
+    """Graphene middleware that batches lazy loads of relationship fields.
+
+    Before a relationship field is resolved the relationship is loaded for
+    all sibling parents at once.  The field's own resolver then runs as
+    usual against the already loaded attribute.
+    """
+    def resolve(self, next, root, info, **args):
+        state = sqlalchemy.inspect(root, raiseerr=False)
+        relationship = self.relationship(state, info.field_name)
+        if relationship is None or state.session is None:
+            return next(root, info, **args)
+        loaders = info.context.setdefault('loaders', {})
+        if relationship not in loaders:
+            loaders[relationship] = RelationshipLoader(relationship)
+        return loaders[relationship].load(root).then(
+            lambda _: next(root, info, **args))
+
+    @staticmethod
+    def relationship(state, field_name):
+        """Return the unloaded relationship behind `field_name` if any."""
+        if state is None or not hasattr(state, 'unloaded'):
+            return None
+        for key, relationship in state.mapper.relationships.items():
+            if field_name in (key, to_camel_case(key)):
+                return relationship if key in state.unloaded else None
+        return None
+
+
+def query_hash(query):
+    """Return the sha256 hex digest used to key documents."""
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def selection_depth(selection_set, fragments):
+    """Return how deeply selection sets are nested in `selection_set`.
+
+    `{ users { id } }` has a depth of 1.  Introspection fields (`__schema`,
+    `__type`) are not counted so graphiql keeps working with a low limit.
+    """
+    depth = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            if selection.name.value.startswith('__'):
+                continue
+            if selection.selection_set:
+                depth = max(depth, 1 + selection_depth(
+                    selection.selection_set, fragments))
+        else:
+            selections = fragment_selections(selection, fragments)
+            if selections:
+                depth = max(depth, selection_depth(selections, fragments))
+    return depth
+
+
+def selection_complexity(selection_set, parent_type, fragments, schema,
+                         multiplier):
+    """Return the field count of `selection_set`.
+
+    The cost of the fields below a list field is multiplied by `multiplier`.
+    """
+    cost = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            name = selection.name.value
+            if name.startswith('__'):
+                continue
+            field = getattr(parent_type, 'fields', {}).get(name)
+            child = 0
+            if field is not None and selection.selection_set:
+                child = selection_complexity(
+                    selection.selection_set, get_named_type(field.type),
+                    fragments, schema, multiplier)
+                field_type = field.type
+                if isinstance(field_type, GraphQLNonNull):
+                    field_type = field_type.of_type
+                if isinstance(field_type, GraphQLList):
+                    child *= multiplier
+            cost += 1 + child
+        else:
+            selections = fragment_selections(selection, fragments)
+            if selections:
+                condition = selection.type_condition if isinstance(
+                    selection, ast.InlineFragment) else \
+                    fragments[selection.name.value].type_condition
+                fragment_type = schema.get_type(condition.name.value) \
+                    if condition else parent_type
+                cost += selection_complexity(
+                    selections, fragment_type, fragments, schema, multiplier)
+    return cost
+
+
+def fragment_selections(selection, fragments):
+    """Return the selection set of an inline fragment or fragment spread."""
+    if isinstance(selection, ast.InlineFragment):
+        return selection.selection_set
+    fragment = fragments.get(selection.name.value)
+    return fragment.selection_set if fragment else None
+
+
+class PowernapGraphQLBackend(GraphQLBackend):
+    """Parses, validates, and checks query limits once per query hash.
+
+    :param max_depth: Maximum field nesting.  Falls back to the
+        `GRAPHQL_MAX_DEPTH` setting.  `None` is unlimited.
+    :param max_complexity: Maximum field count, where fields below a list
+        are multiplied by `list_multiplier`.  Falls back to the
+        `GRAPHQL_MAX_COMPLEXITY` setting.  `None` is unlimited.
+    :param list_multiplier: Expected length of a list field.
+    :param cache_size: Number of documents and persisted queries kept.
+    """
+    def __init__(self, max_depth=None, max_complexity=None,
+                 list_multiplier=10, cache_size=1000):
+        self.max_depth = max_depth
+        self.max_complexity = max_complexity
+        self.list_multiplier = list_multiplier
+        self.cache_size = cache_size
+        self.documents = OrderedDict()
+        self.persisted = OrderedDict()
+        self.lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string):
+        key = query_hash(document_string)
+        document = self.cached(self.documents, key)
+        if document is None or document.schema is not schema:
+            document = self.build_document(schema, document_string)
+            self.store(self.documents, key, document)
+        return document
+
+    def build_document(self, schema, document_string):
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast) or \
+            self.limit_errors(schema, document_ast)
+        if errors:
+            result = ExecutionResult(errors=errors, invalid=True)
+            run = lambda *args, **kwargs: result
+        else:
+            run = partial(execute, schema, document_ast)
+        return GraphQLDocument(schema, document_string, document_ast, run)
+
+    def limit_errors(self, schema, document_ast):
+        """Return errors for operations over the depth or complexity limit."""
+        max_depth = self.max_depth
+        if max_depth is None:
+            max_depth = current_app.config.get('GRAPHQL_MAX_DEPTH')
+        max_complexity = self.max_complexity
+        if max_complexity is None:
+            max_complexity = current_app.config.get('GRAPHQL_MAX_COMPLEXITY')
+
+        fragments = {
+            d.name.value: d for d in document_ast.definitions
+            if isinstance(d, ast.FragmentDefinition)
+        }
+        roots = {
+            'query': schema.get_query_type(),
+            'mutation': schema.get_mutation_type(),
+            'subscription': schema.get_subscription_type(),
+        }
+        errors = []
+        for operation in document_ast.definitions:
+            if not isinstance(operation, ast.OperationDefinition):
+                continue
+            selections = operation.selection_set
+            if max_depth is not None:
+                depth = selection_depth(selections, fragments)
+                if depth > max_depth:
+                    errors.append(GraphQLError(
+                        'Query depth {} exceeds the maximum of {}.'.format(
+                            depth, max_depth)))
+            if max_complexity is not None:
+                complexity = selection_complexity(
+                    selections, roots[operation.operation], fragments,
+                    schema, self.list_multiplier)
+                if complexity > max_complexity:
+                    errors.append(GraphQLError(
+                        'Query complexity {} exceeds the maximum of {}.'.format(
+                            complexity, max_complexity)))
+        return errors
+
+    def persist(self, params):
+        """Resolve an automatic persisted query in request `params`.
+
+        Clients send `extensions.persistedQuery.sha256Hash`.  With a `query`
+        the hash is checked and stored, without one the stored query is used.
+        """
+        extensions = params.get('extensions') or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpQueryError(400, 'Extensions are invalid JSON.')
+        key = (extensions.get('persistedQuery') or {}).get('sha256Hash')
+        if not key:
+            return params
+        params = dict(params.items())
+        if params.get('query'):
+            if query_hash(params['query']) != key:
+                raise HttpQueryError(400, 'provided sha does not match query')
+            self.store(self.persisted, key, params['query'])
+            return params
+        params['query'] = self.cached(self.persisted, key)
+        if params['query'] is None:
+            raise HttpQueryError(400, 'PersistedQueryNotFound')
+        return params
+
+    def cached(self, cache, key):
+        with self.lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def store(self, cache, key, value):
+        with self.lock:
+            cache[key] = value
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+
+class PowernapGraphQLView(GraphQLView):
+    """GraphQLView with a session per request and relationship batching.
+
+    :attr session: A session used for every request.  Takes precedence
+        over `session_func`.
+    :attr session_func: Function that returns a new session.  Called once
+        per request and closed after the request.
+    :attr batching: Batch relationship loads with
+        :class:`RelationshipBatchMiddleware`.
+    :attr backend: A :class:`PowernapGraphQLBackend` shared by every request
+        enables document caching, query limits, and persisted queries.
+    """
+    session = None
+    session_func = None
+    batching = True
+
+    def dispatch_request(self):
+        g._powernap_graphql_session = self.session
+        if g._powernap_graphql_session is None and self.session_func:
+            g._powernap_graphql_session = self.session_func()
+        try:
+            return super(PowernapGraphQLView, self).dispatch_request()
+        finally:
+            session = g.pop('_powernap_graphql_session', None)
+            if self.session is None and session is not None:
+                session.close()
+
+    def parse_body(self):
+        data = super(PowernapGraphQLView, self).parse_body()
+        if not isinstance(self.backend, PowernapGraphQLBackend):
+            return data
+        if isinstance(data, list):
+            return [self.backend.persist(entry) for entry in data]
+        if request.method == 'GET':
+            data = dict(request.args.to_dict(), **data)
+        return self.backend.persist(data)
+
+    def get_context(self):
+        return {
+            'request': request,
+            'session': g.get('_powernap_graphql_session'),
+            'loaders': {},
+        }
+
+    def get_middleware(self):
+        middleware = list(self.middleware or [])
+        if self.batching:
+            middleware.insert(0, RelationshipBatchMiddleware())
+        return middleware
@@ -9,6 +9,7 @@ from werkzeug.datastructures import MultiDict
 from werkzeug.exceptions import BadRequest
 from werkzeug.utils import cached_property
 
+from powernap.encoding import MSGPACK_MIMETYPE, msgpack, unpack_form
 from powernap.exceptions import InvalidJsonError
 
 
@@ -17,13 +18,15 @@ class ApiRequest(Request):
 
     @cached_property
     def jsonform(self):
-        """Parses and returns form for JSON body"""
+        """Parses and returns form for JSON or MessagePack body"""
         formdata = {}
         with suppress(BadRequest):
-            formdata = self.get_json(force=True) or {}
+            formdata = self.get_msgpack() if self.is_msgpack else \
+                self.get_json(force=True) or {}
             if not isinstance(formdata, dict):
                 raise InvalidJsonError(description="Form not API compatible: must be JSON object.")
-            if formdata and self.mimetype != 'application/json':
+            if formdata and self.mimetype not in (
+                    'application/json', MSGPACK_MIMETYPE):
                 current_app.logger.warning(
                     'JSON data with incorrect mimetype! {} {} {} {}'.format(
                         self.remote_addr, self.method, self.scheme, self.full_path,
@@ -34,6 +37,21 @@ class ApiRequest(Request):
         # inside of the MultiDict: {k:[v] for k, v in dict.items()}
         return MultiDict(list(formdata.items()))
 
+    @property
+    def is_msgpack(self):
+        return msgpack is not None and self.mimetype == MSGPACK_MIMETYPE
+
+    def get_msgpack(self):
+        """Return the unpacked MessagePack body, see `powernap.encoding`."""
+        data = self.get_data(cache=True)
+        if not data:
+            return {}
+        try:
+            return unpack_form(data)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise InvalidJsonError(
+                description="Invalid MessagePack body: {}".format(e))
+
     @property
     def remote_addr(self):
         """Safely get the originating ip of the request.
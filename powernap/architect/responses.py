@@ -2,12 +2,57 @@ import logging
 import json
 import re
 from decimal import Decimal
+from functools import lru_cache
+from inspect import signature
+from operator import attrgetter
 
 from sqlalchemy import inspect
 from flask import current_app, jsonify, Response, request, session
 from flask_login import current_user
 from flask_sqlalchemy import Pagination
 
+from powernap.encoding import MSGPACK_MIMETYPE, accepts_msgpack, msgpack, \
+    pack_ext
+from powernap.instrumentation import note, stage
+
+
+@lru_cache(maxsize=None)
+def accepts_exclude(cls):
+    """Whether `cls.api_response` takes the `exclude_properties` kwarg."""
+    try:
+        params = signature(getattr(cls, 'api_response')).parameters.values()
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return any(p.name == 'exclude_properties' or p.kind == p.VAR_KEYWORD
+               for p in params)
+
+
+@lru_cache(maxsize=None)
+def api_columns(cls, mapped=False):
+    """Return the `api_response_columns` of `cls` or `None`.
+
+    Models can set `api_response_columns` to a tuple of column names
+    instead of defining `api_response`.  Lists of them are serialized in
+    bulk.
+
+    :param mapped: (bool): Only return the names if they are all column
+        attributes of the mapped class `cls`, so rows can be selected
+        without loading instances.
+    """
+    names = getattr(cls, 'api_response_columns', None)
+    if names is None or hasattr(cls, 'api_response'):
+        return None
+    if mapped:
+        mapper = inspect(cls, raiseerr=False)
+        if mapper is None or not set(names) <= set(mapper.column_attrs.keys()):
+            return None
+    return tuple(names)
+
+
+def rows_to_dicts(columns, rows):
+    """Return `rows` of values in the order of `columns` as dicts."""
+    return [dict(zip(columns, row)) for row in rows]
+
 
 class APIEncoder(json.JSONEncoder):
     """Allows json.dumps to accept classses with api_respones method."""
@@ -20,7 +65,8 @@ class APIEncoder(json.JSONEncoder):
             return float(o)
         elif hasattr(o, 'isoformat'):
             return o.isoformat()
-        elif hasattr(o, 'api_response'):
+        elif hasattr(o, 'api_response') or \
+                api_columns(type(o)) is not None:
             return self.get_api_response(o)
         try:
             return super(APIEncoder, self).default(o)
@@ -29,12 +75,88 @@ class APIEncoder(json.JSONEncoder):
             msg += 'Did you add an "api_response" method?'
             raise TypeError(msg)
 
+    def encode(self, o):
+        if type(o) is list and o:
+            o = self.serialize_list(o)
+        return super(APIEncoder, self).encode(o)
+
+    def pack(self, o):
+        """Return `o` packed with MessagePack, see `powernap.encoding`."""
+        if type(o) is list and o:
+            o = self.serialize_list(o)
+        return msgpack.packb(o, default=self.pack_default)
+
+    def pack_default(self, o):
+        """`default` of `msgpack.packb`: ext types, then api responses."""
+        ext = pack_ext(o)
+        if ext is not None:
+            return ext
+        if hasattr(o, 'api_response'):
+            return self.get_api_response(o)
+        return self.default(o)
+
     def get_api_response(self, item):
-        try:
-            item = item.api_response(**{'exclude_properties': self.exclude_properties})
-        except TypeError:
-            item = item.api_response()
-        return item
+        return self.serialize_list([item])[0]
+
+    def serialize_list(self, items):
+        """Return the api responses of a list of models of one class.
+
+        The class is only inspected once and exclusions are applied once for
+        the whole list.  Other lists are returned as is.
+        """
+        cls = type(items[0])
+        columns = api_columns(cls)
+        if columns is None and not hasattr(items[0], 'api_response') or \
+                any(type(item) is not cls for item in items):
+            return items
+        if columns is not None:
+            columns = [c for c in columns if c not in self.exclude_properties]
+            if not columns:
+                return [{} for _ in items]
+            get = attrgetter(*columns)
+            rows = map(get, items) if len(columns) > 1 else \
+                ((get(item),) for item in items)
+            return rows_to_dicts(columns, rows)
+        if accepts_exclude(cls):
+            kwargs = {'exclude_properties': self.exclude_properties}
+            return [item.api_response(**kwargs) for item in items]
+        return [item.api_response() for item in items]
+
+
+@lru_cache(maxsize=512)
+def error_body(description, packed=False):
+    """Return the serialized body of an error with a string description."""
+    content = {"errors": [description]}
+    return msgpack.packb(content) if packed else json.dumps(content)
+
+
+def error_response(description, status_code, headers=None):
+    """Return an error response without the work of :class:`ApiResponse`.
+
+    :param description: A dict returned as is, or another value returned
+        as `{"errors": [description]}`.  Bodies of strings are cached.
+    """
+    packed = accepts_msgpack()
+    if isinstance(description, str):
+        data = error_body(description, packed)
+    else:
+        if not isinstance(description, dict):
+            description = {"errors": [description]}
+        data = APIEncoder().pack(description) if packed else \
+            json.dumps(description, cls=APIEncoder)
+    resp = Response(data, status=status_code,
+                    mimetype=MSGPACK_MIMETYPE if packed else 'application/json')
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def log_bad_admin_request(status_code, data):
+    """Log 4xx responses to admins unless in DEBUG."""
+    # The user is looked at last, it may not be loaded yet.
+    if not current_app.config['DEBUG'] and status_code // 100 == 4 and \
+            getattr(current_user, 'is_admin', False):
+        msg = "Bad Admin Request to '{}': {}".format(request.path, data)
+        logging.warning(msg)
 
 
 class ApiResponse(object):
@@ -69,17 +191,26 @@ class ApiResponse(object):
 
     @property
     def response(self):
-        data = json.dumps(self.data, cls=self.json_encoder)
-        resp = Response(data, mimetype='application/json')
+        if hasattr(self.data, 'stream_response'):
+            # Exports stream their own format, see `powernap.query.export`.
+            return self.data.stream_response(self.headers), self.status_code
+        with stage('serialize'):
+            if accepts_msgpack():
+                data = self.json_encoder().pack(self.data)
+                mimetype = MSGPACK_MIMETYPE
+                # Log the data, not the unreadable packed bytes.
+                logged = self.data
+            else:
+                data = json.dumps(self.data, cls=self.json_encoder)
+                mimetype = 'application/json'
+                logged = data
+        note('payload_bytes', len(data))
+        resp = Response(data, mimetype=mimetype)
         resp.headers.extend(self.headers)
         
-        self.log_error_if_bad_admin_request(data)
+        self.log_error_if_bad_admin_request(logged)
         return resp, self.status_code
 
     def log_error_if_bad_admin_request(self, data):
-        if not current_app.config['DEBUG'] and \
-                getattr(current_user, 'is_admin', False) and \
-                self.status_code // 100 == 4:
-            msg = "Bad Admin Request to '{}': {}".format(request.path, data)
-            logging.warning(msg)
+        log_bad_admin_request(self.status_code, data)
 
@@ -1,17 +1,90 @@
 import ipaddress
+import time
 
-from flask import current_app, request
+from flask import current_app, g, request
 from flask_login import current_user
 
+from powernap.decorators import prefetch_permission
 from powernap.exceptions import RequestLimitError
-from powernap.helpers import redis_connection
+from powernap.helpers import async_redis_connection, thread_pool
+from powernap.instrumentation import current_metrics, stage
+from powernap.storage import storage
+
+
+#: Set in the environ of batch sub requests, counted by the batch request.
+SUB_REQUEST_ENVIRON = 'powernap.batch_sub_request'
+
+
+def executor():
+    """Thread pool running Redis round trips that overlap other checks.
+
+    Sized by the `PRE_REQUEST_THREADS` setting.
+    """
+    return thread_pool(
+        'pre-request', current_app.config.get('PRE_REQUEST_THREADS', 4))
 
 
 def check_rate_limit():
-    rl = RateLimiter(current_user)
-    if rl.is_rate_limited():
-        msg = "You have hit the rate limit. Don't worry it will reset soon."
-        raise RequestLimitError(description=msg)
+    """Count the request against the rate limit.
+
+    The endpoint's permission is looked up while the Redis round trip is in
+    flight, see `powernap.decorators.prefetch_permission`.
+    """
+    if request.environ.get(SUB_REQUEST_ENVIRON):
+        return
+    with stage('rate_limit'):
+        rl = RateLimiter(current_user)
+        limited = rl.is_rate_limited(prefetch_permission())
+    if limited:
+        raise_rate_limited()
+
+
+async def check_rate_limit_async():
+    """`check_rate_limit` using the async Redis client."""
+    if request.environ.get(SUB_REQUEST_ENVIRON):
+        return
+    with stage('rate_limit'):
+        rl = AsyncRateLimiter(current_user)
+        limited = await rl.is_rate_limited()
+    if limited:
+        raise_rate_limited()
+
+
+def raise_rate_limited():
+    msg = "You have hit the rate limit. Don't worry it will reset soon."
+    raise RequestLimitError(description=msg)
+
+
+def count_request(storage, key, expiration, amount=1):
+    """Count `amount` requests to `key` with `storage.hit`.
+
+    Safe to call without an app context.  Returns `(requests, ttl, seconds)`
+    where `seconds` is the duration of the call.
+    """
+    start = time.perf_counter()
+    requests, ttl = storage.hit(key, expiration, amount)
+    return requests, ttl, time.perf_counter() - start
+
+
+def record_count(key, requests, ttl, seconds):
+    """Keep a request count for the rate limit headers of this request."""
+    g._powernap_rate_limit = {key: (requests, ttl)}
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add_redis(seconds)
+
+
+def recorded_headers():
+    """Return the rate limit headers of the count made this request.
+
+    Empty if the request was not counted.  Never reads storage, for error
+    responses.
+    """
+    counted = g.get('_powernap_rate_limit')
+    if not counted:
+        return {}
+    return RateLimiter(current_user).format_headers(
+        *next(iter(counted.values())))
 
 
 class RateLimiter:
@@ -23,7 +96,7 @@ class RateLimiter:
         :param db: The redis db num to connect to.
         """
         self.ip = request.remote_addr
-        self.redis = redis_connection(db)
+        self.storage = storage(db)
         self.user = user
 
     def headers(self):
@@ -33,28 +106,51 @@ class RateLimiter:
             X-RateLimit-Limit: The maximum amount of requests.
             X-RateLimit-Remaining: The number of requests Remaining.
             X-RateLimit-Reset: Seconds until reset of ratelimit.
+
+        Reuses the count from `is_rate_limited` when it ran this request.
         """
-        token, limit = self.token, self.limit
-        remaining = limit - int(self.redis.get(token) or 0)
+        token = self.token
+        counted = g.get('_powernap_rate_limit', {}).get(token)
+        if counted is not None:
+            return self.format_headers(*counted)
+        return self.format_headers(
+            self.storage.counter(token), self.storage.ttl(token))
+
+    def format_headers(self, count, ttl):
+        limit = self.limit
+        remaining = limit - int(count or 0)
         if remaining < 0:
             remaining = 0
         return {
             'X-RateLimit-Limit': limit,
             'X-RateLimit-Remaining': remaining,
-            'X-RateLimit-Reset': self.redis.ttl(token),
+            'X-RateLimit-Reset': ttl,
         }
 
-    def is_rate_limited(self):
-        return not self.ip_is_whitelisted() and \
-                self.over_limit(self.token, self.limit)
+    def is_rate_limited(self, while_waiting=None, amount=1):
+        """Count this request and return whether it is over the limit.
 
-    def over_limit(self, key, limit):
-        if self.redis.exists(key):
-            requests = self.redis.incr(key)
+        :param while_waiting: Function called while the Redis round trip runs
+            on another thread.
+        :param amount: Number of requests to count.
+        """
+        if self.ip_is_whitelisted():
+            if while_waiting:
+                while_waiting()
+            return False
+        return self.over_limit(self.token, self.limit, while_waiting, amount)
+
+    def over_limit(self, key, limit, while_waiting=None, amount=1):
+        expiration = current_app.config['RATE_LIMIT_EXPIRATION']
+        if while_waiting is None:
+            requests, ttl, seconds = count_request(
+                self.storage, key, expiration, amount)
         else:
-            requests = self.redis.setex(
-                key, 1, current_app.config['RATE_LIMIT_EXPIRATION']
-            )
+            future = executor().submit(
+                count_request, self.storage, key, expiration, amount)
+            while_waiting()
+            requests, ttl, seconds = future.result()
+        record_count(key, requests, ttl, seconds)
 
         if not current_app.config.get("RATE_LIMITING", True):
             return False
@@ -93,3 +189,42 @@ class RateLimiter:
             user_id,
             request.remote_addr,
         )
+
+
+class AsyncRateLimiter(RateLimiter):
+    """`RateLimiter` for async views using the pooled async Redis client.
+
+    Always uses Redis, whatever the `STORAGE_BACKEND`.
+    """
+    def __init__(self, user, db=0):
+        self.ip = request.remote_addr
+        self.redis = async_redis_connection(db)
+        self.user = user
+
+    async def headers(self):
+        from powernap.redis_clients import RAW_REPLY
+
+        token = self.token
+        counted = g.get('_powernap_rate_limit', {}).get(token)
+        if counted is not None:
+            return self.format_headers(*counted)
+        count = await self.redis.execute_command('GET', token, **RAW_REPLY)
+        return self.format_headers(count, await self.redis.ttl(token))
+
+    async def is_rate_limited(self):
+        return not self.ip_is_whitelisted() and \
+                await self.over_limit(self.token, self.limit)
+
+    async def over_limit(self, key, limit):
+        start = time.perf_counter()
+        async with self.redis.pipeline() as pipe:
+            pipe.set(key, 0, ex=current_app.config['RATE_LIMIT_EXPIRATION'],
+                     nx=True)
+            pipe.incr(key)
+            pipe.ttl(key)
+            _, requests, ttl = await pipe.execute()
+        record_count(key, requests, ttl, time.perf_counter() - start)
+
+        if not current_app.config.get("RATE_LIMITING", True):
+            return False
+        return requests > limit
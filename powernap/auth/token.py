@@ -1,15 +1,26 @@
+import base64
+import binascii
 import hashlib
+import hmac
+import inspect
+import json
 import os
+import threading
+import time
 
 from flask import current_app
 from flask_login import current_user
-from powernap.helpers import redis_connection, model_attrs
+from powernap.helpers import async_redis_connection, model_attrs, run_async
+from powernap.instrumentation import stage
+from powernap.storage import storage
 
 
 class TempToken(object):
     """Facilitate creating a temporary token hash to be stored in redis."""
-    def __init__(self):
-        self.redis = redis_connection()
+    def __init__(self, **data):
+        self.storage = storage()
+        for k, v in data.items():
+            setattr(self, k, v)
 
     @staticmethod
     def keys():
@@ -24,44 +35,64 @@ class TempToken(object):
         return cls(**{k: getattr(user, k) for k in TempToken.keys()})
 
     @classmethod
-    def retrieve(cls, token, redis=None):
-        redis = redis if redis else redis_connection()
-        data = redis.hgetall(token)
-        temp_token = cls()
-        for k in TempToken.keys:
-            setattr(temp_token, k, getattr(data, k, None))
-        return temp_token
+    def retrieve(cls, token, backend=None):
+        """:param backend: A storage backend, see `powernap.storage`.
+
+        Signed tokens are verified without the backend.
+        """
+        if is_signed_token(token):
+            data = verify_signed_token(token) or {}
+        else:
+            backend = backend if backend else storage()
+            data = backend.hgetall(token)
+        return cls(**{k: data.get(k) for k in TempToken.keys()})
 
     @staticmethod
     def delete(token):
-        redis = redis_connection()
-        redis.delete(token)
+        backend = storage()
+        if is_signed_token(token):
+            revoke_signed_token(token, backend)
+        else:
+            backend.delete(token)
         key = active_tokens_key(current_user)
-        redis.srem(key, token)
+        backend.srem(key, token)
 
     def api_response(self):
         return self.token_data
 
 
+def slot_tag(user):
+    """Redis Cluster hash tag shared by a user's tokens and active set.
+
+    Keeps them in one hash slot.  Empty unless the `REDIS` setting's `mode`
+    is "cluster".
+    """
+    if current_app.config.get("REDIS", {}).get("mode") != "cluster":
+        return ''
+    attr, _ = model_attrs()
+    digest = hashlib.sha1(str(getattr(user, attr)).encode()).hexdigest()
+    return '{' + digest[:12] + '}'
+
+
 def active_tokens_key(user):
     prefix_key = current_app.config.get("ACTIVE_TOKENS_PREFIX")
     prefix = getattr(user, prefix_key) if prefix_key else "active"
     attr, _ = model_attrs()
     attr_val = getattr(user, attr)
-    return '{}:{}'.format(prefix, attr_val)
+    return '{}{}:{}'.format(slot_tag(user), prefix, attr_val)
 
 
-def make_hash(redis=None):
+def make_hash(backend=None):
     """Return a random hash that does not exist as a token.
 
-    :param redis: An active redis connection. If None creates its own
-        connection.
+    :param backend: A storage backend, see `powernap.storage`. If None uses
+        the app's backend.
     """
-    redis = redis if redis else redis_connection()
+    backend = backend if backend else storage()
     count = 0
     while count < 100:
         token = hashlib.sha1(os.urandom(64)).hexdigest()
-        if not redis.get(token):
+        if not backend.get(token):
             return token
         count += 1
     raise Exception("Unable to generate unique hash.")
@@ -69,15 +100,15 @@ def make_hash(redis=None):
 
 def create_temp_token_from_hash_func(user, hash_func, temp_token_cls=None,
                                      **kwargs):
-    """Create expiring auth token in redis. `config['TOKEN_EXPIRE']`."""
-    redis = redis_connection()
-    token = hash_func(redis)
+    """Create expiring auth token in storage. `config['TOKEN_EXPIRE']`."""
+    backend = storage()
+    token = slot_tag(user) + hash_func(backend)
     temp_token = (temp_token_cls or TempToken).create(user)
     data = temp_token.token_data
     data.update(kwargs)
-    redis.hmset(token, data)
-    redis.sadd(active_tokens_key(user), token)
-    redis.expire(token, current_app.config['TOKEN_EXPIRE'])
+    backend.hset(token, data)
+    backend.sadd(active_tokens_key(user), token)
+    backend.expire(token, current_app.config['TOKEN_EXPIRE'])
     return token
 
 
@@ -86,17 +117,164 @@ def create_temp_token(user, temp_token_cls=None, **kwargs):
         user, make_hash, temp_token_cls, **kwargs)
 
 
+SIGNED_TOKEN_PREFIX = 'pn.'
+REVOKED_TOKENS_KEY = 'powernap:revoked'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _signature(payload):
+    key = current_app.config.get('SIGNED_TOKEN_KEY') or \
+        current_app.config['SECRET_KEY']
+    key = key.encode() if isinstance(key, str) else key
+    return hmac.new(key, payload.encode(), hashlib.sha256).digest()
+
+
+def is_signed_token(token):
+    return bool(token) and token.startswith(SIGNED_TOKEN_PREFIX)
+
+
+def create_signed_token(user, temp_token_cls=None):
+    """Create an expiring auth token verified without a storage lookup.
+
+    The token carries the `TempToken` data and expiry, signed with
+    `config['SIGNED_TOKEN_KEY']` or the app's `SECRET_KEY`.  It is added to
+    the user's active tokens like the tokens of :func:`create_temp_token`.
+    """
+    data = (temp_token_cls or TempToken).create(user).token_data
+    payload = _b64encode(json.dumps({
+        "jti": _b64encode(os.urandom(9)),
+        "exp": int(time.time()) + current_app.config['TOKEN_EXPIRE'],
+        "data": data,
+    }, separators=(',', ':')).encode())
+    token = '{}{}.{}'.format(
+        SIGNED_TOKEN_PREFIX, payload, _b64encode(_signature(payload)))
+    storage().sadd(active_tokens_key(user), token)
+    return token
+
+
+def _signed_payload(token):
+    """Return the payload of `token` if the signature matches, else `None`."""
+    try:
+        payload, signature = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        if not hmac.compare_digest(_b64decode(signature),
+                                   _signature(payload)):
+            return None
+        return json.loads(_b64decode(payload))
+    except (ValueError, binascii.Error):
+        return None
+
+
+def verify_signed_token(token):
+    """Return the data of a signed token, `None` if it is forged, expired,
+    or revoked.
+
+    Values are strings, like the data of tokens in storage.
+    """
+    payload = _signed_payload(token)
+    if not payload or payload["exp"] <= time.time() or \
+            payload["jti"] in denylist():
+        return None
+    return {k: str(v) for k, v in payload["data"].items()}
+
+
+def revoke_signed_token(token, backend=None):
+    """Add `token` to the revoked tokens until it expires."""
+    payload = _signed_payload(token)
+    if not payload:
+        return
+    backend = backend if backend else storage()
+    backend.sadd(REVOKED_TOKENS_KEY, '{exp}:{jti}'.format(**payload))
+    backend.expire(REVOKED_TOKENS_KEY, current_app.config['TOKEN_EXPIRE'])
+    denylist().add(payload["jti"])
+
+
+class Denylist(object):
+    """In process copy of the ids of revoked signed tokens.
+
+    Synced from storage at most every `TOKEN_DENYLIST_REFRESH` seconds, so
+    a token revoked by another worker is refused within that time.  Members
+    are stored as `<expiry>:<id>` and dropped once the token expires.
+    """
+    def __init__(self, refresh):
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.revoked = frozenset()
+        self.synced = None
+
+    def __contains__(self, jti):
+        if self.synced is None or time.time() - self.synced >= self.refresh:
+            self.sync()
+        return jti in self.revoked
+
+    def add(self, jti):
+        with self.lock:
+            self.revoked = self.revoked | {jti}
+
+    def sync(self, backend=None):
+        backend = backend if backend else storage()
+        now = time.time()
+        revoked, expired = set(), []
+        for member in backend.smembers(REVOKED_TOKENS_KEY):
+            if isinstance(member, bytes):
+                member = member.decode()
+            expires, _, jti = member.partition(':')
+            if int(expires) > now:
+                revoked.add(jti)
+            else:
+                expired.append(member)
+        if expired:
+            backend.srem(REVOKED_TOKENS_KEY, *expired)
+        with self.lock:
+            self.revoked = frozenset(revoked)
+            self.synced = now
+
+
+def denylist():
+    """Return the app's :class:`Denylist`."""
+    extensions = current_app.extensions
+    if 'powernap_denylist' not in extensions:
+        refresh = current_app.config.get('TOKEN_DENYLIST_REFRESH', 30)
+        extensions.setdefault('powernap_denylist', Denylist(refresh))
+    return extensions['powernap_denylist']
+
+
 def request_user_wrapper(f):
+    if inspect.iscoroutinefunction(f):
+        f = run_async(f)
+
     def inner(request):
         key = current_app.config.get("AUTH_HEADER", "X-Auth")
-        return f(request.headers.get(key))
+        with stage('auth'):
+            return f(request.headers.get(key))
     return inner
 
 
 def user_from_redis_token_wrapper(user_class, temp_token_cls=None):
-    def user_from_redis_token(token, redis=None):
-        redis = redis if redis else redis_connection()
-        temp_token = (temp_token_cls or TempToken).retrieve(token)
+    def user_from_redis_token(token, backend=None):
+        temp_token = (temp_token_cls or TempToken).retrieve(token, backend)
         pk = getattr(temp_token, current_app.config["active_tokens_attr"])
         return user_class.query.get(pk)
     return user_from_redis_token
+
+
+def async_user_from_redis_token_wrapper(user_class):
+    """Like `user_from_redis_token_wrapper` using the async Redis client.
+
+    The user is still loaded with a blocking database query.
+    """
+    async def user_from_redis_token(token):
+        if not token:
+            return None
+        if is_signed_token(token):
+            return user_from_redis_token_wrapper(user_class)(token)
+        data = await async_redis_connection().hgetall(token)
+        pk = data.get(current_app.config["active_tokens_attr"])
+        return user_class.query.get(pk) if pk is not None else None
+    return user_from_redis_token
@@ -0,0 +1,189 @@
+"""Run several API requests in one HTTP round trip.
+
+Enabled with the Architect's `batch` kwarg, which routes `POST /batch`:
+
+    {
+        "requests": [
+            {"method": "GET", "path": "/api/v1/items", "args": {"$page": 2}},
+            {"method": "POST", "path": "/api/v1/items", "body": {"name": "a"}}
+        ],
+        "concurrent": true
+    }
+
+Each sub request is dispatched like a request to the app, with its before
+and after request funcs, as the user of the batch request, which is only
+authenticated once.  A batch of n requests counts n requests against the
+rate limit with a single round trip; sub requests are not counted again.
+
+The response is a list of `{"status": ..., "body": ...}` in request order.
+Sub requests always answer JSON, even when the batch accepts MessagePack.
+Each sub request runs in its own app context, with its own `g`.  With
+`concurrent` consecutive GET requests run on a thread pool, each with its
+own database session.  A user that is a model instance is merged into the
+session of each sub request, as sessions are not thread safe.  Other
+methods run in order on the request thread.  Streamed responses, like
+event streams, can not be batched and answer 400.
+
+Settings:
+
+- `BATCH_MAX_REQUESTS`: Maximum number of sub requests.  Defaults to 20.
+- `BATCH_THREADS`: Size of the thread pool for concurrent GET requests.
+"""
+
+import json
+import sys
+
+import sqlalchemy
+from flask import Response, current_app, g, request
+from flask_login import current_user
+from werkzeug.test import EnvironBuilder
+
+from powernap.auth.rate_limit import (
+    SUB_REQUEST_ENVIRON,
+    RateLimiter,
+    raise_rate_limited,
+)
+from powernap.exceptions import InvalidFormError
+from powernap.helpers import thread_pool
+from powernap.http_codes import error_code, internal_server_error_code
+
+
+METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+# Sub requests answer JSON, whatever the batch request accepts, as their
+# bodies are embedded in the JSON batch response.
+SKIP_HEADERS = {"Accept", "Content-Length", "Content-Type"}
+
+
+def sub_requests(data, batch_path):
+    """Validate the `requests` of a batch and return them."""
+    requests = data.get("requests")
+    maximum = current_app.config.get("BATCH_MAX_REQUESTS", 20)
+    if not isinstance(requests, list) or not 0 < len(requests) <= maximum:
+        msg = "Must be a list of 1 to {} requests.".format(maximum)
+        raise InvalidFormError(description={"fields": {"requests": [msg]}})
+    for i, sub in enumerate(requests):
+        errors = []
+        if not isinstance(sub, dict):
+            errors.append("Must be an object.")
+        elif str(sub.get("method", "GET")).upper() not in METHODS:
+            errors.append("Method must be one of {}.".format(sorted(METHODS)))
+        elif not str(sub.get("path", "")).startswith("/"):
+            errors.append("Path must start with '/'.")
+        elif sub["path"].split("?")[0] == batch_path:
+            errors.append("Batch requests can not be nested.")
+        if errors:
+            raise InvalidFormError(
+                description={"fields": {"requests.{}".format(i): errors}})
+    return requests
+
+
+def environ(sub):
+    """Return the WSGI environ of sub request `sub`."""
+    headers = [(k, v) for k, v in request.headers if k not in SKIP_HEADERS]
+    headers.append(("Accept", "application/json"))
+    builder = EnvironBuilder(
+        path=sub["path"], method=str(sub.get("method", "GET")).upper(),
+        query_string=sub.get("args"), headers=headers,
+        json=sub.get("body"), base_url=request.host_url,
+        environ_base={"REMOTE_ADDR": request.environ.get("REMOTE_ADDR"),
+                      SUB_REQUEST_ENVIRON: True})
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def dispatch(app, environ, user, rate_limit):
+    """Run the request `environ` as `user` in its own app context, return a
+    `Response`.
+
+    A fresh app context gives each sub request its own `g`, so the unit of
+    work, metrics and caches of one do not leak into another.  Streamed
+    responses are rejected unread, they would block the batch until the
+    stream ends.
+    """
+    with app.app_context():
+        g._powernap_rate_limit = rate_limit
+        with app.request_context(environ) as ctx:
+            # flask_login loads the user unless the request context has one.
+            ctx.user = session_user(user)
+            try:
+                response = app.full_dispatch_request()
+            except Exception:
+                app.log_exception(sys.exc_info())
+                return Response(
+                    json.dumps({"errors": ["Internal server error."]}),
+                    internal_server_error_code, mimetype="application/json")
+            if response.is_streamed:
+                response.close()
+                return Response(
+                    json.dumps({"errors": ["Streamed responses can not be "
+                                           "batched."]}),
+                    error_code, mimetype="application/json")
+            return response
+
+
+def session_user(user):
+    """Return `user` merged into the current database session.
+
+    Model instances stay bound to the session they were loaded in, which
+    is removed with the app context of each sub request, and lazy loads on
+    them would use it from several threads.  Other users are returned as
+    is.
+    """
+    state = sqlalchemy.inspect(user, raiseerr=False)
+    if state is None or state.key is None:
+        return user
+    return type(user).query.session.merge(user, load=False)
+
+
+def run(requests, concurrent):
+    """Return the responses of `requests` in order."""
+    app = current_app._get_current_object()
+    user = current_user._get_current_object()
+    rate_limit = g.get("_powernap_rate_limit")
+    pool = thread_pool("batch", app.config.get("BATCH_THREADS", 4))
+    responses, pending = [], []
+    for sub in requests:
+        env = environ(sub)
+        if concurrent and env["REQUEST_METHOD"] == "GET":
+            pending.append(pool.submit(dispatch, app, env, user, rate_limit))
+            continue
+        responses.extend(future.result() for future in pending)
+        pending = []
+        responses.append(dispatch(app, env, user, rate_limit))
+    responses.extend(future.result() for future in pending)
+    return responses
+
+
+def encode(response):
+    """Return `response` as a JSON object string without decoding its body."""
+    data = response.get_data()
+    if not data:
+        body = "null"
+    elif response.mimetype == "application/json":
+        body = data.decode("utf-8")
+    else:
+        body = json.dumps(data.decode("utf-8", "replace"))
+    return '{{"status": {}, "body": {}}}'.format(response.status_code, body)
+
+
+def register_batch_view(architect, url_prefix="/batch"):
+    """Route the batch endpoint on a new sub blueprint."""
+    bp = architect.sub_blueprint(
+        "powernap_batch", import_name=__name__, public=True)
+    batch_path = architect.prefix + url_prefix
+
+    @bp.route(url_prefix, methods=["POST"], **architect.raw_route_options)
+    def batch():
+        data = request.jsonform
+        requests = sub_requests(data, batch_path)
+        # The batch request itself was counted as the first sub request.
+        if len(requests) > 1 and RateLimiter(current_user).is_rate_limited(
+                amount=len(requests) - 1):
+            raise_rate_limited()
+        responses = run(requests, bool(data.get("concurrent")))
+        body = "[{}]".format(", ".join(encode(res) for res in responses))
+        return Response(body, mimetype="application/json")
+
+    return bp
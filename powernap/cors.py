@@ -2,13 +2,32 @@
 
 import flask.logging
 import logging
-from flask_cors import CORS
+from flask import current_app, request
 
 
 def init_cors(app):
-    """Allow intial pre-flight "OPTIONS" request globally on app."""
+    """Allow intial pre-flight "OPTIONS" request globally on app.
+
+    Preflights are answered before any other before request func, so they
+    are not rate limited and do not load the user.  Browsers cache the
+    answer for `CORS_MAX_AGE` seconds, 600 by default.
+    """
     logging.getLogger('flask_cors').addHandler(flask.logging.default_handler)
     # Uncomment to debug CORS
     # logging.getLogger('flask_cors').setLevel(logging.DEBUG)
 
+    from flask_cors import CORS
+
+    app.config.setdefault('CORS_MAX_AGE', 600)
     CORS(app)
+    app.before_request_funcs.setdefault(None, []).insert(0, answer_preflight)
+
+
+def answer_preflight():
+    """Return the response to a CORS preflight, `None` for other requests.
+
+    Flask-CORS adds the CORS headers after the request.
+    """
+    if request.method == 'OPTIONS' and \
+            'Access-Control-Request-Method' in request.headers:
+        return current_app.make_default_options_response()
@@ -1,72 +1,131 @@
+import inspect
 import json
 
-import bleach
-from flask import abort, current_app
+from flask import abort, current_app, g, has_app_context, request
 from flask_login import current_user
 
+from powernap.encoding import MSGPACK_MIMETYPE, msgpack, pack_ext, unpack_ext
 from powernap.exceptions import PermissionError, UnauthorizedError
+from powernap.instrumentation import stage
+
+
+def check_before(func, check):
+    """Return `func` wrapped to call `check` first.
+
+    The wrapper is a coroutine function when `func` is, so decorators keep
+    `async def` views awaitable.
+    """
+    if inspect.iscoroutinefunction(func):
+        async def _formatter(*args, **kwargs):
+            check()
+            return await func(*args, **kwargs)
+    else:
+        def _formatter(*args, **kwargs):
+            check()
+            return func(*args, **kwargs)
+    return _formatter
 
 
 def public(func, public=False):
     """Identifies endpoints that are non-public and only available to admins."""
-    def _formatter(*args, **kwargs):
+    def check():
         if not public and not getattr(current_user, 'is_admin', False):
             abort(503 if current_app.config["DEBUG"] else 404)
-        return func(*args, **kwargs)
-    return _formatter
+    return check_before(func, check)
 
 
 def login(func, login=True):
     """Identifies public endpoints that do not require authenticated users."""
-    def _formatter(*args, **kwargs):
+    def check():
         if login and not current_user.is_authenticated:
             raise UnauthorizedError
-        return func(*args, **kwargs)
-    return _formatter
+    return check_before(func, check)
+
+
+def user_has_permission(permission):
+    """Return `current_user.has_permission(permission)`, cached per request."""
+    checked = g.setdefault('_powernap_permissions', {}) \
+        if has_app_context() else {}
+    if permission not in checked:
+        with stage('permission'):
+            checked[permission] = current_user.has_permission(permission)
+    return checked[permission]
+
+
+def prefetch_permission():
+    """Return a function looking up the requested endpoint's permission.
+
+    Returns `None` when the `permission` decorator will not check one.
+    The rate limit check calls it while waiting on Redis.
+    """
+    view = current_app.view_functions.get(request.endpoint)
+    permission = getattr(view, 'required_permission', None)
+    if not permission or not current_user.is_authenticated or \
+            getattr(current_user, 'is_admin', False):
+        return None
+    return lambda: user_has_permission(permission)
 
 
 def permission(func, permission=None):
     """Identifies endpoints that require the user to have permisssion."""
-    def _formatter(*args, **kwargs):
+    def check():
         if permission and not getattr(current_user, 'is_admin', False):
-            if not current_user.has_permission(permission):
+            allowed = user_has_permission(permission)
+            if not allowed:
                 raise PermissionError(
                     description="You have not been granted permission.")
-        return func(*args, **kwargs)
-    return _formatter
+    return check_before(func, check)
+
+
+def sanitize(data):
+    """Recursively bleach the strings of `data`.
+
+    This is not optimum, as we have to decode then recode.  This really
+    should be done in the ApiResponse.  Need to rethink how decorators are
+    registered for a route so that bleaching can be done before the response
+    results are rendered.
+    """
+    # Imported by the first sanitized response, not with powernap.
+    import bleach
+
+    def clean(data):
+        if isinstance(data, dict):
+            data = {clean(k): clean(v) for k, v in data.items()}
+        elif isinstance(data, (list, tuple)):
+            data = [clean(i) for i in data]
+        elif isinstance(data, str):
+            data = bleach.clean(data)
+        return data
+    return clean(data)
 
 
 def safe(func, safe=False):
     """Identifies endpoints that don't require sanitization of response data."""
-    def _formatter(*args, **kwargs):
-        res = func(*args, **kwargs)
+    def finish(res):
         if not safe:
-            def sanitize(data):
-                """This function recursively bleaches all the data.
-
-                This is not optimum, as we have to decode then recode.  This
-                really should be done in the ApiResponse.  Need to rethink how
-                decorators are registered for a route so that bleaching can be
-                done before the response results are rendered.
-                """
-                if isinstance(data, dict):
-                    data = {sanitize(k): sanitize(v) for k, v in data.items()}
-                elif isinstance(data, (list, tuple)):
-                    data = [sanitize(i) for i in data]
-                elif isinstance(data, str):
-                    data = bleach.clean(data)
-                return data
-
             def clean(res):
-                data = json.loads(res.get_data().decode())
-                data = json.dumps(sanitize(data))
-                res.set_data(data)
-
-            if isinstance(res, (tuple)):
-                clean(res[0])
-            else:
-                clean(res)
+                if res.mimetype == 'application/json':
+                    data = json.loads(res.get_data().decode())
+                    res.set_data(json.dumps(sanitize(data)))
+                elif res.mimetype == MSGPACK_MIMETYPE:
+                    data = msgpack.unpackb(
+                        res.get_data(), raw=False, ext_hook=unpack_ext)
+                    res.set_data(msgpack.packb(sanitize(data),
+                                               default=pack_ext))
+
+            with stage('sanitize'):
+                if isinstance(res, (tuple)):
+                    clean(res[0])
+                else:
+                    clean(res)
         return res
+
+    if inspect.iscoroutinefunction(func):
+        async def _formatter(*args, **kwargs):
+            return finish(await func(*args, **kwargs))
+    else:
+        def _formatter(*args, **kwargs):
+            return finish(func(*args, **kwargs))
     return _formatter
 
 
@@ -81,24 +140,35 @@ def format_(func, format_=True):
     :class:`powernap.api.responses.ApiResponse` object before the final
     response is sent from Flask.
     """
-    def _formatter(*args, **kwargs):
-        from powernap.architect.responses import ApiResponse
-        from powernap.auth.rate_limit import RateLimiter
-
-        res = func(*args, **kwargs)
-        if not format_:
-            return res
+    from powernap.architect.responses import ApiResponse
+    from powernap.auth.rate_limit import AsyncRateLimiter, RateLimiter
 
+    def unpack(res):
         if isinstance(res, tuple):
-            data, status_code = res
+            return res
         elif isinstance(res, int):
-            data = None
-            status_code = res
-        else:
-            raise Exception("Invalid Response Type: {}".format(type(res)))
+            return None, res
+        raise Exception("Invalid Response Type: {}".format(type(res)))
+
+    if inspect.iscoroutinefunction(func):
+        async def _formatter(*args, **kwargs):
+            res = await func(*args, **kwargs)
+            if not format_:
+                return res
+            data, status_code = unpack(res)
+            with stage('rate_limit'):
+                headers = await AsyncRateLimiter(current_user).headers()
+            return ApiResponse(data, status_code, headers).response
+        return _formatter
 
-        rl = RateLimiter(current_user)
-        headers = rl.headers()
+    def _formatter(*args, **kwargs):
+        res = func(*args, **kwargs)
+        if not format_:
+            return res
+        data, status_code = unpack(res)
+        with stage('rate_limit'):
+            rl = RateLimiter(current_user)
+            headers = rl.headers()
 
         return ApiResponse(data, status_code, headers).response
     return _formatter
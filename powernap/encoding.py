@@ -0,0 +1,82 @@
+"""MessagePack bodies for requests and responses.
+
+Requests sending `Content-Type: application/msgpack` have their body read
+by `request.jsonform` like JSON, and responses are packed instead of dumped
+to JSON when the request prefers `Accept: application/msgpack`.
+
+The types the :class:`powernap.architect.responses.APIEncoder` turns into
+strings or floats are packed as ext types instead:
+
+- `EXT_DECIMAL`: A `Decimal` as its string.
+- `EXT_DATETIME`, `EXT_DATE`, `EXT_TIME`: The ISO 8601 string.
+
+:func:`unpack_ext` turns them back into Python objects.  Needs
+[msgpack](https://msgpack.org/).
+"""
+
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from flask import request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+EXT_DECIMAL = 1
+EXT_DATETIME = 2
+EXT_DATE = 3
+EXT_TIME = 4
+
+EXT_TYPES = (
+    (Decimal, EXT_DECIMAL, str, Decimal),
+    (datetime, EXT_DATETIME, datetime.isoformat, datetime.fromisoformat),
+    (date, EXT_DATE, date.isoformat, date.fromisoformat),
+    (time, EXT_TIME, time.isoformat, time.fromisoformat),
+)
+
+
+def accepts_msgpack():
+    """Whether the request prefers MessagePack to JSON."""
+    if msgpack is None:
+        return False
+    accept = request.accept_mimetypes
+    return accept[MSGPACK_MIMETYPE] > accept['application/json']
+
+
+EXT_CODES = {type_: (code, to_str) for type_, code, to_str, _ in EXT_TYPES}
+
+
+def pack_ext(o):
+    """Return `o` as an ext type, or `None` if it has none."""
+    ext = EXT_CODES.get(type(o))
+    if ext is not None:
+        return msgpack.ExtType(ext[0], ext[1](o).encode())
+    for type_, code, to_str, _ in EXT_TYPES:
+        if isinstance(o, type_):
+            return msgpack.ExtType(code, to_str(o).encode())
+    return None
+
+
+def unpack_ext(code, data):
+    """`ext_hook` returning the Python objects of the ext types."""
+    for _, ext_code, _, from_str in EXT_TYPES:
+        if code == ext_code:
+            return from_str(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def unpack_form_ext(code, data):
+    """`ext_hook` returning the strings of the ext types, like JSON."""
+    if any(code == ext_code for _, ext_code, _, _ in EXT_TYPES):
+        return data.decode()
+    return msgpack.ExtType(code, data)
+
+
+def unpack_form(data):
+    """Return the object of a MessagePack request body."""
+    return msgpack.unpackb(data, raw=False, ext_hook=unpack_form_ext)
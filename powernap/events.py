@@ -0,0 +1,249 @@
+"""Push changes to models over Server-Sent Events.
+
+Models opt in with `publish_events = True`.  Their creates, updates, and
+deletes are published to the broker set by `EVENT_BROKER` when the session
+commits, and :meth:`ResponseBlueprint.event_stream` routes a stream of
+them:
+
+    event: update
+    data: {"model": "thing", "data": {"id": 1, "name": "new name"}}
+
+Each event goes to the channel of the model and to the channel of the
+row's owner, the `DB_ENTRY_ATTR` of the row.  Users stream the channel of
+the rows they own, admins the channel of the model, the same scoping as
+:func:`powernap.query.transformer.override_owner_id`.
+
+Rows are serialized with their `api_response` after the commit and bleached
+like the responses of routes that are not `safe`.  Delete events only carry
+the primary key of the row.
+
+- :class:`RedisBroker` (default): Redis pub/sub, shared by every worker.
+- :class:`MemoryBroker`: Queues in the worker process, for tests and
+  single process deployments.
+
+Settings:
+
+- `EVENT_BROKER`: Path to the broker class.
+- `EVENT_STREAM_HEARTBEAT`: Seconds between keepalive comments.
+"""
+
+import json
+import queue
+import threading
+
+from flask import Response, current_app, has_app_context
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from powernap.architect.responses import APIEncoder
+from powernap.decorators import sanitize
+from powernap.exceptions import PermissionError
+from powernap.helpers import load_from_string, model_attrs, redis_connection
+
+
+def broker():
+    """Return the app's event broker."""
+    extensions = current_app.extensions
+    if 'powernap_broker' not in extensions:
+        path = current_app.config.get(
+            'EVENT_BROKER', 'powernap.events.RedisBroker')
+        extensions.setdefault('powernap_broker', load_from_string(path)())
+    return extensions['powernap_broker']
+
+
+def channel(model, owner=None):
+    """Return the channel of `model`'s table, or of the rows of `owner`."""
+    name = 'powernap:events:{}'.format(model.__tablename__)
+    return name if owner is None else '{}:{}'.format(name, owner)
+
+
+class MemoryBroker(object):
+    """Delivers events to subscribers in the worker process."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, channels, message):
+        with self.lock:
+            queues = [q for c in channels for q in self.subscribers.get(c, ())]
+        for q in queues:
+            q.put(message)
+
+    def subscribe(self, channel):
+        subscription = MemorySubscription(self, channel)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription.queue)
+        return subscription
+
+
+class MemorySubscription(object):
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue()
+
+    def get(self, timeout):
+        """Return the next message, `None` after `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with self.broker.lock:
+            self.broker.subscribers.get(self.channel, set()).discard(
+                self.queue)
+
+
+class RedisBroker(object):
+    """Delivers events with Redis pub/sub, see the `REDIS` setting."""
+    def __init__(self):
+        self.redis = redis_connection()
+
+    def publish(self, channels, message):
+        pipe = self.redis.pipeline()
+        for c in channels:
+            pipe.publish(c, message)
+        pipe.execute()
+
+    def subscribe(self, channel):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(channel)
+        return RedisSubscription(pubsub)
+
+
+class RedisSubscription(object):
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout):
+        """Return the next message, `None` after `timeout` seconds."""
+        message = self.pubsub.get_message(timeout=timeout)
+        if message is None:
+            return None
+        data = message['data']
+        return data.decode('utf-8') if isinstance(data, bytes) else data
+
+    def close(self):
+        self.pubsub.close()
+
+
+def queue_events(session, flush_context):
+    """After flush: queue the changes of models that publish events.
+
+    Only the primary keys are captured here, rows are serialized once the
+    session commits, see :func:`publish`.
+    """
+    if not has_app_context():
+        return
+    _, db_entry_key = model_attrs()
+    pending = session.info.setdefault('powernap_events', [])
+    for kind, instances in (("create", session.new),
+                            ("update", session.dirty),
+                            ("delete", session.deleted)):
+        for instance in instances:
+            if not getattr(instance, 'publish_events', False):
+                continue
+            if kind == "update" and not session.is_modified(instance):
+                continue
+            model = type(instance)
+            channels = [channel(model)]
+            owner = getattr(instance, db_entry_key, None)
+            if owner is not None:
+                channels.append(channel(model, owner))
+            mapper = inspect(model)
+            pk = {mapper.get_property_by_column(column).key: value
+                  for column, value in zip(
+                      mapper.primary_key,
+                      mapper.primary_key_from_instance(instance))}
+            pending.append((channels, kind, model, pk))
+
+
+def commit_events(session):
+    """After commit: keep the queued events until the transaction ends."""
+    pending = session.info.pop('powernap_events', None)
+    if pending:
+        session.info.setdefault('powernap_committed_events', []).extend(
+            pending)
+
+
+def event_message(session, kind, model, pk):
+    """Return the Server-Sent Event of a change.
+
+    Deletes only carry the primary key.  The data is sanitized like the
+    responses of routes that are not `safe`.
+    """
+    data = pk
+    if kind != "delete":
+        data = session.query(model).filter_by(**pk).one_or_none()
+        if data is None:
+            return None
+    data = json.loads(json.dumps(
+        {"model": model.__tablename__, "data": data}, cls=APIEncoder))
+    return "event: {}\ndata: {}\n\n".format(kind, json.dumps(sanitize(data)))
+
+
+def publish(session, transaction):
+    """After the committed transaction ends: publish its events.
+
+    The rows are loaded and serialized here, outside of the flush and the
+    commit, where lazy loads may emit SQL.
+    """
+    if transaction.parent is not None:
+        return
+    pending = session.info.pop('powernap_committed_events', None)
+    if not pending or not has_app_context():
+        return
+    try:
+        for channels, kind, model, pk in pending:
+            message = event_message(session, kind, model, pk)
+            if message is not None:
+                broker().publish(channels, message)
+    except Exception as e:
+        current_app.logger.warning('Publishing events failed: {}'.format(e))
+
+
+def discard(session):
+    """After rollback: drop the events of the rolled back changes."""
+    session.info.pop('powernap_events', None)
+    session.info.pop('powernap_committed_events', None)
+
+
+event.listen(Session, 'after_flush', queue_events)
+event.listen(Session, 'after_commit', commit_events)
+event.listen(Session, 'after_transaction_end', publish)
+event.listen(Session, 'after_rollback', discard)
+
+
+def stream_channel(model):
+    """Return the channel the `current_user` may stream for `model`."""
+    client_key, db_entry_key = model_attrs()
+    if getattr(current_user, 'is_admin', False) or \
+            not hasattr(model, db_entry_key):
+        return channel(model)
+    if not hasattr(current_user, client_key):
+        # Like `owned_query`, a user that owns no rows sees none.
+        raise PermissionError
+    return channel(model, getattr(current_user, client_key))
+
+
+def event_stream_response(model):
+    """Return a streaming response of the events the user may see."""
+    events, channel = broker(), stream_channel(model)
+    heartbeat = current_app.config.get('EVENT_STREAM_HEARTBEAT', 15)
+
+    def stream():
+        # Subscribed on the first read, a response that is never read
+        # (like a rejected batch sub request) does not leak a subscription.
+        subscription = events.subscribe(channel)
+        try:
+            yield ": connected\n\n"
+            while True:
+                message = subscription.get(heartbeat)
+                yield ": keepalive\n\n" if message is None else message
+        finally:
+            subscription.close()
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream(), mimetype='text/event-stream', headers=headers)
@@ -1,37 +1,142 @@
+import asyncio
 import importlib
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-from redis import Redis, ConnectionPool
 from flask import current_app
 
 
-class DecodedRedis(Redis):
-    """Python 3.5 returns all items from redis as byte objects, decode them."""
-    def execute_command(self, *args, **options):
-        val = super(DecodedRedis, self).execute_command(*args, **options)
-        return decode_object(val)
+def __getattr__(name):
+    """Import the Redis clients of :mod:`powernap.redis_clients` on first
+    use, so importing powernap does not import redis.
+    """
+    if name.startswith('__'):
+        raise AttributeError(name)
+    from powernap import redis_clients
+    try:
+        return getattr(redis_clients, name)
+    except AttributeError:
+        raise AttributeError(
+            "module 'powernap.helpers' has no attribute '{}'".format(name))
 
 
-def decode_object(val):
-    if isinstance(val, list):
-        return list(map(lambda x: decode_value(x), val))
-    elif isinstance(val, dict):
-        return {decode_value(k): decode_value(v) for k, v in val.items()}
-    else:
-        return decode_value(val)
+# Keys of the `REDIS` setting that are not connection kwargs.
+TOPOLOGY_SETTINGS = (
+    'mode', 'startup_nodes', 'sentinels', 'sentinel_kwargs', 'service_name',
+    'replicas', 'read_from_replicas')
 
+_clients = {}
 
-def decode_value(val):
-    return val.decode('utf-8') if isinstance(val, bytes) else val
 
+def redis_connection(db=None, read_only=False):
+    """Return a Redis client shared by the process.
 
-def redis_connection(db=None):
-    settings = current_app.config['REDIS']
+    `config['REDIS']` holds the connection kwargs of a single node, e.g.
+    `{"host": "localhost", "port": 6379}`, and optionally:
+
+    - `mode`: `"cluster"` for Redis Cluster with `startup_nodes`, a list of
+      `{"host": ..., "port": ...}`.  `"sentinel"` for Sentinel failover with
+      `sentinels`, a list of `[host, port]`, and `service_name`.
+    - `replicas`: A list of connection kwargs of read replicas of a single
+      node.
+    - `read_from_replicas`: Send the commands of `read_only` clients to a
+      replica.
+
+    :param db: The redis db num to connect to.
+    :param read_only: The client is only used for commands that do not write.
+    """
+    settings = dict(current_app.config['REDIS'])
     if db is not None:
         settings['db'] = db
-    pool = ConnectionPool(**settings)
     decode_bytes = current_app.config.get("DECODE_REDIS_BYTES", True)
-    cls = DecodedRedis if decode_bytes else Redis
-    return cls(connection_pool=pool, decode_responses=True)
+    # Cluster clients route read commands to replicas themselves.
+    read_only = read_only and settings.get('read_from_replicas', False) \
+        and settings.get('mode') != 'cluster'
+    key = repr((sorted(settings.items()), decode_bytes, read_only))
+    client = _clients.get(key)
+    if client is None:
+        from powernap.redis_clients import (
+            DecodedRedis, InstrumentedRedis, make_redis)
+        cls = DecodedRedis if decode_bytes else InstrumentedRedis
+        client = _clients.setdefault(key, make_redis(settings, cls, read_only))
+    return client
+
+
+# Async connection pools are bound to the event loop they were created on.
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def async_redis_connection(db=None):
+    """Return an async Redis client using a pool shared by the event loop.
+
+    Responses are always decoded.  Requires redis-py 4.2 or newer.
+    """
+    from powernap.redis_clients import InstrumentedAsyncRedis, aioredis
+    if aioredis is None:
+        raise Exception("Async Redis requires redis-py 4.2 or newer.")
+    settings = dict(current_app.config['REDIS'])
+    if settings.get('mode'):
+        raise Exception("Async Redis only supports a single node.")
+    settings = {k: v for k, v in settings.items()
+                if k not in TOPOLOGY_SETTINGS}
+    if db is not None:
+        settings['db'] = db
+    pools = _async_pools.setdefault(asyncio.get_running_loop(), {})
+    key = repr(sorted(settings.items()))
+    if key not in pools:
+        pools[key] = aioredis.ConnectionPool(decode_responses=True, **settings)
+    return InstrumentedAsyncRedis(connection_pool=pools[key])
+
+
+_loops = threading.local()
+
+
+def run_async(func):
+    """Return a sync function that runs the coroutine function `func`.
+
+    The coroutine runs on an event loop kept for the worker thread, so the
+    async connection pools of `async_redis_connection`, which are bound to
+    their loop, are reused between requests.  Flask 2's `app.ensure_sync`
+    is not used, it runs each call on a new loop.  The worker thread is
+    blocked until the coroutine finishes, this does not serve more requests
+    at once.
+    """
+    def _run(*args, **kwargs):
+        loop = getattr(_loops, 'loop', None)
+        if loop is None or loop.is_closed():
+            loop = _loops.loop = asyncio.new_event_loop()
+        return loop.run_until_complete(func(*args, **kwargs))
+    _run.__name__ = func.__name__
+    return _run
+
+
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+
+def thread_pool(name, size):
+    """Return the process wide thread pool `name` with `size` threads.
+
+    `size` is only used the first time the pool is requested.
+    """
+    with _thread_pools_lock:
+        if name not in _thread_pools:
+            _thread_pools[name] = ThreadPoolExecutor(
+                size, thread_name_prefix='powernap-{}'.format(name))
+        return _thread_pools[name]
+
+
+@lru_cache(maxsize=None)
+def optional_import(name):
+    """Return module `name`, imported on first use, or `None` if it is not
+    installed.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
 
 
 def load_from_string(path):
@@ -0,0 +1,222 @@
+"""Per request timings, SQL counts, and Redis counts.
+
+Enabled with the Architect's `instrumentation` kwarg.  Every request then
+records how long each stage of the Powernap pipeline took along with the
+number and duration of SQL statements and Redis commands.  The results are
+logged, sent to the Architect's `metrics_sink`, and in debug added to the
+response as a `Server-Timing` header.
+"""
+
+import contextlib
+import inspect
+import json
+import logging
+import time
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger('powernap.metrics')
+
+
+class MetricsSink(object):
+    """Receives metrics after every request.  Subclass to export them.
+
+    `tags` is a dict with the `endpoint`, `method`, and `status` of the
+    request.
+    """
+    def increment(self, name, value=1, tags=None):
+        """Add `value` to the counter `name`."""
+
+    def observe(self, name, seconds, tags=None):
+        """Add a duration in seconds to the histogram `name`."""
+
+
+class RequestMetrics(object):
+    """Metrics of a single request.
+
+    Stage timings are exclusive: time spent in a nested stage (like `auth`
+    inside `rate_limit`) is only counted for the nested stage.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.redis_count = 0
+        self.redis_time = 0.0
+        self.notes = {}
+        self.statements = None
+        self._children = [0.0]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._children.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._children.pop()
+            self._children[-1] += elapsed
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - children
+
+    def add_sql(self, seconds, statement=None, parameters=None, conn=None):
+        self.sql_count += 1
+        self.sql_time += seconds
+        if self.statements is not None:
+            self.statements.append((statement, parameters, seconds, conn))
+
+    def add_redis(self, seconds):
+        self.redis_count += 1
+        self.redis_time += seconds
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Return a `Server-Timing` header value, durations in ms."""
+        metrics = ['{};dur={:.2f}'.format(k, v * 1000)
+                   for k, v in self.stages.items()]
+        metrics.append('sql;desc="{} queries";dur={:.2f}'.format(
+            self.sql_count, self.sql_time * 1000))
+        metrics.append('redis;desc="{} commands";dur={:.2f}'.format(
+            self.redis_count, self.redis_time * 1000))
+        metrics.append('total;dur={:.2f}'.format(self.total * 1000))
+        return ', '.join(metrics)
+
+    def api_response(self):
+        return {
+            "total": self.total,
+            "stages": dict(self.stages),
+            "sql_count": self.sql_count,
+            "sql_time": self.sql_time,
+            "redis_count": self.redis_count,
+            "redis_time": self.redis_time,
+        }
+
+
+def current_metrics():
+    """Return the :class:`RequestMetrics` of this request or `None`."""
+    if not has_app_context():
+        return None
+    return g.get('_powernap_metrics')
+
+
+def note(key, value):
+    """Attach `value` to the current request's metrics, if recorded."""
+    metrics = current_metrics()
+    if metrics:
+        metrics.notes[key] = value
+
+
+def stage(name):
+    """Context manager timing a pipeline stage of the current request."""
+    metrics = current_metrics()
+    return metrics.stage(name) if metrics else contextlib.nullcontext()
+
+
+def timed(func, name):
+    """Wrap `func` in a :func:`stage` named `name`.  Supports `async def`."""
+    if inspect.iscoroutinefunction(func):
+        async def _timed(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+    else:
+        def _timed(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+    _timed.__name__ = func.__name__
+    return _timed
+
+
+@contextlib.contextmanager
+def redis_timer():
+    """Record one Redis command for the current request."""
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_redis(time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('_powernap_query_start', []).append(
+        time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = conn.info['_powernap_query_start'].pop()
+    metrics = current_metrics()
+    if metrics:
+        metrics.add_sql(time.perf_counter() - start, statement, parameters,
+                        conn)
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get('_powernap_query_start')
+        if starts:
+            starts.pop()
+
+
+def begin_request_metrics():
+    g._powernap_metrics = RequestMetrics()
+
+
+def end_request_metrics(response):
+    metrics = current_metrics()
+    if metrics is None:
+        return response
+    data = metrics.api_response()
+    tags = {
+        "endpoint": request.endpoint,
+        "method": request.method,
+        "status": response.status_code,
+    }
+    if current_app.config.get('SERVER_TIMING', current_app.debug):
+        response.headers['Server-Timing'] = metrics.server_timing()
+    logger.info(json.dumps(dict(data, **tags), sort_keys=True))
+
+    sink = current_app.extensions['powernap_metrics_sink']
+    sink.observe('powernap.request', data['total'], tags)
+    for name, seconds in data['stages'].items():
+        sink.observe('powernap.stage.{}'.format(name), seconds, tags)
+    sink.increment('powernap.sql.count', data['sql_count'], tags)
+    sink.observe('powernap.sql', data['sql_time'], tags)
+    sink.increment('powernap.redis.count', data['redis_count'], tags)
+    sink.observe('powernap.redis', data['redis_time'], tags)
+    return response
+
+
+def init_request_metrics(app):
+    """Keep a :class:`RequestMetrics` for every request of `app`.
+
+    Can be called more than once, the hooks are only installed once.
+    """
+    if app.extensions.get('powernap_request_metrics'):
+        return
+    app.extensions['powernap_request_metrics'] = True
+    if not event.contains(Engine, 'before_cursor_execute',
+                          _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request_funcs.setdefault(None, []).insert(
+        0, begin_request_metrics)
+
+
+def init_instrumentation(app, sink=None):
+    """Record, log, and report metrics for every request of `app`."""
+    app.extensions['powernap_metrics_sink'] = sink or MetricsSink()
+    init_request_metrics(app)
+    app.after_request(end_request_metrics)
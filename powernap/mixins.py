@@ -1,12 +1,83 @@
 import contextlib
+from datetime import datetime
 
 import sqlalchemy
-from flask import current_app
+from flask import current_app, g, has_app_context
 from flask_sqlalchemy import BaseQuery
 from flask_login import current_user
+from sqlalchemy.ext.declarative import declared_attr
 
+# Registers the session listeners that publish model events.
+import powernap.events  # noqa: F401
 from powernap.exceptions import OwnerError
-from powernap.helpers import model_attrs
+from powernap.helpers import load_from_string, model_attrs
+
+
+# Paths to each dialect's insert, imported when a model first upserts.
+UPSERT_DIALECTS = {
+    "postgresql": "sqlalchemy.dialects.postgresql.insert",
+    "sqlite": "sqlalchemy.dialects.sqlite.insert",
+}
+
+
+def staged_sessions():
+    """Return sessions staged by the active unit of work, or `None`."""
+    if not has_app_context():
+        return None
+    return g.get("_powernap_unit_of_work")
+
+
+def begin_unit_of_work():
+    """Make `save`, `create`, and `delete` stage instead of commit.
+
+    Can be added to the Architect's `before_request_funcs` to batch every
+    commit of a request into one.
+    """
+    if staged_sessions() is None:
+        g._powernap_unit_of_work = []
+
+
+def commit_unit_of_work():
+    """Commit every session staged since :func:`begin_unit_of_work`."""
+    sessions = g.pop("_powernap_unit_of_work", None) or []
+    try:
+        for session in sessions:
+            session.commit()
+    except Exception as e:
+        current_app.logger.warning('Rollback: {}'.format(str(e)))
+        for session in sessions:
+            session.rollback()
+        raise
+
+
+def rollback_unit_of_work():
+    """Discard every session staged since :func:`begin_unit_of_work`."""
+    for session in g.pop("_powernap_unit_of_work", None) or []:
+        session.rollback()
+
+
+def end_unit_of_work(response):
+    """After request func: commit successful responses, rollback the rest."""
+    if response.status_code < 400:
+        commit_unit_of_work()
+    else:
+        rollback_unit_of_work()
+    return response
+
+
+@contextlib.contextmanager
+def unit_of_work():
+    """Explicit unit of work boundary.  Joins an already active one."""
+    if staged_sessions() is not None:
+        yield
+        return
+    begin_unit_of_work()
+    try:
+        yield
+    except Exception:
+        rollback_unit_of_work()
+        raise
+    commit_unit_of_work()
 
 
 class PowernapMixin(object):
@@ -16,37 +87,77 @@ class PowernapMixin(object):
     """
     query_class = BaseQuery
     exposed_fields = []
+    #: Publish creates, updates, and deletes, see :mod:`powernap.events`.
+    publish_events = False
 
     def session(self):
         return self.query.session
 
     @contextlib.contextmanager
     def session_context(self):
+        """Yield the session, rolling it back if the block raises.
+
+        Inside a unit of work the error is raised again, as the rollback
+        also discards the writes staged before it, so the whole unit of work
+        aborts instead of committing part of it.
+        """
         try:
             session = self.session()
             yield session
         except Exception as e:
             current_app.logger.warning('Rollback: {}'.format(str(e)))
             session.rollback()
+            if staged_sessions() is not None:
+                raise
+
+    @staticmethod
+    def commit_session(session):
+        """Commit `session` or stage it if a unit of work is active.
+
+        Staged sessions are flushed so primary keys and column defaults are
+        set before the unit of work commits.
+        """
+        staged = staged_sessions()
+        if staged is None:
+            session.commit()
+            return
+        session.flush()
+        if session not in staged:
+            staged.append(session)
 
     def delete(self):
         with self.session_context() as session:
+            self.add_tombstone(session)
             session.delete(self)
-            session.commit()
+            self.commit_session(session)
             return True
         return False
 
+    def add_tombstone(self, session):
+        """Record the delete for `$since` syncs if `tombstone_class` is set.
+
+        See :mod:`powernap.query.sync`.
+        """
+        tombstone_class = getattr(self, 'tombstone_class', None)
+        if tombstone_class is None:
+            return
+        _, db_entry_key = model_attrs()
+        owner = getattr(self, db_entry_key, None)
+        session.add(tombstone_class(
+            model=self.__tablename__,
+            pk=str(sqlalchemy.inspect(self).identity[0]),
+            owner=None if owner is None else str(owner)))
+
     @classmethod
     def safe_delete(cls, pk):
-        obj = cls.query.get_or_404(pk)
-        obj.confirm_owner()
+        obj = cls.get_owned_or_404(pk, write=True)
         obj.delete()
         return True
 
     def save(self):
         with self.session_context() as session:
             session.add(self)
-            session.commit()
+            self.commit_session(session)
             return self
         return None
 
@@ -73,12 +184,73 @@ class PowernapMixin(object):
         instance = cls.query.filter_by(**kwargs).first()
         if instance:
             return instance, False
+        dialect = cls.query.session.get_bind().dialect.name
+        # Relationships and other attributes can not be inserted with Core.
+        columns = sqlalchemy.inspect(cls).column_attrs.keys()
+        if dialect in UPSERT_DIALECTS and all(k in columns for k in kwargs):
+            return cls._insert_or_get(
+                load_from_string(UPSERT_DIALECTS[dialect]), kwargs)
         return cls.create(**kwargs), True
 
+    @classmethod
+    def _insert_or_get(cls, insert, kwargs):
+        """Race free create with `INSERT ... ON CONFLICT DO NOTHING`.
+
+        Only guards against duplicates when a unique constraint covers the
+        kwargs, which must all be columns.  The row is inserted with Core, so ORM-level events do not
+        fire for it.
+        """
+        mapper = sqlalchemy.inspect(cls)
+        values = {mapper.columns[k].name: v for k, v in kwargs.items()}
+        stmt = insert(cls.__table__).values(**values).on_conflict_do_nothing()
+        session = cls.query.session
+        result = session.execute(stmt)
+        if not result.rowcount:
+            return cls.query.filter_by(**kwargs).one(), False
+        cls.commit_session(session)
+        pk = {mapper.get_property_by_column(column).key: value for column, value
+              in zip(mapper.primary_key, result.inserted_primary_key)}
+        return cls.query.filter_by(**pk).one(), True
+
     @classmethod
     def create(cls, **kwargs):
         return cls(**kwargs).save()
 
+    @classmethod
+    def owned_query(cls, write=False):
+        """Return `cls.query` filtered to the `current_user`'s rows.
+
+        Pushes the same check as :meth:`confirm_owner` into the WHERE clause.
+        Models without the `DB_ENTRY_ATTR` are not filtered, and admins only
+        read every row, the same as
+        :func:`powernap.query.transformer.override_owner_id`.  Users without
+        the `ACTIVE_TOKENS_ATTR`, e.g. anonymous users, match no rows.
+
+        :param write: (bool): The rows are updated or deleted, admins are
+            filtered like other users.
+        """
+        client_key, db_entry_key = model_attrs()
+        query = cls.query
+        if not hasattr(cls, db_entry_key) or \
+                (not write and getattr(current_user, 'is_admin', False)):
+            return query
+        if not hasattr(current_user, client_key):
+            return query.filter(sqlalchemy.false())
+        return query.filter(
+            getattr(cls, db_entry_key) == getattr(current_user, client_key))
+
+    @classmethod
+    def get_owned_or_404(cls, pk, write=False):
+        """Like `get_or_404` but only matches rows the `current_user` owns.
+
+        Non-owners get a 404 from the same single query, so the row is never
+        loaded and a composite (owner, id) index can be used.
+
+        :param write: (bool): See :meth:`owned_query`.
+        """
+        pk_column = sqlalchemy.inspect(cls).primary_key[0]
+        return cls.owned_query(write).filter(pk_column == pk).first_or_404()
+
     def confirm_owner(self, throw=True):
         client_key, db_entry_key = model_attrs()
         current_user_id = getattr(current_user, client_key)
@@ -89,6 +261,26 @@ class PowernapMixin(object):
         return is_owner
 
 
+class TombstoneTableMixin(object):
+    """Add to the table recording deletes for `$since` syncs.
+
+    Models set it as their `tombstone_class`.
+    """
+    __tablename__ = "powernap_tombstones"
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    model = sqlalchemy.Column(sqlalchemy.String(255), nullable=False)
+    pk = sqlalchemy.Column(sqlalchemy.String(255), nullable=False)
+    owner = sqlalchemy.Column(sqlalchemy.String(255))
+    deleted_at = sqlalchemy.Column(
+        sqlalchemy.DateTime, nullable=False, default=datetime.utcnow)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (sqlalchemy.Index(
+            "ix_{}_model_id".format(cls.__tablename__), "model", "id"),)
+
+
 class PowernapFormMixin(object):
     def __init__(self, *args, **kwargs):
         self.instance = kwargs.pop("instance", None)
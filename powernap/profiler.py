@@ -0,0 +1,175 @@
+"""Profile a running worker without redeploying.
+
+Enabled with the Architect's `profiler` kwarg, which routes admin only
+endpoints that either:
+
+- Sample the stacks of every thread for a few seconds and return them in
+  the collapsed stack format used by flame graph tools.
+- Run :mod:`cProfile` on the next N requests to one endpoint and return the
+  combined stats in the :mod:`pstats` dump format.
+
+Nothing is registered when the profiler is not enabled.  Profiles only
+cover the worker process that handles the profiling request.
+"""
+
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, current_app, g, request
+
+from powernap.exceptions import InvalidFormError
+from powernap.http_codes import success_code
+
+
+class StackSampler(object):
+    """Statistical profiler that samples the stacks of all threads.
+
+    :param interval: Seconds between samples.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def sample(self, seconds):
+        """Sample other threads for `seconds` and return `self.stacks`."""
+        ignore = threading.get_ident()
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != ignore:
+                    self.stacks[self.collapse(frame)] += 1
+            time.sleep(self.interval)
+        return self.stacks
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("{} ({}:{})".format(
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def collapsed(self):
+        """Return the samples as `frame;frame;frame count` lines."""
+        return "\n".join("{} {}".format(stack, count)
+                         for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler(object):
+    """Runs cProfile on the next requests to an armed endpoint."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoint = None
+        self.remaining = 0
+        self.captured = 0
+        self.stats = None
+
+    def arm(self, endpoint, count):
+        """Profile the next `count` requests to `endpoint`."""
+        with self.lock:
+            self.endpoint = endpoint
+            self.remaining = count
+            self.captured = 0
+            self.stats = None
+
+    def status(self):
+        return {
+            "endpoint": self.endpoint,
+            "remaining": self.remaining,
+            "captured": self.captured,
+        }
+
+    def start(self):
+        """Before request func: start a profile if the endpoint is armed."""
+        if not self.remaining or request.endpoint != self.endpoint:
+            return
+        with self.lock:
+            if not self.remaining:
+                return
+            self.remaining -= 1
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this interpreter.
+            return
+        g._powernap_profile = profile
+
+    def stop(self, exc=None):
+        """Teardown request func: add a finished profile to `self.stats`."""
+        profile = g.pop('_powernap_profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.captured += 1
+
+    def dump(self):
+        """Return the stats in the format written by `pstats.dump_stats`."""
+        with self.lock:
+            return marshal.dumps(self.stats.stats if self.stats else {})
+
+    def init_app(self, app):
+        app.before_request(self.start)
+        app.teardown_request(self.stop)
+
+
+def int_arg(data, key, default, maximum):
+    try:
+        value = int(data.get(key, default))
+    except (TypeError, ValueError):
+        value = 0
+    if not 0 < value <= maximum:
+        msg = "Must be an integer from 1 to {}.".format(maximum)
+        raise InvalidFormError(description={"fields": {key: [msg]}})
+    return value
+
+
+def register_profiler_views(architect, profiler, url_prefix="/profiler",
+                            permission="powernap.profile"):
+    """Route the admin only profiling endpoints on a new sub blueprint."""
+    bp = architect.admin_blueprint(
+        "powernap_profiler", url_prefix, permission, "Profile API requests.")
+    raw = architect.raw_route_options
+
+    @bp.route("/sample", methods=["POST"], **raw)
+    def sample_stacks():
+        data = request.jsonform
+        seconds = int_arg(data, "seconds", 5, 60)
+        interval = int_arg(data, "interval_ms", 5, 1000) / 1000.0
+        sampler = StackSampler(interval)
+        sampler.sample(seconds)
+        return Response(sampler.collapsed(), mimetype="text/plain")
+
+    @bp.route("/requests", methods=["POST"])
+    def arm_request_profile():
+        data = request.jsonform
+        endpoint = data.get("endpoint")
+        if endpoint not in current_app.view_functions:
+            msg = "Unknown endpoint."
+            raise InvalidFormError(description={"fields": {"endpoint": [msg]}})
+        profiler.arm(endpoint, int_arg(data, "count", 10, 1000))
+        return profiler.status(), success_code
+
+    @bp.route("/requests", methods=["GET"])
+    def request_profile_status():
+        return profiler.status(), success_code
+
+    @bp.route("/requests/stats", methods=["GET"], **raw)
+    def request_profile_stats():
+        return Response(profiler.dump(), mimetype="application/octet-stream")
+
+    return bp
@@ -80,7 +80,7 @@ class BaseQueryColumn(object, metaclass=_QueryMeta):
 
 class IntegerQueryColumn(BaseQueryColumn):
     impl = Integer
-    invalid = ['icontains']
+    invalid = ['icontains', 'startswith', 'startswith_case', 'search']
 
     def filter_by(self, column, value):
         if value == 'True':
@@ -92,7 +92,7 @@ class IntegerQueryColumn(BaseQueryColumn):
 
 class BooleanQueryColumn(IntegerQueryColumn):
     impl = Boolean
-    invalid = ['icontains']
+    invalid = ['icontains', 'startswith', 'startswith_case', 'search']
 
 
 class StringQueryColumn(BaseQueryColumn):
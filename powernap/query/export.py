@@ -0,0 +1,211 @@
+"""Columnar exports of crudify list endpoints.
+
+A request with `Accept: application/vnd.apache.arrow.stream` or
+`Accept: text/csv` gets every row of the query, or of the requested page,
+streamed in that format instead of a JSON page.  Rows are fetched from the
+cursor `EXPORT_CHUNK_SIZE` at a time and each chunk is written as one
+Arrow record batch or a block of CSV lines, without building instances or
+dicts.
+
+`$fields=id,name` selects the exported columns.  They must be columns in
+`exposed_fields` or `api_response_columns`, which are the default.
+Arrow needs [pyarrow](https://arrow.apache.org/docs/python/).
+
+Exports are not bleached like JSON responses, they are not rendered as
+HTML.  CSV strings a spreadsheet would read as a formula are prefixed with
+`'`.
+"""
+
+import csv
+import io
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy import inspect
+
+from powernap.architect.responses import api_columns
+from powernap.exceptions import InvalidFormError
+from powernap.helpers import optional_import
+
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+CSV_MIMETYPE = 'text/csv'
+
+# Leading characters that make spreadsheets evaluate a CSV cell.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def export_mimetype():
+    """Return the export format the request prefers to JSON, or `None`."""
+    accept = request.accept_mimetypes
+    offered = [CSV_MIMETYPE]
+    # Only import pyarrow for the requests that may want Arrow.
+    if ARROW_MIMETYPE in accept and optional_import('pyarrow') is not None:
+        offered.append(ARROW_MIMETYPE)
+    best = accept.best_match(offered)
+    if best is None or accept[best] <= accept['application/json']:
+        return None
+    return best
+
+
+def export_columns(cls, fields, exclude_properties=()):
+    """Return the names of the columns of `cls` to export.
+
+    :param fields: (str): Comma separated names from `$fields`, or `None`
+        for the `api_response_columns` or the exposed columns.
+    """
+    mapped = inspect(cls).column_attrs.keys()
+    allowed = [c for c in cls.exposed_fields if c in mapped]
+    allowed += [c for c in api_columns(cls, mapped=True) or ()
+                if c not in allowed]
+    if fields is None:
+        columns = list(api_columns(cls, mapped=True) or allowed)
+    else:
+        columns = [c.strip() for c in fields.split(',') if c.strip()]
+        for column in columns:
+            if column not in allowed:
+                errors = {'fields': {
+                    column: ["Invalid Argument: Field not exposed"]}}
+                raise InvalidFormError(description=errors)
+    columns = [c for c in columns if c not in exclude_properties]
+    if not columns:
+        errors = {'fields': {'$fields': ["Invalid Argument: No fields"]}}
+        raise InvalidFormError(description=errors)
+    return columns
+
+
+class ExportResult(object):
+    """Rows of a query to stream as `mimetype`, see
+    :meth:`QueryTransformer.transform`.
+
+    :param query: (Query): Query selecting only the exported columns.
+    :param names: (list): Names of the selected columns.
+    """
+    def __init__(self, query, names, mimetype):
+        self.query = query
+        self.names = names
+        self.mimetype = mimetype
+
+    def chunks(self):
+        """Yield lists of row tuples read from the cursor in chunks."""
+        size = current_app.config.get('EXPORT_CHUNK_SIZE', 10000)
+        result = self.query.session.execute(
+            self.query.statement,
+            execution_options={'stream_results': True})
+        for rows in result.partitions(size):
+            yield rows
+
+    def text_columns(self):
+        """Return the indexes of the selected string columns."""
+        indexes = []
+        for i, description in enumerate(self.query.column_descriptions):
+            try:
+                if issubclass(description['type'].python_type, str):
+                    indexes.append(i)
+            except NotImplementedError:
+                indexes.append(i)
+        return indexes
+
+    def csv_stream(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.names)
+        text = self.text_columns()
+        for rows in self.chunks():
+            if text:
+                rows = [escape_formulas(row, text) for row in rows]
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def arrow_stream(self):
+        pyarrow = optional_import('pyarrow')
+        types = [arrow_type(description['type'])
+                 for description in self.query.column_descriptions]
+        schema = pyarrow.schema([
+            (name, type_) for name, (type_, _) in zip(self.names, types)])
+        sink = ArrowSink()
+        writer = pyarrow.ipc.new_stream(sink, schema)
+        for rows in self.chunks():
+            arrays = [
+                pyarrow.array(values).cast(type_) if cast else
+                pyarrow.array(values, type=type_)
+                for values, (type_, cast) in zip(zip(*rows), types)]
+            writer.write_batch(
+                pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+            yield sink.pop()
+        writer.close()
+        yield sink.pop()
+
+    def stream_response(self, headers=None):
+        stream = self.arrow_stream if self.mimetype == ARROW_MIMETYPE \
+            else self.csv_stream
+        resp = Response(stream_with_context(stream()), mimetype=self.mimetype)
+        resp.headers.extend(headers or {})
+        return resp
+
+
+def escape_formulas(row, indexes):
+    """Return `row` with the strings at `indexes` that start like a
+    spreadsheet formula prefixed with `'`.
+    """
+    row = list(row)
+    for i in indexes:
+        value = row[i]
+        if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+            row[i] = "'" + value
+    return row
+
+
+class ArrowSink(object):
+    """File object collecting what the Arrow writer writes until `pop`."""
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+ARROW_TYPES = (
+    (bool, 'bool_'),
+    (int, 'int64'),
+    (float, 'float64'),
+    (Decimal, 'float64'),
+    (str, 'string'),
+    (bytes, 'binary'),
+    (datetime, 'timestamp'),
+    (date, 'date32'),
+)
+
+
+def arrow_type(column_type):
+    """Return the Arrow type of a SQLAlchemy column type and whether the
+    values must be cast to it.
+
+    Decimals are cast to doubles, like the JSON responses.
+    """
+    pyarrow = optional_import('pyarrow')
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return pyarrow.string(), True
+    for type_, name in ARROW_TYPES:
+        if issubclass(python_type, type_):
+            if name == 'timestamp':
+                return pyarrow.timestamp('us'), False
+            return getattr(pyarrow, name)(), type_ is Decimal
+    return pyarrow.string(), True
@@ -15,14 +15,22 @@ You would define the method:
         return query(func.max(column))
 """
 import json
+from functools import lru_cache
 
-from sqlalchemy import func, inspect
-
+from flask import current_app
+from sqlalchemy import (
+    all_, any_, column as sql_column, func, inspect, literal, select, table)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm.util import _ORMJoin
 
 from powernap.exceptions import InvalidFormError
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 
 def raise_error(keys=[], args=[]):
     keys = [keys] if not isinstance(keys, list) else keys
@@ -85,24 +93,150 @@ def icontains(cls, query, column, value):
     )
 
 
-def inside(cls, query, column, value):
-    """Return in_ query."""
+def _escape_like(value):
+    """Escape the wildcards of `value` for a LIKE pattern escaped by `\\`."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _dialect_name(cls, query):
+    """Return the name of the database dialect `query` runs on."""
+    return query.session.get_bind(mapper=inspect(cls)).dialect.name
+
+
+@lru_cache(maxsize=None)
+def _prefix_index(cls, column):
+    """Return the kind of index the table of `cls` has for prefix queries on
+    `column`: `'lower'` for an index on `LOWER(column)`, `'plain'` for an
+    index starting with the column, or `None`.
+    """
+    name = inspect(cls).columns[column].name
+    kind = None
+    for index in inspect(cls).local_table.indexes:
+        first = index.expressions[0]
+        if getattr(first, 'name', '').lower() == 'lower' and any(
+                getattr(c, 'name', None) == name for c in first.clauses):
+            return 'lower'
+        if getattr(first, 'name', None) == name:
+            kind = 'plain'
+    return kind
+
+
+def startswith(cls, query, column, value):
+    """Return prefix query, using the column's index when it has one.
+
+    - Index on `LOWER(column)` or no index: `LOWER(column) LIKE 'value%'`,
+      which ignores case.
+    - Index on the column: `column LIKE 'value%'`, which an ordinary index
+      serves (`text_pattern_ops` on Postgres).  It is case sensitive on
+      Postgres, SQLite and MySQL ignore case with their default collations.
+
+    The wildcards of `value` are escaped.
+    """
+    if _prefix_index(cls, column) == 'plain':
+        return startswith_case(cls, query, column, value)
+    pattern = _escape_like(value.lower()) + '%'
+    return query.filter(
+        func.LOWER(getattr(cls, column)).like(pattern, escape='\\'))
+
+
+def startswith_case(cls, query, column, value):
+    """Return case sensitive prefix query `column LIKE 'value%'`.
+
+    Case sensitive on Postgres, SQLite and MySQL ignore case with their
+    default collations.  The wildcards of `value` are escaped.
+    """
+    pattern = _escape_like(value) + '%'
+    return query.filter(getattr(cls, column).like(pattern, escape='\\'))
+
+
+def search(cls, query, column, value):
+    """Return full text search query for a column in `searchable_fields`.
+
+    - Postgres: `to_tsvector(config, column) @@ plainto_tsquery(config,
+      value)` with the `SEARCH_CONFIG` setting, "english" by default.
+    - MySQL: `MATCH (column) AGAINST (value)`, needs a FULLTEXT index.
+    - SQLite: `column MATCH` on the FTS5 table `search_table`, which
+      defaults to "<tablename>_fts" and has the rowids of the model's table.
+    - Other databases: `icontains` for each word.
+    """
+    if column not in getattr(cls, 'searchable_fields', []):
+        errors = {'fields': {column: ["Invalid Argument: Field not searchable"]}}
+        raise InvalidFormError(description=errors)
+    words = value.split()
+    if not words:
+        return query
+    attr = getattr(cls, column)
+    dialect = _dialect_name(cls, query)
+    if dialect == 'postgresql':
+        config = current_app.config.get('SEARCH_CONFIG', 'english')
+        return query.filter(func.to_tsvector(config, attr).op('@@')(
+            func.plainto_tsquery(config, value)))
+    if dialect in ('mysql', 'mariadb'):
+        return query.filter(attr.match(value))
+    if dialect == 'sqlite':
+        name = getattr(cls, 'search_table', None) or \
+            '{}_fts'.format(cls.__tablename__)
+        fts = table(name, sql_column('rowid'), sql_column(column))
+        phrases = " ".join(
+            '"{}"'.format(word.replace('"', '""')) for word in words)
+        rowids = select(fts.c.rowid).where(fts.c[column].op('MATCH')(phrases))
+        return query.filter(inspect(cls).primary_key[0].in_(rowids))
+    for word in words:
+        query = icontains(cls, query, column, word)
+    return query
+
+
+def _inside_values(column, value):
+    """Return the JSON list `value` or `None` if it is not a list.
+
+    Raises when the list is longer than the `INSIDE_MAX_LENGTH` setting.
+    """
     try:
-        return query.filter(getattr(cls, column).in_(json.loads(value)))
-    # Catching all exceptions is bad.  We'd like to catch
-    # json.decoder.JSONDecodeError but doesn't exists below python3.5.
-    except (TypeError, ValueError, Exception):
+        values = json_loads(value)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(values, list):
+        return None
+    maximum = current_app.config.get('INSIDE_MAX_LENGTH', 1000)
+    if len(values) > maximum:
+        msg = "Invalid Argument: More than {} values".format(maximum)
+        raise InvalidFormError(description={'fields': {column: [msg]}})
+    return values
+
+
+def _inside(cls, query, column, value, negate=False):
+    """Filter `query` by `column` in the JSON list `value`.
+
+    The list is bound as one parameter so the SQL is the same for any
+    length: `column = ANY(:values)` on Postgres and
+    `column IN (SELECT value FROM json_each(:values))` on SQLite.  Other
+    databases get one parameter per value.  Invalid lists are ignored.
+    """
+    values = _inside_values(column, value)
+    if values is None:
         return query
+    attr = getattr(cls, column)
+    dialect = _dialect_name(cls, query)
+    if dialect == 'postgresql':
+        array = literal(values, ARRAY(attr.type))
+        return query.filter(
+            attr != all_(array) if negate else attr == any_(array))
+    if dialect == 'sqlite':
+        rows = func.json_each(value).table_valued('value')
+        clause = attr.in_(select(rows.c.value))
+    else:
+        clause = attr.in_(values)
+    return query.filter(~clause if negate else clause)
+
+
+def inside(cls, query, column, value):
+    """Return in_ query."""
+    return _inside(cls, query, column, value)
 
 
 def not_inside(cls, query, column, value):
     """Return ~in_ query."""
-    try:
-        return query.filter(~getattr(cls, column).in_(json.loads(value)))
-    # Catching all exceptions is bad.  We'd like to catch
-    # json.decoder.JSONDecodeError but doesn't exists below python3.5.
-    except (TypeError, ValueError, Exception):
-        return query
+    return _inside(cls, query, column, value, negate=True)
 
 
 def gt(cls, query, column, value):
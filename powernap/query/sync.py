@@ -0,0 +1,144 @@
+"""Incremental sync of crudify list endpoints with `$since`.
+
+Models opt in by setting `sync_column`, the name of an indexed column
+updated on every write such as `updated_at` or a version, and
+`tombstone_class`, a table inheriting from
+:class:`powernap.mixins.TombstoneTableMixin`.  Deletes through
+:meth:`PowernapMixin.delete` record a tombstone in the same commit.
+
+`$since=` starts a sync and `$since=<token>` continues it.  The response
+has the rows changed after the token, the primary keys of rows deleted
+after it, a new token, and whether there are more changes to fetch:
+
+    {"items": [...], "deleted": [3, 7], "since": "WyIy...", "more": false}
+
+Rows are found with a seek on `(sync_column, primary key)`, so an index on
+those columns serves every page.
+
+Values are not assigned in commit order, a transaction can commit after a
+sync read rows with newer values.  With a `DateTime` sync column, set with
+`datetime.utcnow`, rows and tombstones newer than `SYNC_LAG` seconds are
+left for the next sync, so writes committing within `SYNC_LAG` of their
+timestamp are never skipped.  Other sync columns have no such window and
+are only safe when writes are serialized.
+
+Rows that stop matching the client's filters without being deleted are not
+reported, clients syncing a filtered list must resync to drop them.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import DateTime, func, inspect, literal, tuple_
+
+from powernap.exceptions import InvalidFormError
+
+
+def encode_token(value, pk, tombstone):
+    """Return the opaque token of a sync position."""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    data = json.dumps([value, pk, tombstone], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_token(token, column):
+    """Return the `(value, pk, tombstone)` of `token`.
+
+    :param column: (Column): The sync column, used to parse the value.
+    """
+    try:
+        value, pk, tombstone = json.loads(base64.urlsafe_b64decode(token))
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        return value, pk, tombstone
+    except (TypeError, ValueError, binascii.Error):
+        errors = {'fields': {'$since': ["Invalid Argument: Bad sync token"]}}
+        raise InvalidFormError(description=errors)
+
+
+def sync_cutoff(column):
+    """Return the time before which writes to `column` have committed, or
+    `None` when `column` is not a `DateTime` column.
+    """
+    if not isinstance(column.type, DateTime):
+        return None
+    lag = timedelta(seconds=current_app.config.get('SYNC_LAG', 5))
+    if column.type.timezone:
+        return datetime.now(timezone.utc) - lag
+    return datetime.utcnow() - lag
+
+
+class SyncResult(object):
+    """One page of changes, see :func:`sync_query`."""
+    def __init__(self, items, deleted, since, more):
+        self.items = items
+        self.deleted = deleted
+        self.since = since
+        self.more = more
+
+    def api_response(self):
+        return {
+            "items": self.items,
+            "deleted": self.deleted,
+            "since": self.since,
+            "more": self.more,
+        }
+
+
+def sync_query(cls, query, token, limit, owner=None):
+    """Return a :class:`SyncResult` of the rows of `query` changed after
+    `token`.
+
+    :param cls: (Model): Model with `sync_column` and `tombstone_class`.
+    :param query: (Query): Filtered query of `cls`.
+    :param token: (str): Token of the last sync, empty to start one.
+    :param limit: (int): Maximum number of rows and of tombstones.
+    :param owner: Only return tombstones of rows with this owner.
+    """
+    column = getattr(cls, cls.sync_column)
+    pk = inspect(cls).primary_key[0]
+    cutoff = sync_cutoff(column)
+    if cutoff is not None:
+        query = query.filter(column < cutoff)
+    tombstone_class = cls.tombstone_class
+    tombstones = tombstone_class.query.filter(
+        tombstone_class.model == cls.__tablename__,
+        tombstone_class.deleted_at < sync_cutoff(tombstone_class.deleted_at))
+    if owner is not None:
+        tombstones = tombstones.filter_by(owner=str(owner))
+    if token:
+        value, last_pk, last_tombstone = decode_token(token, column)
+        if value is not None:
+            query = query.filter(tuple_(column, pk) > tuple_(
+                literal(value, column.type), literal(last_pk, pk.type)))
+        tombstones = tombstones.filter(tombstone_class.id > last_tombstone)
+        deleted = tombstones.order_by(tombstone_class.id)\
+            .limit(limit + 1).all()
+    else:
+        # A new sync only needs the tombstones of later deletes.
+        last_tombstone = tombstones.with_entities(
+            func.max(tombstone_class.id)).scalar() or 0
+        value, last_pk, deleted = None, None, []
+    items = query.order_by(None).order_by(column, pk).limit(limit + 1).all()
+    more = len(items) > limit or len(deleted) > limit
+    items, deleted = items[:limit], deleted[:limit]
+    if items:
+        value = getattr(items[-1], cls.sync_column)
+        last_pk = getattr(items[-1], inspect(cls).get_property_by_column(
+            pk).key)
+    if deleted:
+        last_tombstone = deleted[-1].id
+    to_pk = pk.type.python_type
+    return SyncResult(
+        items, [to_pk(tombstone.pk) for tombstone in deleted],
+        encode_token(value, last_pk, last_tombstone), more)
+
+
+def sync_page_size(paginate, per_page):
+    """Return the page size of a sync from the pagination kwargs."""
+    return paginate.get(per_page) or \
+        current_app.config.get('SYNC_PAGE_SIZE', 500)
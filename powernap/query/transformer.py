@@ -2,25 +2,50 @@ from collections import deque
 
 from flask import current_app, request, session
 from flask_login import current_user
-from sqlalchemy import exc
+from sqlalchemy import exc, func
 
+from powernap.architect.responses import api_columns, rows_to_dicts
 from powernap.exceptions import InvalidFormError
 from powernap.helpers import load_from_string, model_attrs
+from powernap.instrumentation import note
 from powernap.query.columns import BaseQueryColumn, QUERY_COLUMNS
+from powernap.query.export import ExportResult, export_columns, export_mimetype
+from powernap.query.sync import sync_page_size, sync_query
 
 
-def construct_query(cls, enforce_owner=True, **kwargs):
+AGGREGATES = {
+    'count': func.count,
+    'sum': func.sum,
+    'avg': func.avg,
+    'min': func.min,
+    'max': func.max,
+}
+
+
+def aggregate_names(aggregates):
+    """Return the column names of `aggregates`, like `count` or `sum_amount`."""
+    return ['{}_{}'.format(name, column) if column else name
+            for name, column in aggregates]
+
+
+def construct_query(cls, enforce_owner=True, api_rows=False, export=False,
+                    **kwargs):
     """Return :class:`flask_sqlalchemy.Pagination` object from kwargs.
 
     :param cls: Target SQLA model for query_construction.
     :param enforce_owner: Ensures `id` in the query is set to
         the `current_user`'s id.
+    :param api_rows: The items of models with `api_response_columns` are
+        their api response dicts, selected without loading instances.
+    :param export: Return a :class:`powernap.query.export.ExportResult`
+        when the request accepts Arrow or CSV.
     :param kwargs: Kwargs to overide the query_args passed to
         :meth:`.QueryTransformer.transform`.
     """
     query_args = get_query_args_for_cls(
         cls, enforce_owner=enforce_owner, **kwargs)
-    return QueryTransformer(cls).transform(query_args)
+    return QueryTransformer(cls, api_rows=api_rows, export=export)\
+        .transform(query_args)
 
 
 def extend_query(query, enforce_owner=True, ignore=[], **kwargs):
@@ -73,9 +98,11 @@ def override_owner_id(cls, query_args):
 class QueryTransformer:
     query_columns = QUERY_COLUMNS
 
-    def __init__(self, cls=None, query=None):
+    def __init__(self, cls=None, query=None, api_rows=False, export=False):
         self.cls = cls or query._primary_entity.type
         self.initial_query = query
+        self.api_rows = api_rows
+        self.export = export
         self.exclude_properties = []
         self.page = current_app.config['PAGINATION_PAGE']
         self.per_page = current_app.config['PAGINATION_PER_PAGE']
@@ -120,15 +147,56 @@ class QueryTransformer:
                     `kwargs = {'page': 2, 'per_page': 25}`
                     `self.cls.query.paginate(2, 25, False)`
 
+        `$aggregate` and `$group_by` replace the items with grouped rows
+        computed in SQL, see :meth:`.QueryTransformer.aggregate_query`.
+
+        `$since` returns a :class:`powernap.query.sync.SyncResult` of the
+        changes since a sync token instead.
+
+        With `export` set, requests accepting Arrow or CSV get a
+        :class:`powernap.query.export.ExportResult` of the `$fields`
+        columns of every row, or of the requested page.
+
         If a kwarg not passed to `filter_by` is invalid the exception is
         caught & the query continues executing.  If a kwarg not designated
         special, is not a pagination kwarg, & is an invalid field will raise
         a subclassed :class:`core.api.exceptions.ApiError`.
         """
+        note('query_model', self.cls.__name__)
+        note('query_args', dict(query_args))
         self.pop_exclude_kwargs(query_args)
         paginate = self.pop_pagination_kwargs(query_args)
+        since = self.pop_since_kwarg(query_args)
+        aggregates, group_by = self.pop_aggregate_kwargs(query_args)
+        order = self.pop_aggregate_order_kwarg(query_args, aggregates,
+                                               group_by)
+        fields = query_args.pop('$fields', None)
+        mimetype = export_mimetype() if self.export else None
         query = self.create_query(query_args)
-        return self.paginate_query(query, paginate)
+        if since is not None:
+            _, db_entry_key = model_attrs()
+            result = sync_query(
+                self.cls, query, since, sync_page_size(paginate, self.per_page),
+                owner=query_args.get(db_entry_key))
+            note('rows', len(result.items))
+            return result
+        if aggregates:
+            query, columns = self.aggregate_query(
+                query, aggregates, group_by, order)
+        else:
+            columns = export_columns(self.cls, fields, self.exclude_properties) \
+                if mimetype else self.row_columns()
+            if columns:
+                query = query.with_entities(
+                    *[getattr(self.cls, column) for column in columns])
+        if mimetype:
+            note('export', mimetype)
+            return ExportResult(
+                self.page_query(query, paginate), columns, mimetype)
+        result = self.paginate_query(query, paginate, columns)
+        note('rows', len(result.items))
+        note('total', result.total)
+        return result
 
     def create_query(self, kwargs):
         """Create the query.  Called by :meth:`.QueryTransformer.transform`."""
@@ -204,14 +272,139 @@ class QueryTransformer:
             paginate[self.page] = 1
         return paginate
 
-    def paginate_query(self, query, paginate):
-        """Return :class:`flask_sqlalchemy.Pagination` object from query."""
+    def pop_since_kwarg(self, kwargs):
+        """Return the popped `$since` sync token, `None` without one."""
+        since = kwargs.pop('$since', None)
+        if since is not None and not getattr(self.cls, 'sync_column', None):
+            errors = {'fields': {
+                '$since': ["Invalid Argument: Model can not be synced"]}}
+            raise InvalidFormError(description=errors)
+        return since
+
+    def pop_aggregate_kwargs(self, kwargs):
+        """Return the popped `$aggregate` and `$group_by` kwargs.
 
+        `$aggregate=count,sum:amount` becomes
+        `[('count', None), ('sum', 'amount')]` and `$group_by=status`
+        becomes `['status']`.  Fields must be exposed.
+        """
+        aggregate = kwargs.pop('$aggregate', None)
+        group_by = kwargs.pop('$group_by', None)
+        aggregates = []
+        for spec in (aggregate or '').split(','):
+            name, _, column = spec.strip().partition(':')
+            if not name:
+                continue
+            if name not in AGGREGATES or (not column and name != 'count'):
+                errors = {'fields': {'$aggregate': [
+                    "Invalid Argument: {}".format(spec)]}}
+                raise InvalidFormError(description=errors)
+            if (name, column or None) in aggregates:
+                errors = {'fields': {'$aggregate': [
+                    "Invalid Argument: Duplicate {}".format(spec)]}}
+                raise InvalidFormError(description=errors)
+            aggregates.append((name, column or None))
+        group_by = [c.strip() for c in (group_by or '').split(',') if c.strip()]
+        if len(set(group_by)) != len(group_by):
+            errors = {'fields': {'$group_by': [
+                "Invalid Argument: Duplicate field"]}}
+            raise InvalidFormError(description=errors)
+        if group_by and not aggregates:
+            aggregates.append(('count', None))
+        for column in group_by + [c for _, c in aggregates if c]:
+            if column not in self.cls.exposed_fields:
+                errors = {'fields': {
+                    column: ["Invalid Argument: Field not exposed"]}}
+                raise InvalidFormError(description=errors)
+        return aggregates, group_by
+
+    def pop_aggregate_order_kwarg(self, kwargs, aggregates, group_by):
+        """Return the popped `$order_by` of an aggregate query.
+
+        `$order_by=-count,status` becomes `[('count', True), ('status',
+        False)]`.  Only `group_by` fields and aggregate names can order
+        grouped rows.  Other queries keep their `$order_by`.
+        """
+        if not aggregates or '$order_by' not in kwargs:
+            return []
+        names = set(group_by) | set(aggregate_names(aggregates))
+        order = []
+        for value in kwargs.pop('$order_by').split(','):
+            name = value.strip()
+            desc = name.startswith('-')
+            name = name.lstrip('-')
+            if name not in names:
+                errors = {'fields': {'$order_by': [
+                    "Invalid Argument: Not grouped or aggregated: {}".format(
+                        name)]}}
+                raise InvalidFormError(description=errors)
+            order.append((name, desc))
+        return order
+
+    def aggregate_query(self, query, aggregates, group_by, order=()):
+        """Return the grouped query and the names of its columns.
+
+        Each row has the `group_by` fields and the aggregates, named like
+        `count` or `sum_amount`.  Rows are ordered by `order`, the `(name,
+        descending)` tuples of :meth:`pop_aggregate_order_kwarg`, then by
+        the `group_by` fields.
+        """
+        groups = [getattr(self.cls, column) for column in group_by]
+        names = list(group_by) + aggregate_names(aggregates)
+        entities = list(groups)
+        for name, column in aggregates:
+            if column:
+                entities.append(AGGREGATES[name](getattr(self.cls, column)))
+            else:
+                entities.append(func.count())
+        query = query.with_entities(*entities)
+        by_name = dict(zip(names, entities))
+        ordering = [by_name[name].desc() if desc else by_name[name].asc()
+                    for name, desc in order]
+        if groups:
+            query = query.group_by(*groups)
+        if ordering or groups:
+            query = query.order_by(*(ordering + groups))
+        return query, names
+
+    def paginate_query(self, query, paginate, columns=None):
+        """Return :class:`flask_sqlalchemy.Pagination` object from query.
+
+        :param columns: (list): Names of the selected columns.  The items
+            are dicts of them instead of the rows.
+        """
         try:
-            return query.paginate(paginate.get(self.page, 1),
-                                  paginate.get(self.per_page, query.count()),
-                                  False)
+            result = query.paginate(paginate.get(self.page, 1),
+                                    paginate.get(self.per_page, query.count()),
+                                    False)
         except exc.OperationalError as e:
             msg = "Invalid Value: {}".format(e.orig.args[-1])
             errors = {'query_construction': [msg]}
             raise InvalidFormError(description=errors)
+        if columns:
+            result.items = rows_to_dicts(columns, result.items)
+        return result
+
+    def page_query(self, query, paginate):
+        """Return `query` limited to the requested page, if there is one.
+
+        Raises for pages or page sizes under 1, before anything is streamed.
+        """
+        per_page = paginate.get(self.per_page)
+        page = paginate.get(self.page, 1)
+        for key, value in ((self.page, page), (self.per_page, per_page)):
+            if value is not None and value < 1:
+                errors = {'fields': {'$' + key: [
+                    "Invalid Argument: Must be at least 1"]}}
+                raise InvalidFormError(description=errors)
+        if not per_page:
+            return query
+        return query.limit(per_page).offset((page - 1) * per_page)
+
+    def row_columns(self):
+        """Return the columns to select when `api_rows` is set, or `None`."""
+        columns = self.api_rows and api_columns(self.cls, mapped=True)
+        if not columns:
+            return None
+        return [c for c in columns if c not in self.exclude_properties] \
+            or None
@@ -0,0 +1,117 @@
+"""Redis clients, imported on first use by :mod:`powernap.helpers`."""
+
+import random
+
+from redis import Redis, ConnectionPool
+from redis.client import NEVER_DECODE
+from redis.sentinel import Sentinel
+
+from powernap.helpers import TOPOLOGY_SETTINGS
+from powernap.instrumentation import redis_timer
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:  # redis-py < 4.2
+    aioredis = None
+
+try:
+    from redis.cluster import ClusterNode, RedisCluster
+except ImportError:  # redis-py < 4.1
+    RedisCluster = None
+
+# Command options that skip decoding the reply, for replies that are parsed
+# as numbers anyway.
+RAW_REPLY = {NEVER_DECODE: True}
+
+
+class InstrumentedRedis(Redis):
+    """Records every command for :mod:`powernap.instrumentation`."""
+    def execute_command(self, *args, **options):
+        with redis_timer():
+            return super(InstrumentedRedis, self).execute_command(
+                *args, **options)
+
+
+class DecodedRedis(InstrumentedRedis):
+    """Python 3.5 returns all items from redis as byte objects, decode them.
+
+    `redis_connection` gives its pools `decode_responses`, so replies are
+    decoded by the connection's parser, hiredis when installed, and are
+    returned as is.  Replies from other pools are decoded here.
+    """
+    def __init__(self, *args, **kwargs):
+        super(DecodedRedis, self).__init__(*args, **kwargs)
+        self.pool_decodes = self.connection_pool.connection_kwargs.get(
+            'decode_responses', False)
+
+    def execute_command(self, *args, **options):
+        val = super(DecodedRedis, self).execute_command(*args, **options)
+        return val if self.pool_decodes else decode_object(val)
+
+
+if RedisCluster is not None:
+    class InstrumentedRedisCluster(RedisCluster):
+        """Cluster client recording every command like `InstrumentedRedis`."""
+        def execute_command(self, *args, **kwargs):
+            with redis_timer():
+                return super(InstrumentedRedisCluster, self).execute_command(
+                    *args, **kwargs)
+
+
+if aioredis is not None:
+    class InstrumentedAsyncRedis(aioredis.Redis):
+        """Async client recording every command like `InstrumentedRedis`."""
+        async def execute_command(self, *args, **options):
+            with redis_timer():
+                return await super(InstrumentedAsyncRedis, self)\
+                    .execute_command(*args, **options)
+
+
+def decode_object(val):
+    cls = type(val)
+    if cls is bytes:
+        return val.decode('utf-8')
+    elif cls is list or cls is tuple:
+        return [decode_value(x) for x in val]
+    elif cls is set:
+        return {decode_value(x) for x in val}
+    elif cls is dict:
+        return {decode_value(k): decode_value(v) for k, v in val.items()}
+    return val
+
+
+def decode_value(val):
+    if type(val) is bytes:
+        return val.decode('utf-8')
+    return decode_object(val) if type(val) in _CONTAINERS else val
+
+
+_CONTAINERS = (list, tuple, set, dict)
+
+
+def make_redis(settings, cls, read_only):
+    """Return a new client for `settings`, see `redis_connection`."""
+    topology = {k: settings.pop(k) for k in TOPOLOGY_SETTINGS if k in settings}
+    settings.setdefault('decode_responses', cls is DecodedRedis)
+    mode = topology.get('mode')
+    if mode == 'cluster':
+        if RedisCluster is None:
+            raise Exception("Redis Cluster requires redis-py 4.1 or newer.")
+        # Cluster nodes only have db 0.
+        settings.pop('db', None)
+        nodes = [ClusterNode(**node) for node in topology['startup_nodes']]
+        return InstrumentedRedisCluster(
+            startup_nodes=nodes,
+            read_from_replicas=topology.get('read_from_replicas', False),
+            **settings)
+    if mode == 'sentinel':
+        sentinel = Sentinel(
+            [tuple(address) for address in topology['sentinels']],
+            sentinel_kwargs=topology.get('sentinel_kwargs'), **settings)
+        connect = sentinel.slave_for if read_only else sentinel.master_for
+        return connect(topology['service_name'], redis_class=cls)
+    if mode is not None:
+        raise Exception("Unknown Redis mode: {}".format(mode))
+    if read_only and topology.get('replicas'):
+        settings.update(random.choice(topology['replicas']))
+    return cls(connection_pool=ConnectionPool(**settings))
@@ -0,0 +1,159 @@
+"""Log requests that take longer than a threshold.
+
+Enabled with the Architect's `slow_request_log` kwarg.  A slow request is
+logged to the `powernap.slow_requests` logger and kept in an in memory ring
+buffer that admins can read from the `/slow-requests` endpoint.  Each entry
+has the endpoint, the query args after :class:`QueryTransformer` normalized
+them, the SQL statements that ran, the row count, serialization time, and
+payload size.
+
+Settings:
+
+- `SLOW_REQUEST_THRESHOLD`: Seconds a request may take before it is logged.
+- `SLOW_REQUEST_LOG_SIZE`: Number of entries kept.
+- `SLOW_REQUESTS_PER_MINUTE`: Maximum number of entries logged per minute.
+- `SLOW_REQUEST_EXPLAIN`: Add the database's query plan of each SELECT.
+  Runs every SELECT again so it is ignored when the `ENV` setting is
+  "production" or unset.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import current_app, request
+
+from powernap.http_codes import success_code
+from powernap.instrumentation import current_metrics, init_request_metrics
+
+
+logger = logging.getLogger('powernap.slow_requests')
+
+
+def query_shape(query_args):
+    """Return `query_args` with filter values removed.
+
+    Requests that filter by the same fields have the same shape, which is
+    what decides the index a query needs.  `$order_by` values are kept.
+    """
+    return "&".join(
+        k if not k.startswith('$order_by') else "{}={}".format(k, v)
+        for k, v in sorted(query_args.items()))
+
+
+def explain(statement, parameters, conn):
+    """Return the query plan of a SELECT `statement` as a list of strings."""
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == 'sqlite' \
+        else "EXPLAIN "
+    try:
+        with conn.engine.connect() as explain_conn:
+            rows = explain_conn.exec_driver_sql(prefix + statement, parameters)
+            return [" ".join(str(col) for col in row) for row in rows]
+    except Exception as e:
+        return ["EXPLAIN failed: {}".format(e)]
+
+
+class SlowRequestLog(object):
+    """Ring buffer of slow requests, rate limited per minute."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = deque()
+        self.window = 0
+        self.window_count = 0
+
+    def start(self):
+        """Before request func: capture the SQL statements of the request."""
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.statements = []
+
+    def finish(self, response):
+        """After request func: record the request if it was slow."""
+        metrics = current_metrics()
+        config = current_app.config
+        if metrics is None or \
+                metrics.total < config.get('SLOW_REQUEST_THRESHOLD', 1.0):
+            return response
+        if self.allow(config.get('SLOW_REQUESTS_PER_MINUTE', 60)):
+            entry = self.entry(metrics, response)
+            self.add(entry, config.get('SLOW_REQUEST_LOG_SIZE', 100))
+            logger.warning(json.dumps(entry, sort_keys=True, default=str))
+        return response
+
+    def allow(self, per_minute):
+        window = int(time.time() // 60)
+        with self.lock:
+            if window != self.window:
+                self.window, self.window_count = window, 0
+            self.window_count += 1
+            return self.window_count <= per_minute
+
+    def add(self, entry, size):
+        with self.lock:
+            self.entries.append(entry)
+            while len(self.entries) > size:
+                self.entries.popleft()
+
+    def entry(self, metrics, response):
+        # Flask 2.3 dropped `app.env`, an unset `ENV` counts as production.
+        do_explain = current_app.config.get('SLOW_REQUEST_EXPLAIN', False) \
+            and current_app.config.get('ENV', 'production') != 'production'
+        query_args = metrics.notes.get('query_args')
+        sql_count, sql_time = metrics.sql_count, metrics.sql_time
+        # Stop capturing so the EXPLAIN queries are not logged themselves.
+        captured, metrics.statements = metrics.statements or [], None
+        statements = []
+        for statement, parameters, seconds, conn in captured:
+            sql = {
+                "statement": statement,
+                "parameters": parameters,
+                "duration": seconds,
+            }
+            if do_explain:
+                sql["explain"] = explain(statement, parameters, conn)
+            statements.append(sql)
+        return {
+            "timestamp": time.time(),
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration": metrics.total,
+            "model": metrics.notes.get('query_model'),
+            "query_args": query_args,
+            "query_shape": query_shape(query_args) if query_args else None,
+            "sql": statements,
+            "sql_count": sql_count,
+            "sql_time": sql_time,
+            "rows": metrics.notes.get('rows'),
+            "total_rows": metrics.notes.get('total'),
+            "serialize_time": metrics.stages.get('serialize'),
+            "payload_bytes": metrics.notes.get('payload_bytes'),
+        }
+
+    def api_response(self):
+        with self.lock:
+            return list(reversed(self.entries))
+
+    def init_app(self, app):
+        init_request_metrics(app)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+
+def register_slow_request_views(architect, log, url_prefix="/slow-requests",
+                                permission="powernap.slow_requests"):
+    """Route the admin only endpoint listing slow requests, newest first."""
+    bp = architect.admin_blueprint(
+        "powernap_slow_requests", url_prefix, permission,
+        "View slow API requests.")
+
+    @bp.route("", methods=["GET"])
+    def slow_requests():
+        return log.api_response(), success_code
+
+    return bp
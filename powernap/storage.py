@@ -0,0 +1,366 @@
+"""Storage backends for rate limits and tokens.
+
+The backend is chosen with the `STORAGE_BACKEND` setting, a path to a
+:class:`StorageBackend` subclass.  Defaults to :class:`RedisStorage`.
+
+- :class:`RedisStorage`: Redis, shared by every worker.
+- :class:`MemoryStorage`: A dict in the worker process.  For tests and
+  single process deployments.
+- :class:`SQLiteStorage`: A SQLite file at `STORAGE_SQLITE_PATH`, shared by
+  the workers on one host.
+
+Values are returned like Redis with decoded responses: `get` and hash
+values come back as strings.
+"""
+
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+from powernap.helpers import load_from_string, redis_connection
+
+
+def storage(db=None):
+    """Return the app's storage backend for Redis database `db`."""
+    backends = current_app.extensions.setdefault('powernap_storage', {})
+    if db not in backends:
+        path = current_app.config.get(
+            'STORAGE_BACKEND', 'powernap.storage.RedisStorage')
+        backends.setdefault(db, load_from_string(path)(db=db))
+    return backends[db]
+
+
+class StorageBackend(object):
+    """Counters with a TTL, hashes, and sets.
+
+    Implementations must be thread safe.  `hit` is called from the
+    pre-request thread pool without an app context.
+
+    :param db: The Redis database number.  Other backends ignore it.
+    """
+    def __init__(self, db=None):
+        self.db = db
+
+    def get(self, key):
+        """Return the string value of `key` or `None`."""
+        raise NotImplementedError
+
+    def counter(self, key):
+        """Return the int value of counter `key` or `None`."""
+        value = self.get(key)
+        return None if value is None else int(value)
+
+    def hit(self, key, expiration, amount=1):
+        """Add `amount` to counter `key`, return `(count, ttl)`.
+
+        A new counter expires in `expiration` seconds.
+        """
+        raise NotImplementedError
+
+    def ttl(self, key):
+        """Seconds until `key` expires, -1 without expiry, -2 if missing."""
+        raise NotImplementedError
+
+    def expire(self, key, seconds):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def hgetall(self, key):
+        """Return hash `key` as a dict, empty if missing."""
+        raise NotImplementedError
+
+    def hset(self, key, mapping):
+        raise NotImplementedError
+
+    def sadd(self, key, *members):
+        raise NotImplementedError
+
+    def srem(self, key, *members):
+        raise NotImplementedError
+
+    def smembers(self, key):
+        raise NotImplementedError
+
+
+class RedisStorage(StorageBackend):
+    """Stores everything in Redis, see the `REDIS` setting.
+
+    `get`, `ttl`, `hgetall`, and `smembers` go to a replica when the
+    `REDIS` setting has `read_from_replicas`.
+    """
+    def __init__(self, db=None):
+        super(RedisStorage, self).__init__(db)
+        self.redis = redis_connection(db)
+        self.replica = redis_connection(db, read_only=True)
+
+    def get(self, key):
+        return self.replica.get(key)
+
+    def counter(self, key):
+        from powernap.redis_clients import RAW_REPLY
+
+        # Read the raw bytes, int() parses them without decoding.
+        value = self.replica.execute_command('GET', key, **RAW_REPLY)
+        return None if value is None else int(value)
+
+    def hit(self, key, expiration, amount=1):
+        pipe = self.redis.pipeline()
+        pipe.set(key, 0, ex=expiration, nx=True)
+        pipe.incr(key, amount)
+        pipe.ttl(key)
+        _, count, ttl = pipe.execute()
+        return count, ttl
+
+    def ttl(self, key):
+        return self.replica.ttl(key)
+
+    def expire(self, key, seconds):
+        self.redis.expire(key, seconds)
+
+    def delete(self, key):
+        self.redis.delete(key)
+
+    def hgetall(self, key):
+        return self.replica.hgetall(key)
+
+    def hset(self, key, mapping):
+        pipe = self.redis.pipeline()
+        for field, value in mapping.items():
+            pipe.hset(key, field, value)
+        pipe.execute()
+
+    def sadd(self, key, *members):
+        self.redis.sadd(key, *members)
+
+    def srem(self, key, *members):
+        self.redis.srem(key, *members)
+
+    def smembers(self, key):
+        return self.replica.smembers(key)
+
+
+class MemoryStorage(StorageBackend):
+    """Stores everything in the worker process.
+
+    Expired keys are dropped lazily, oldest first, from a heap of expiry
+    times.
+    """
+    def __init__(self, db=None):
+        super(MemoryStorage, self).__init__(db)
+        self.lock = threading.RLock()
+        self.data = {}
+        self.expires = {}
+        self.heap = []
+
+    def _purge(self):
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            expires, key = heapq.heappop(self.heap)
+            if self.expires.get(key) == expires:
+                del self.expires[key]
+                self.data.pop(key, None)
+
+    def _value(self, key, default=None):
+        self._purge()
+        if key not in self.data and default is not None:
+            self.data[key] = default
+        return self.data.get(key)
+
+    def get(self, key):
+        with self.lock:
+            value = self._value(key)
+            return None if value is None else str(value)
+
+    def hit(self, key, expiration, amount=1):
+        with self.lock:
+            if self._value(key) is None:
+                self.data[key] = 0
+                self._expire(key, expiration)
+            self.data[key] = int(self.data[key]) + amount
+            return self.data[key], self.ttl(key)
+
+    def ttl(self, key):
+        with self.lock:
+            if self._value(key) is None:
+                return -2
+            if key not in self.expires:
+                return -1
+            return int(round(self.expires[key] - time.time()))
+
+    def _expire(self, key, seconds):
+        expires = time.time() + seconds
+        self.expires[key] = expires
+        heapq.heappush(self.heap, (expires, key))
+
+    def expire(self, key, seconds):
+        with self.lock:
+            if self._value(key) is not None:
+                self._expire(key, seconds)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def hgetall(self, key):
+        with self.lock:
+            return {k: str(v) for k, v in (self._value(key) or {}).items()}
+
+    def hset(self, key, mapping):
+        with self.lock:
+            self._value(key, {}).update(mapping)
+
+    def sadd(self, key, *members):
+        with self.lock:
+            self._value(key, set()).update(members)
+
+    def srem(self, key, *members):
+        with self.lock:
+            self._value(key, set()).difference_update(members)
+
+    def smembers(self, key):
+        with self.lock:
+            return set(self._value(key) or ())
+
+
+class SQLiteStorage(StorageBackend):
+    """Stores everything in the SQLite file `STORAGE_SQLITE_PATH`.
+
+    Values are kept as JSON in one table.  Writes take SQLite's write lock
+    so workers sharing the file see consistent counters, reads do not.
+    Expired keys read as missing and are deleted by the writes at most once
+    every `SWEEP_INTERVAL` seconds.
+    """
+    SWEEP_INTERVAL = 60
+
+    def __init__(self, db=None, path=None):
+        super(SQLiteStorage, self).__init__(db)
+        self.path = path or current_app.config['STORAGE_SQLITE_PATH']
+        self.local = threading.local()
+        self.swept = 0
+        with self.transaction(write=True) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS powernap_storage ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None)
+        return conn
+
+    @contextmanager
+    def transaction(self, write=False):
+        """Yield the connection in a transaction.
+
+        :param write: (bool): Take the write lock up front, for read, modify,
+            write updates.  Reads use a deferred transaction that does not
+            block other workers.
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield conn
+            if write:
+                self._sweep(conn)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _sweep(self, conn):
+        """Delete the expired keys if `SWEEP_INTERVAL` has passed."""
+        now = time.time()
+        if now - self.swept < self.SWEEP_INTERVAL:
+            return
+        self.swept = now
+        conn.execute(
+            "DELETE FROM powernap_storage WHERE expires <= ?", (now,))
+
+    def _load(self, conn, key):
+        """Return `(value, expires)` of `key`, `(None, None)` if missing or
+        expired.
+        """
+        row = conn.execute(
+            "SELECT value, expires FROM powernap_storage WHERE key = ?",
+            (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def _store(self, conn, key, value, expires):
+        conn.execute(
+            "INSERT OR REPLACE INTO powernap_storage (key, value, expires) "
+            "VALUES (?, ?, ?)", (key, json.dumps(value), expires))
+
+    @staticmethod
+    def _ttl(value, expires):
+        if value is None:
+            return -2
+        return -1 if expires is None else int(round(expires - time.time()))
+
+    def get(self, key):
+        with self.transaction() as conn:
+            value, _ = self._load(conn, key)
+        return None if value is None else str(value)
+
+    def hit(self, key, expiration, amount=1):
+        with self.transaction(write=True) as conn:
+            value, expires = self._load(conn, key)
+            if value is None:
+                value, expires = 0, time.time() + expiration
+            value += amount
+            self._store(conn, key, value, expires)
+        return value, self._ttl(value, expires)
+
+    def ttl(self, key):
+        with self.transaction() as conn:
+            return self._ttl(*self._load(conn, key))
+
+    def expire(self, key, seconds):
+        with self.transaction(write=True) as conn:
+            now = time.time()
+            conn.execute(
+                "UPDATE powernap_storage SET expires = ? WHERE key = ? AND "
+                "(expires IS NULL OR expires > ?)", (now + seconds, key, now))
+
+    def delete(self, key):
+        with self.transaction(write=True) as conn:
+            conn.execute("DELETE FROM powernap_storage WHERE key = ?", (key,))
+
+    def hgetall(self, key):
+        with self.transaction() as conn:
+            value, _ = self._load(conn, key)
+        return {k: str(v) for k, v in (value or {}).items()}
+
+    def hset(self, key, mapping):
+        with self.transaction(write=True) as conn:
+            value, expires = self._load(conn, key)
+            value = dict(value or {})
+            value.update(mapping)
+            self._store(conn, key, value, expires)
+
+    def _update_set(self, key, update):
+        with self.transaction(write=True) as conn:
+            value, expires = self._load(conn, key)
+            members = update(set(value or ()))
+            self._store(conn, key, sorted(members), expires)
+
+    def sadd(self, key, *members):
+        self._update_set(key, lambda s: s | set(members))
+
+    def srem(self, key, *members):
+        self._update_set(key, lambda s: s - set(members))
+
+    def smembers(self, key):
+        with self.transaction() as conn:
+            value, _ = self._load(conn, key)
+        return set(value or ())
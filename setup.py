@@ -33,10 +33,11 @@ if __name__ == '__main__':
             'graphene-sqlalchemy==2.0.0',
             'pytest==3.6.3',
         ],
+        python_requires='>=3.7',
         classifiers=[
             'Programming Language :: Python',
             'Intended Audience :: Developers',
             'Operating System :: OS Independent',
-            'Programming Language :: Python :: 3.5',
+            'Programming Language :: Python :: 3.7',
         ],
     )
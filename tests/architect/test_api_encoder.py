@@ -0,0 +1,108 @@
+import json
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer, String, event
+from powernap.architect.responses import APIEncoder
+from powernap.mixins import PowernapMixin
+from powernap.query.transformer import construct_query
+
+
+class Plain(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+
+    def api_response(self):
+        self.calls += 1
+        return {"name": self.name}
+
+
+class Excluding(Plain):
+    def api_response(self, exclude_properties=None):
+        return {"excluded": exclude_properties}
+
+
+class TestAPIEncoder(object):
+    """Creates a sample app with an in-memory database for the tests."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['PAGINATION_PAGE'] = 'page'
+    app.config['PAGINATION_PER_PAGE'] = 'per_page'
+    db = SQLAlchemy(app)
+
+    class Thing(PowernapMixin, db.Model):
+        api_response_columns = ("id", "name")
+        id = Column(Integer, primary_key=True)
+        name = Column(String(255))
+        secret = Column(String(255))
+
+    @pytest.fixture(autouse=True)
+    def things(self):
+        with self.app.app_context():
+            self.db.create_all()
+            self.db.session.add_all([
+                self.Thing(id=1, name="a", secret="x"),
+                self.Thing(id=2, name="b", secret="y"),
+            ])
+            self.db.session.commit()
+            yield
+            self.db.session.remove()
+            self.db.drop_all()
+
+    def encode(self, data, exclude_properties=None):
+        return json.loads(json.dumps(
+            data, cls=lambda *a, **kw: APIEncoder(exclude_properties, *a, **kw)))
+
+    def test_api_response_columns(self):
+        """Should serialize the columns of a list of instances in bulk."""
+        with self.app.app_context():
+            things = self.Thing.query.order_by(self.Thing.id).all()
+
+            assert self.encode(things) == [
+                {"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+            assert self.encode(things, ["name"]) == [{"id": 1}, {"id": 2}]
+            assert self.encode({"thing": things[0]}) == {
+                "thing": {"id": 1, "name": "a"}}
+
+    @patch('flask_login.utils._get_user')
+    def test_api_rows(self, current_user):
+        """Should select the api response columns without loading instances."""
+        current_user.return_value = current_user
+        with self.app.test_request_context('/?$order_by=id'):
+            statements = []
+            event.listen(self.db.engine, 'before_cursor_execute',
+                         lambda *args: statements.append(args[2]))
+            result = construct_query(self.Thing, api_rows=True)
+
+            assert result.items == [
+                {"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+            assert result.total == 2
+            assert not any("secret" in s for s in statements)
+
+    def test_api_response_signature(self):
+        """Should only pass the exclusions when `api_response` takes them."""
+        items = [Plain("a"), Plain("b")]
+
+        assert self.encode(items, ["x"]) == [{"name": "a"}, {"name": "b"}]
+        assert [item.calls for item in items] == [1, 1]
+        assert self.encode([Excluding("a")], ["x"]) == [{"excluded": ["x"]}]
+
+    def test_api_response_errors(self):
+        """Should not retry an `api_response` that raises a TypeError."""
+        class Broken(Plain):
+            def api_response(self, exclude_properties=None):
+                self.calls += 1
+                raise TypeError("broken")
+
+        item = Broken("a")
+        with pytest.raises(TypeError):
+            self.encode([item])
+        assert item.calls == 1
+
+    def test_mixed_lists(self):
+        """Should serialize lists of different classes one by one."""
+        assert self.encode([Plain("a"), Excluding("b"), 1], ["x"]) == [
+            {"name": "a"}, {"excluded": ["x"]}, 1]
@@ -0,0 +1,72 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, Mock, patch
+from flask import Flask
+from powernap.architect.blueprints import ResponseBlueprint, api_error
+from powernap.decorators import format_, login, permission, public, safe
+from powernap.exceptions import ApiError
+from powernap.helpers import async_redis_connection, run_async
+from powernap.http_codes import success_code
+
+
+app = Flask(__name__)
+app.config['AUTHENTICATED_REQUESTS_PER_HOUR'] = 1000
+app.config['REDIS'] = {'host': 'localhost'}
+app.config['STORAGE_BACKEND'] = 'powernap.storage.MemoryStorage'
+bp = ResponseBlueprint('items', [format_, safe, permission, login, public],
+                       permissions={'items': 'Items'}, import_name=__name__,
+                       url_prefix='/items')
+
+
+@bp.route('', methods=['GET'], public=True, permission='items')
+async def items():
+    values = await asyncio.gather(asyncio.sleep(0, 1), asyncio.sleep(0, 2))
+    return values, success_code
+
+
+app.register_blueprint(bp)
+app.register_error_handler(ApiError, api_error)
+
+
+class TestAsyncViews(object):
+    """Routes an `async def` view through the Powernap decorators."""
+
+    @patch('powernap.auth.rate_limit.async_redis_connection')
+    @patch('flask_login.utils._get_user')
+    def test_async_view(self, current_user, redis_connection):
+        """Should await the view and read rate limit headers asynchronously."""
+        current_user.return_value = Mock(is_admin=False, is_authenticated=True)
+        redis = redis_connection.return_value
+        redis.execute_command = AsyncMock(return_value=b'10')
+        redis.ttl = AsyncMock(return_value=60)
+
+        res = app.test_client().get('/items')
+
+        assert res.status_code == 200
+        assert json.loads(res.data) == [1, 2]
+        assert res.headers['X-RateLimit-Remaining'] == '990'
+        assert res.headers['X-RateLimit-Reset'] == '60'
+
+    @patch('flask_login.utils._get_user')
+    def test_async_view_checks_permission(self, current_user):
+        """Should run the permission decorator before awaiting the view."""
+        user = Mock(is_admin=False, is_authenticated=True)
+        user.has_permission.return_value = False
+        current_user.return_value = user
+
+        assert app.test_client().get('/items').status_code == 403
+
+
+def test_async_redis_pool_is_shared_per_loop():
+    """Should reuse one connection pool for every client of an event loop."""
+    async def pools():
+        return (async_redis_connection().connection_pool,
+                async_redis_connection().connection_pool)
+
+    with app.app_context(), \
+            patch.object(app, 'ensure_sync', create=True) as ensure_sync:
+        first, second = run_async(pools)()
+        third, _ = run_async(pools)()
+
+    assert first is second is third
+    ensure_sync.assert_not_called()
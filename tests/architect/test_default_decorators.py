@@ -0,0 +1,29 @@
+import sys
+import types
+import pytest
+from unittest.mock import patch
+from powernap.architect.blueprints import Architect
+
+
+def otp(func, otp=True):
+    return func
+
+
+class TestDefaultDecorators(object):
+    """Builds Architects with the default decorators."""
+
+    def test_otp(self):
+        """Should decorate every route with the app's otp decorator."""
+        modules = {name: types.ModuleType(name)
+                   for name in ("core", "core.otp", "core.otp.decorators")}
+        modules["core.otp.decorators"].otp = otp
+        with patch.dict(sys.modules, modules):
+            architect = Architect(user_loader="test_default_decorators.otp")
+
+        assert "otp" in architect.decorator_names
+
+    def test_missing_otp(self):
+        """Should refuse to start without the otp decorator."""
+        with patch.dict(sys.modules, {"core": None}):
+            with pytest.raises(ImportError):
+                Architect(user_loader="test_default_decorators.otp")
@@ -0,0 +1,118 @@
+import json
+import tempfile
+from unittest.mock import DEFAULT, patch
+from flask import Flask
+from flask_login import UserMixin
+from powernap.architect.blueprints import Architect
+from powernap.exceptions import InvalidFormError
+from powernap.http_codes import success_code
+from powernap.storage import MemoryStorage
+
+
+class User(UserMixin):
+    id = 1
+    is_admin = False
+
+
+class Admin(User):
+    is_admin = True
+
+
+loaded = []
+
+
+def load_user(token):
+    loaded.append(token)
+    return {"one": User(), "admin": Admin()}.get(token)
+
+
+app = Flask(__name__)
+app.config.update(DEBUG=False, RATE_LIMIT_EXPIRATION=3600,
+                  REQUESTS_PER_HOUR=100, AUTHENTICATED_REQUESTS_PER_HOUR=1000,
+                  STORAGE_BACKEND="powernap.storage.MemoryStorage",
+                  CORS_MAX_AGE=1200)
+architect = Architect(
+    user_loader="test_fast_paths.load_user", base_dir=tempfile.mkdtemp(),
+    prefix="/api/v{version}", decorators=[
+        "powernap.decorators.format_",
+        "powernap.decorators.safe",
+        "powernap.decorators.permission",
+        "powernap.decorators.login",
+        "powernap.decorators.public",
+    ])
+bp = architect.sub_blueprint("things", url_prefix="/things", public=True,
+                             import_name=__name__)
+
+
+@bp.route("", methods=["GET", "POST"])
+def things():
+    return [], success_code
+
+
+@bp.route("/invalid", methods=["GET"])
+def invalid():
+    raise InvalidFormError(description={"fields": {"name": ["Required"]}})
+
+
+architect.login_manager.request_loader(
+    lambda request: load_user(request.headers.get("X-Auth")))
+architect.init_app(app)
+
+
+class TestFastPaths(object):
+    """Counts the storage calls and user loads of a sample app's requests."""
+
+    def setup_method(self, method):
+        del loaded[:]
+
+    def storage_calls(self):
+        return patch.multiple(MemoryStorage, **{name: DEFAULT for name in (
+            "hit", "counter", "ttl", "get", "hgetall")})
+
+    def test_preflight(self):
+        """Should answer preflights without rate limiting or loading users."""
+        with self.storage_calls() as calls:
+            res = app.test_client().options('/api/v1/things', headers={
+                'Origin': 'https://example.com',
+                'Access-Control-Request-Method': 'POST',
+                'X-Auth': 'one'})
+
+        assert res.status_code == 200
+        assert res.headers['Access-Control-Allow-Origin'] == 'https://example.com'
+        assert res.headers['Access-Control-Max-Age'] == '1200'
+        assert "POST" in res.headers['Access-Control-Allow-Methods']
+        assert not any(call.called for call in calls.values())
+        assert loaded == []
+
+    def test_unknown_url(self):
+        """Should return 404s without storage calls."""
+        with self.storage_calls() as calls:
+            res = app.test_client().get('/wp-login.php',
+                                        headers={'X-Auth': 'one'})
+
+        assert res.status_code == 404
+        assert len(json.loads(res.data)['errors']) == 1
+        assert 'X-RateLimit-Limit' not in res.headers
+        assert not any(call.called for call in calls.values())
+
+    def test_admin_error_logged(self):
+        """Should log the errors of admins whether or not they were counted."""
+        with patch('logging.warning') as warning:
+            app.test_client().get('/wp-login.php', headers={'X-Auth': 'one'})
+            warning.assert_not_called()
+            app.test_client().get('/wp-login.php', headers={'X-Auth': 'admin'})
+
+        assert "Bad Admin Request to '/wp-login.php'" in \
+            warning.call_args[0][0]
+
+    def test_counted_error(self):
+        """Should reuse the request's rate limit count for the headers."""
+        with patch.object(MemoryStorage, 'counter') as counter:
+            res = app.test_client().get('/api/v1/things/invalid',
+                                        headers={'X-Auth': 'one'})
+
+        assert res.status_code == 400
+        assert json.loads(res.data) == {"fields": {"name": ["Required"]}}
+        assert res.headers['X-RateLimit-Limit'] == '1000'
+        assert int(res.headers['X-RateLimit-Remaining']) < 1000
+        counter.assert_not_called()
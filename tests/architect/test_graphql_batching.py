@@ -0,0 +1,108 @@
+import json
+import graphene
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from graphene_sqlalchemy import SQLAlchemyObjectType
+from sqlalchemy import Column, ForeignKey, Integer, event
+from sqlalchemy.orm import relationship
+from powernap.architect.graphql_views import PowernapGraphQLView
+
+
+app = Flask(__name__)
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+db = SQLAlchemy(app)
+sessions = []
+
+
+class UserModel(db.Model):
+    id = Column(Integer, primary_key=True)
+    devices = relationship("DeviceModel")
+
+
+class DeviceModel(db.Model):
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('user_model.id'))
+
+
+class User(SQLAlchemyObjectType):
+    class Meta:
+        model = UserModel
+
+
+class Device(SQLAlchemyObjectType):
+    class Meta:
+        model = DeviceModel
+
+
+class Query(graphene.ObjectType):
+    users = graphene.List(User)
+
+    def resolve_users(self, info):
+        return User.get_query(info).all()
+
+
+def session_func():
+    session = db.create_scoped_session()
+    sessions.append(session)
+    return session
+
+
+schema = graphene.Schema(query=Query)
+app.add_url_rule('/graphql', view_func=PowernapGraphQLView.as_view(
+    'graphql', schema=schema, session_func=session_func))
+app.add_url_rule('/graphql-unbatched', view_func=PowernapGraphQLView.as_view(
+    'graphql_unbatched', schema=schema, session_func=session_func,
+    batching=False))
+
+
+class TestGraphQLBatching(object):
+    """Uses a sample app with an in-memory database and schema."""
+
+    @pytest.fixture(autouse=True)
+    def database(self):
+        with app.app_context():
+            db.create_all()
+            for user_id in range(1, 11):
+                db.session.add(UserModel(id=user_id))
+                db.session.add(DeviceModel(user_id=user_id))
+                db.session.add(DeviceModel(user_id=user_id))
+            db.session.commit()
+            yield
+            db.session.remove()
+            db.drop_all()
+
+    def query(self, url):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        res = app.test_client().post(
+            url, data=json.dumps({'query': '{ users { id devices { id } } }'}),
+            content_type='application/json')
+        event.remove(db.engine, 'before_cursor_execute', listener)
+        return json.loads(res.data), statements
+
+    def test_nested_lists_use_constant_queries(self):
+        """Should load every user's devices without a query per user."""
+        data, statements = self.query('/graphql')
+
+        assert 'errors' not in data
+        assert len(data['data']['users']) == 10
+        assert all(len(u['devices']) == 2 for u in data['data']['users'])
+        assert len(statements) == 3
+
+    def test_unbatched_queries_per_parent(self):
+        """Should lazy load each user's devices when batching is off."""
+        data, statements = self.query('/graphql-unbatched')
+
+        assert len(statements) == 11
+
+    def test_session_per_request(self):
+        """Should create a new session for every request."""
+        del sessions[:]
+        self.query('/graphql')
+        self.query('/graphql')
+
+        assert len(sessions) == 2
+        assert sessions[0] is not sessions[1]
@@ -0,0 +1,106 @@
+import json
+import graphene
+from unittest.mock import patch
+from flask import Flask
+from powernap.architect.graphql_views import (
+    PowernapGraphQLBackend,
+    PowernapGraphQLView,
+    query_hash,
+)
+
+
+class Item(graphene.ObjectType):
+    id = graphene.Int()
+    children = graphene.List(lambda: Item)
+
+    def resolve_children(self, info):
+        return [Item(id=i) for i in range(3)]
+
+
+class Query(graphene.ObjectType):
+    items = graphene.List(Item)
+
+    def resolve_items(self, info):
+        return [Item(id=i) for i in range(3)]
+
+
+app = Flask(__name__)
+backend = PowernapGraphQLBackend(max_depth=3, max_complexity=150)
+app.add_url_rule('/graphql', view_func=PowernapGraphQLView.as_view(
+    'graphql', schema=graphene.Schema(query=Query), backend=backend))
+
+
+class TestGraphQLLimits(object):
+    """Uses a sample app with a limited graphql view."""
+
+    def post(self, body):
+        res = app.test_client().post(
+            '/graphql', data=json.dumps(body), content_type='application/json')
+        return res.status_code, json.loads(res.data)
+
+    def test_query_within_limits(self):
+        """Should execute a query under the depth and complexity limits."""
+        status, data = self.post({'query': '{ items { id children { id } } }'})
+
+        assert status == 200
+        assert len(data['data']['items']) == 3
+
+    def test_query_too_deep(self):
+        """Should reject a query nested deeper than max_depth."""
+        status, data = self.post(
+            {'query': '{ items { children { children { children { id } } } } }'})
+
+        assert status == 400
+        assert 'depth 4' in data['errors'][0]['message']
+
+    def test_query_too_complex(self):
+        """Should reject a query whose list fields multiply past the budget."""
+        status, data = self.post(
+            {'query': '{ items { id children { id children { id } } } }'})
+
+        assert status == 400
+        assert 'complexity' in data['errors'][0]['message']
+
+    def test_fragments_are_counted(self):
+        """Should follow fragment spreads when measuring depth."""
+        query = '''
+            { items { ...Deep } }
+            fragment Deep on Item { children { children { children { id } } } }
+        '''
+        status, data = self.post({'query': query})
+
+        assert status == 400
+
+    def test_documents_are_parsed_once(self):
+        """Should parse and validate a repeated query only once."""
+        query = '{ items { id } }'
+        with patch('powernap.architect.graphql_views.validate',
+                   return_value=[]) as validate:
+            self.post({'query': query})
+            self.post({'query': query})
+
+        assert validate.call_count <= 1
+
+    def test_persisted_query(self):
+        """Should register a query by hash and then execute it by hash alone."""
+        query = '{ items { children { id } } }'
+        extensions = {'persistedQuery': {'version': 1,
+                                         'sha256Hash': query_hash(query)}}
+        status, data = self.post({'extensions': extensions})
+        assert status == 400
+        assert data['errors'][0]['message'] == 'PersistedQueryNotFound'
+
+        status, _ = self.post({'query': query, 'extensions': extensions})
+        assert status == 200
+
+        status, data = self.post({'extensions': extensions})
+        assert status == 200
+        assert len(data['data']['items']) == 3
+
+    def test_persisted_query_hash_mismatch(self):
+        """Should refuse to store a query under the wrong hash."""
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': 'abc'}}
+        status, _ = self.post({'query': '{ items { id } }',
+                               'extensions': extensions})
+
+        assert status == 400
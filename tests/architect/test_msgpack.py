@@ -0,0 +1,99 @@
+import json
+import pytest
+from datetime import date, datetime
+from decimal import Decimal
+from unittest.mock import Mock, patch
+from flask import Flask, request
+from powernap.architect.requests import ApiRequest
+from powernap.architect.responses import ApiResponse
+from powernap.decorators import safe
+from powernap.encoding import unpack_ext
+from powernap.exceptions import InvalidJsonError
+
+msgpack = pytest.importorskip('msgpack')
+
+
+class Thing(object):
+    def __init__(self, id):
+        self.id = id
+
+    def api_response(self):
+        return {"id": self.id, "price": Decimal("1.10"),
+                "created": datetime(2020, 1, 2, 3, 4, 5)}
+
+
+class TestMsgpack(object):
+    """Creates a sample app using the Powernap request class."""
+    app = Flask(__name__)
+    app.request_class = ApiRequest
+
+    def respond(self, data, accept):
+        with self.app.test_request_context(headers={'Accept': accept}):
+            resp, _ = ApiResponse(data, 200).response
+            return resp
+
+    def test_response(self):
+        """Should pack the response when MessagePack is preferred."""
+        resp = self.respond([Thing(1), Thing(2)], 'application/msgpack')
+
+        assert resp.mimetype == 'application/msgpack'
+        data = msgpack.unpackb(resp.get_data(), ext_hook=unpack_ext)
+        assert data == [
+            {"id": i, "price": Decimal("1.10"),
+             "created": datetime(2020, 1, 2, 3, 4, 5)} for i in (1, 2)]
+
+    def test_ext_types(self):
+        """Should pack the types JSON turns into strings as ext types."""
+        resp = self.respond({"day": date(2020, 1, 2)}, 'application/msgpack')
+
+        raw = msgpack.unpackb(resp.get_data())
+        assert raw == {"day": msgpack.ExtType(3, b"2020-01-02")}
+
+    @pytest.mark.parametrize("accept", [
+        '*/*', 'application/json', 'application/msgpack;q=0.5, */*'])
+    def test_json(self, accept):
+        """Should respond with JSON unless MessagePack is preferred."""
+        resp = self.respond({"price": Decimal("1.5")}, accept)
+
+        assert resp.mimetype == 'application/json'
+        assert json.loads(resp.get_data()) == {"price": 1.5}
+
+    def test_request(self):
+        """Should read MessagePack bodies into `jsonform`."""
+        body = msgpack.packb({"name": "a", "price": msgpack.ExtType(1, b"2.5"),
+                              "tags": ["x"]})
+        with self.app.test_request_context(
+                method='POST', data=body, content_type='application/msgpack'):
+            assert request.jsonform.to_dict() == {
+                "name": "a", "price": "2.5", "tags": ["x"]}
+
+    @pytest.mark.parametrize("body", [b"\xc1", msgpack.packb([1, 2])])
+    def test_invalid_request(self, body):
+        """Should reject bodies that are not a packed map."""
+        with self.app.test_request_context(
+                method='POST', data=body, content_type='application/msgpack'):
+            with pytest.raises(InvalidJsonError):
+                request.jsonform
+
+    def test_admin_error_log(self):
+        """Should log the data of bad admin requests, not packed bytes."""
+        with patch('flask_login.utils._get_user') as current_user, \
+                patch('powernap.architect.responses.logging') as logging:
+            current_user.return_value.is_admin = True
+            with self.app.test_request_context(
+                    '/things', headers={'Accept': 'application/msgpack'}):
+                self.app.config['DEBUG'] = False
+                ApiResponse({"name": ["Required"]}, 400).response
+
+        logging.warning.assert_called_once_with(
+            "Bad Admin Request to '/things': {'name': ['Required']}")
+
+    def test_safe(self):
+        """Should sanitize packed responses."""
+        resp = self.respond({"name": "<script>evil();</script>",
+                             "price": Decimal("1")}, 'application/msgpack')
+        cleaned = safe(Mock(return_value=resp))()
+
+        data = msgpack.unpackb(cleaned.get_data(), ext_hook=unpack_ext)
+        assert data == {"name": "&lt;script&gt;evil();&lt;/script&gt;",
+                        "price": Decimal("1")}
@@ -0,0 +1,78 @@
+import threading
+import pytest
+from unittest.mock import Mock, patch
+from flask import Flask, g
+from flask_login import current_user as user_proxy
+from powernap.auth.rate_limit import RateLimiter, check_rate_limit
+from powernap.exceptions import RequestLimitError
+from powernap.storage import StorageBackend
+
+
+def items():
+    pass
+
+
+items.required_permission = 'items'
+
+
+class TestCheckRateLimit(object):
+    """Creates a sample app whose view requires a permission."""
+    app = Flask(__name__)
+    app.config.update(RATE_LIMIT_EXPIRATION=3600, REQUESTS_PER_HOUR=100,
+                      AUTHENTICATED_REQUESTS_PER_HOUR=1000)
+    app.add_url_rule('/items', 'items', items)
+
+    def request_context(self):
+        return self.app.test_request_context(
+            '/items', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+
+    def storage(self, requests):
+        backend = Mock(StorageBackend)
+        backend.hit.return_value = requests, 60
+        return backend
+
+    @patch('powernap.auth.rate_limit.storage')
+    @patch('flask_login.utils._get_user')
+    def test_one_round_trip(self, current_user, storage):
+        """Should count the request and reuse the count for the headers."""
+        current_user.return_value.is_admin = False
+        backend = storage.return_value = self.storage(10)
+
+        with self.request_context():
+            check_rate_limit()
+            headers = RateLimiter(user_proxy).headers()
+
+        backend.hit.assert_called_once()
+        backend.get.assert_not_called()
+        assert headers['X-RateLimit-Remaining'] == 990
+        assert headers['X-RateLimit-Reset'] == 60
+
+    @patch('powernap.auth.rate_limit.storage')
+    @patch('flask_login.utils._get_user')
+    def test_permission_overlaps_storage(self, current_user, storage):
+        """Should look up the permission while the storage call runs."""
+        user = current_user.return_value
+        user.is_admin = False
+        user.has_permission.return_value = True
+        backend = storage.return_value = self.storage(10)
+        threads = []
+        backend.hit.side_effect = lambda *args: \
+            threads.append(threading.get_ident()) or (10, 60)
+
+        with self.request_context():
+            check_rate_limit()
+            assert g._powernap_permissions == {'items': True}
+
+        user.has_permission.assert_called_once_with('items')
+        assert threads and threads[0] != threading.get_ident()
+
+    @patch('powernap.auth.rate_limit.storage')
+    @patch('flask_login.utils._get_user')
+    def test_over_limit(self, current_user, storage):
+        """Should raise a RequestLimitError over the limit."""
+        current_user.return_value.is_admin = True
+        storage.return_value = self.storage(1001)
+
+        with self.request_context():
+            with pytest.raises(RequestLimitError):
+                check_rate_limit()
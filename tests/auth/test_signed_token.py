@@ -0,0 +1,112 @@
+import time
+import pytest
+from unittest.mock import Mock, patch
+from flask import Flask
+from powernap.auth.token import (
+    TempToken, create_signed_token, create_temp_token, denylist,
+    user_from_redis_token_wrapper, verify_signed_token)
+from powernap.storage import storage
+
+
+class User(object):
+    id = 7
+
+
+class TestSignedToken(object):
+    """Creates a sample app with in-process storage for the tests."""
+    app = Flask(__name__)
+    app.config.update(STORAGE_BACKEND="powernap.storage.MemoryStorage",
+                      SECRET_KEY="secret", TOKEN_EXPIRE=60,
+                      active_tokens_attr="id", TOKEN_DENYLIST_REFRESH=30)
+
+    @pytest.fixture(autouse=True)
+    def context(self):
+        with self.app.app_context():
+            yield
+        self.app.extensions.clear()
+
+    @pytest.fixture(autouse=True)
+    def current_user(self):
+        with patch('flask_login.utils._get_user') as current_user:
+            current_user.return_value = User()
+            yield current_user
+
+    def test_verify(self):
+        """Should verify the token without reading storage."""
+        token = create_signed_token(User())
+        denylist().sync()
+
+        with patch.object(storage(), 'hgetall') as hgetall:
+            assert verify_signed_token(token) == {"id": "7"}
+            assert TempToken.retrieve(token).id == "7"
+        hgetall.assert_not_called()
+        assert storage().smembers("active:7") == {token}
+
+    def test_forged(self):
+        """Should refuse tokens with a bad signature or payload."""
+        token = create_signed_token(User())
+        payload, signature = token.split('.')[1:]
+
+        assert verify_signed_token(token[:-2]) is None
+        assert verify_signed_token('pn.{}.{}'.format(signature, payload)) \
+            is None
+        assert verify_signed_token('pn.garbage') is None
+        self.app.config['SECRET_KEY'] = "other"
+        try:
+            assert verify_signed_token(token) is None
+        finally:
+            self.app.config['SECRET_KEY'] = "secret"
+
+    def test_expired(self):
+        """Should refuse tokens after `TOKEN_EXPIRE` seconds."""
+        token = create_signed_token(User())
+
+        with patch('powernap.auth.token.time.time',
+                   return_value=time.time() + 61):
+            assert verify_signed_token(token) is None
+
+    def test_revoke(self):
+        """Should refuse deleted tokens in this and other workers."""
+        token, other = create_signed_token(User()), create_signed_token(User())
+        TempToken.delete(token)
+
+        assert verify_signed_token(token) is None
+        assert verify_signed_token(other) == {"id": "7"}
+        assert storage().smembers("active:7") == {other}
+
+        self.app.extensions.pop('powernap_denylist')
+        assert verify_signed_token(token) is None
+
+    def test_denylist_refresh(self):
+        """Should sync the revoked tokens every `TOKEN_DENYLIST_REFRESH`."""
+        token = create_signed_token(User())
+        assert verify_signed_token(token) == {"id": "7"}
+        # Another worker revokes the token.
+        TempToken.delete(token)
+        self.app.extensions['powernap_denylist'].revoked = frozenset()
+
+        assert verify_signed_token(token) == {"id": "7"}
+        with patch('powernap.auth.token.time.time',
+                   return_value=time.time() + 31):
+            assert verify_signed_token(token) is None
+
+    def test_denylist_prune(self):
+        """Should drop revoked tokens from storage once they expire."""
+        TempToken.delete(create_signed_token(User()))
+        assert len(storage().smembers("powernap:revoked")) == 1
+
+        with patch('powernap.auth.token.time.time',
+                   return_value=time.time() + 61):
+            denylist().sync()
+        assert storage().smembers("powernap:revoked") == set()
+
+    def test_user_loader(self):
+        """Should load users from signed and opaque tokens side by side."""
+        user_class = Mock()
+        load_user = user_from_redis_token_wrapper(user_class)
+
+        load_user(create_signed_token(User()))
+        load_user(create_temp_token(User()))
+
+        assert [c.args for c in user_class.query.get.call_args_list] == [
+            ("7",), ("7",)]
@@ -0,0 +1,206 @@
+import json
+import tempfile
+import threading
+from flask import Flask, Response, g, request
+from flask_login import UserMixin, current_user
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer
+from sqlalchemy.orm import object_session
+from powernap.architect.blueprints import Architect
+from powernap.http_codes import post_success_code, success_code
+from powernap.storage import storage
+
+
+class User(UserMixin):
+    is_admin = False
+
+    def __init__(self, id):
+        self.id = id
+
+
+db = SQLAlchemy()
+
+
+class Member(UserMixin, db.Model):
+    is_admin = False
+    id = Column(Integer, primary_key=True)
+
+
+def load_user(token):
+    if token == "member":
+        return Member.query.filter_by(id=1).one()
+    return User(1) if token == "user" else None
+
+
+loads = []
+threads = []
+hooks = []
+architect = Architect(
+    user_loader="test_batch.load_user", base_dir=tempfile.mkdtemp(),
+    prefix="/api/v{version}",
+    batch=True, decorators=[
+        "powernap.decorators.format_",
+        "powernap.decorators.safe",
+        "powernap.decorators.permission",
+        "powernap.decorators.login",
+        "powernap.decorators.public",
+    ])
+bp = architect.sub_blueprint("items", url_prefix="/items", public=True,
+                             import_name=__name__)
+
+
+@bp.route("", methods=["GET"])
+def items():
+    threads.append(threading.get_ident())
+    return {"page": request.args.get("page"), "user": current_user.id}, \
+        success_code
+
+
+@bp.route("/session", methods=["GET"])
+def session():
+    user = current_user._get_current_object()
+    return {"own": object_session(user) is db.session()}, success_code
+
+
+@bp.route("/mark", methods=["GET"])
+def mark():
+    seen = g.get("mark")
+    g.mark = request.args.get("value")
+    return {"seen": seen}, success_code
+
+
+@bp.route("/stream", methods=["GET"], **architect.raw_route_options)
+def stream():
+    def events():
+        while True:
+            yield ": keepalive\n\n"
+    return Response(events(), mimetype="text/event-stream")
+
+
+@bp.route("", methods=["POST"])
+def create_item():
+    return {"name": request.jsonform.get("name")}, post_success_code
+
+
+@architect.login_manager.request_loader
+def count_loads(request):
+    loads.append(request.path)
+    return load_user(request.headers.get("X-Auth"))
+
+
+app = Flask(__name__)
+app.config.update(DEBUG=False, SQLALCHEMY_DATABASE_URI="sqlite://",
+                  SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                  RATE_LIMIT_EXPIRATION=3600, REQUESTS_PER_HOUR=100,
+                  AUTHENTICATED_REQUESTS_PER_HOUR=1000,
+                  STORAGE_BACKEND="powernap.storage.MemoryStorage")
+db.init_app(app)
+architect.init_app(app)
+app.before_request(lambda: hooks.append(request.path))
+
+
+class TestBatch(object):
+    """Sample app with the batch endpoint, storing rate limits in memory."""
+
+    def setup_method(self, method):
+        loads.clear()
+        threads.clear()
+        hooks.clear()
+        app.extensions.pop('powernap_storage', None)
+        with app.app_context():
+            db.create_all()
+            db.session.add(Member(id=1))
+            db.session.commit()
+
+    def teardown_method(self, method):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def batch(self, requests, token='user', headers=None, **kwargs):
+        return app.test_client().post(
+            '/api/v1/batch', headers=dict(headers or {}, **{'X-Auth': token}),
+            data=json.dumps(dict(requests=requests, **kwargs)),
+            content_type='application/json')
+
+    def test_batch(self):
+        """Should return each response in order, authenticating once."""
+        res = self.batch([
+            {"method": "GET", "path": "/api/v1/items", "args": {"page": 2}},
+            {"method": "POST", "path": "/api/v1/items", "body": {"name": "a"}},
+            {"method": "GET", "path": "/api/v1/missing"},
+        ])
+
+        assert res.status_code == 200
+        assert json.loads(res.data) == [
+            {"status": 200, "body": {"page": "2", "user": 1}},
+            {"status": 201, "body": {"name": "a"}},
+            {"status": 404, "body": {"errors": [
+                "The requested URL was not found on the server. If you "
+                "entered the URL manually please check your spelling and "
+                "try again."]}},
+        ]
+        assert loads == ['/api/v1/batch']
+        assert hooks == ['/api/v1/batch', '/api/v1/items', '/api/v1/items',
+                         '/api/v1/missing']
+        with app.app_context():
+            assert list(storage(0).data.values()) == [3]
+
+    def test_concurrent_reads(self):
+        """Should run GET requests on worker threads."""
+        res = self.batch([{"method": "GET", "path": "/api/v1/items"}] * 3,
+                         concurrent=True)
+
+        assert [r["status"] for r in json.loads(res.data)] == [200] * 3
+        assert threading.get_ident() not in threads
+
+    def test_concurrent_model_user(self):
+        """Should give each worker thread the user in its own session."""
+        res = self.batch([{"method": "GET", "path": "/api/v1/items/session"}] * 3,
+                         token='member', concurrent=True)
+
+        assert json.loads(res.data) == [
+            {"status": 200, "body": {"own": True}}] * 3
+
+    def test_own_app_context(self):
+        """Should not share `g` between sub requests or with the batch."""
+        mark = {"method": "GET", "path": "/api/v1/items/mark",
+                "args": {"value": "a"}}
+        res = self.batch([mark, mark], token='member')
+
+        assert json.loads(res.data) == [
+            {"status": 200, "body": {"seen": None}}] * 2
+
+    def test_model_user_in_order(self):
+        """Should merge the user into the session of each sub request."""
+        res = self.batch([{"method": "GET", "path": "/api/v1/items"},
+                          {"method": "GET", "path": "/api/v1/items/session"}] * 2,
+                         token='member')
+
+        assert [r["status"] for r in json.loads(res.data)] == [200] * 4
+        assert json.loads(res.data)[1]["body"] == {"own": True}
+
+    def test_streamed_response(self):
+        """Should answer 400 instead of reading a streamed response."""
+        res = self.batch([{"method": "GET", "path": "/api/v1/items/stream"},
+                          {"method": "GET", "path": "/api/v1/items"}],
+                         concurrent=True)
+
+        assert [r["status"] for r in json.loads(res.data)] == [400, 200]
+
+    def test_msgpack_accept(self):
+        """Should embed JSON sub responses when the batch accepts msgpack."""
+        res = self.batch([{"method": "GET", "path": "/api/v1/items",
+                           "args": {"page": 2}}],
+                         headers={'Accept': 'application/msgpack'})
+
+        assert json.loads(res.data) == [
+            {"status": 200, "body": {"page": "2", "user": 1}}]
+
+    def test_invalid_batch(self):
+        """Should reject nested batches and too many requests."""
+        nested = self.batch([{"method": "POST", "path": "/api/v1/batch"}])
+        too_many = self.batch([{"path": "/api/v1/items"}] * 21)
+
+        assert nested.status_code == 400
+        assert too_many.status_code == 400
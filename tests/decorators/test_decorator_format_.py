@@ -7,12 +7,12 @@ from powernap.exceptions import RequestLimitError
 from powernap.decorators import format_
 
 
-@pytest.mark.usefixtures('mock_redis')
 class TestDecoratorFormat_(object):
-    """Patch redis_connection method to bypass it and setup a sample app for the tests."""
+    """Setup a sample app storing rate limits in memory for the tests."""
 
     app = Flask(__name__)
     app.config['AUTHENTICATED_REQUESTS_PER_HOUR'] = 1000
+    app.config['STORAGE_BACKEND'] = 'powernap.storage.MemoryStorage'
 
     @patch('powernap.architect.responses.ApiResponse')
     @patch('flask_login.utils._get_user')
@@ -1,6 +1,6 @@
 import bleach
 import json
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 from unittest.mock import Mock
 from powernap.decorators import safe
 
@@ -52,3 +52,11 @@ class TestDecoratorSafe(object):
         decorated_func = safe(func, safe=True)
 
         assert func.data == decorated_func()
+
+    def test_streamed_exports_are_not_read(self):
+        """Should leave responses that are not JSON alone."""
+        func = Mock()
+        func.return_value = Response(iter(["<b>a</b>\n"]), mimetype="text/csv")
+        decorated_func = safe(func)
+
+        assert decorated_func().is_streamed
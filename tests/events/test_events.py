@@ -0,0 +1,156 @@
+import json
+import tempfile
+from flask import Flask
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer, String
+from powernap.architect.blueprints import Architect
+from powernap.mixins import PowernapMixin, unit_of_work
+
+
+class User(UserMixin):
+    def __init__(self, id, is_admin=False):
+        self.id = id
+        self.is_admin = is_admin
+
+
+def load_user(token):
+    return {"one": User(1), "admin": User(9, is_admin=True)}.get(token)
+
+
+app = Flask(__name__)
+app.config.update(DEBUG=False, SQLALCHEMY_DATABASE_URI='sqlite://',
+                  SQLALCHEMY_TRACK_MODIFICATIONS=False, DB_ENTRY_ATTR='user_id',
+                  RATE_LIMIT_EXPIRATION=3600, REQUESTS_PER_HOUR=100,
+                  AUTHENTICATED_REQUESTS_PER_HOUR=1000,
+                  STORAGE_BACKEND="powernap.storage.MemoryStorage",
+                  EVENT_BROKER="powernap.events.MemoryBroker",
+                  EVENT_STREAM_HEARTBEAT=0.01)
+db = SQLAlchemy(app)
+
+
+class Thing(PowernapMixin, db.Model):
+    publish_events = True
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer)
+    name = Column(String(255))
+
+    def api_response(self):
+        return {"id": self.id, "name": self.name}
+
+
+architect = Architect(
+    user_loader="test_events.load_user", base_dir=tempfile.mkdtemp(),
+    prefix="/api/v{version}", decorators=[
+        "powernap.decorators.format_",
+        "powernap.decorators.safe",
+        "powernap.decorators.permission",
+        "powernap.decorators.login",
+        "powernap.decorators.public",
+    ])
+bp = architect.sub_blueprint("things", url_prefix="/things", public=True,
+                             import_name=__name__)
+bp.event_stream("/events", Thing)
+bp.event_stream("/open-events", Thing, login=False, endpoint="open_events")
+architect.login_manager.request_loader(
+    lambda request: load_user(request.headers.get("X-Auth")))
+architect.init_app(app)
+
+
+class TestEventStream(object):
+    """Streams the events of a sample app through the in-process broker."""
+
+    def setup_method(self, method):
+        with app.app_context():
+            db.create_all()
+
+    def teardown_method(self, method):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def stream(self, token):
+        res = app.test_client().get(
+            '/api/v1/things/events', headers={'X-Auth': token}, buffered=False)
+        assert res.status_code == 200
+        assert res.mimetype == 'text/event-stream'
+        events = iter(res.response)
+        assert next(events) == b": connected\n\n"
+        return res, events
+
+    def event(self, message):
+        kind, data = message.decode().strip().split("\n")
+        return kind[len("event: "):], json.loads(data[len("data: "):])
+
+    def test_owner_events(self):
+        """Should stream the changes to the user's rows once committed."""
+        res, events = self.stream("one")
+        with app.app_context():
+            thing = Thing.create(user_id=1, name="mine")
+            Thing.create(user_id=2, name="theirs")
+            thing.name = "renamed"
+            thing.save()
+            thing.delete()
+
+        assert self.event(next(events)) == (
+            "create", {"model": "thing", "data": {"id": 1, "name": "mine"}})
+        assert self.event(next(events))[0] == "update"
+        assert self.event(next(events)) == (
+            "delete", {"model": "thing", "data": {"id": 1}})
+        assert next(events) == b": keepalive\n\n"
+        res.close()
+
+    def test_admin_events(self):
+        """Should stream every row's changes to admins."""
+        res, events = self.stream("admin")
+        with app.app_context():
+            Thing.create(user_id=2, name="theirs")
+
+        assert self.event(next(events))[1]["data"]["name"] == "theirs"
+        res.close()
+
+    def test_sanitized(self):
+        """Should bleach the event data like other routes' responses."""
+        res, events = self.stream("admin")
+        with app.app_context():
+            Thing.create(user_id=2, name="<script>evil();</script>")
+
+        assert self.event(next(events))[1]["data"]["name"] == \
+            "&lt;script&gt;evil();&lt;/script&gt;"
+        res.close()
+
+    def test_unit_of_work(self):
+        """Should publish staged changes once, when the unit of work commits."""
+        res, events = self.stream("admin")
+        with app.test_request_context():
+            with unit_of_work():
+                thing = Thing.create(user_id=2, name="new")
+                thing.name = "renamed"
+                thing.save()
+                assert next(events) == b": keepalive\n\n"
+
+        assert self.event(next(events)) == (
+            "create", {"model": "thing", "data": {"id": 1, "name": "renamed"}})
+        assert self.event(next(events))[0] == "update"
+        res.close()
+
+    def test_rollback(self):
+        """Should not publish changes that were rolled back."""
+        res, events = self.stream("admin")
+        with app.app_context():
+            db.session.add(Thing(user_id=1, name="gone"))
+            db.session.flush()
+            db.session.rollback()
+
+        assert next(events) == b": keepalive\n\n"
+        res.close()
+
+    def test_login_required(self):
+        """Should require a user like other routes."""
+        res = app.test_client().get('/api/v1/things/events')
+        assert res.status_code == 401
+
+    def test_anonymous_owned_rows(self):
+        """Should not stream owned rows to users without an owner id."""
+        res = app.test_client().get('/api/v1/things/open-events')
+        assert res.status_code == 403
@@ -0,0 +1,129 @@
+import pytest
+import redis
+from unittest.mock import patch
+from flask import Flask
+from redis.crc import key_slot
+from powernap import helpers
+from powernap.auth.token import active_tokens_key, create_temp_token
+from powernap.helpers import DecodedRedis, decode_object, redis_connection
+from powernap.storage import RedisStorage
+
+
+class User(object):
+    id = 7
+
+
+class TestRedisConnection(object):
+    """Builds clients for each `REDIS` topology without connecting."""
+    app = Flask(__name__)
+
+    @pytest.fixture(autouse=True)
+    def clients(self):
+        helpers._clients.clear()
+        yield
+        helpers._clients.clear()
+
+    def connect(self, settings, **kwargs):
+        self.app.config['REDIS'] = settings
+        with self.app.app_context():
+            return redis_connection(**kwargs)
+
+    def test_single_node_replicas(self):
+        """Should send read only clients to a replica."""
+        settings = {"host": "primary", "replicas": [{"host": "replica"}],
+                    "read_from_replicas": True}
+        primary = self.connect(settings)
+        replica = self.connect(settings, read_only=True)
+
+        assert primary.connection_pool.connection_kwargs["host"] == "primary"
+        assert replica.connection_pool.connection_kwargs["host"] == "replica"
+        assert self.connect(settings) is primary
+
+    def test_parser_decodes(self):
+        """Should decode replies in the pool unless `DECODE_REDIS_BYTES` is off."""
+        decoded = self.connect({"host": "primary"})
+        self.app.config['DECODE_REDIS_BYTES'] = False
+        try:
+            raw = self.connect({"host": "primary"})
+        finally:
+            del self.app.config['DECODE_REDIS_BYTES']
+
+        assert decoded.connection_pool.connection_kwargs["decode_responses"]
+        assert decoded.pool_decodes
+        assert not raw.connection_pool.connection_kwargs["decode_responses"]
+
+    @patch('powernap.helpers.InstrumentedRedis.execute_command')
+    def test_decoded_redis(self, execute_command):
+        """Should only decode replies the pool did not decode."""
+        execute_command.return_value = [b"a", {b"b": b"1"}]
+        pool = helpers.ConnectionPool()
+
+        assert DecodedRedis(connection_pool=pool).get("a") == ["a", {"b": "1"}]
+        pool = helpers.ConnectionPool(decode_responses=True)
+        assert DecodedRedis(connection_pool=pool).get("a") == [b"a", {b"b": b"1"}]
+
+    def test_decode_object(self):
+        """Should decode nested replies and sets."""
+        assert decode_object({b"a", b"b"}) == {"a", "b"}
+        assert decode_object([1, (b"x", None)]) == [1, ["x", None]]
+
+    def test_raw_counter(self):
+        """Should read counters without decoding the reply."""
+        self.app.config['REDIS'] = {"host": "primary"}
+        with self.app.app_context():
+            backend = RedisStorage(db=0)
+        with patch.object(backend.replica, 'execute_command',
+                          return_value=b"5") as execute_command:
+            assert backend.counter("ip") == 5
+        execute_command.assert_called_once_with(
+            'GET', 'ip', **helpers.RAW_REPLY)
+        assert helpers.RAW_REPLY == {redis.client.NEVER_DECODE: True}
+
+    def test_replicas_are_opt_in(self):
+        """Should use the primary without `read_from_replicas`."""
+        settings = {"host": "primary", "replicas": [{"host": "replica"}]}
+        replica = self.connect(settings, read_only=True)
+
+        assert replica.connection_pool.connection_kwargs["host"] == "primary"
+
+    @patch('powernap.redis_clients.Sentinel')
+    def test_sentinel(self, sentinel):
+        """Should connect to the service's master and replicas."""
+        settings = {"mode": "sentinel", "sentinels": [["s1", 26379]],
+                    "service_name": "powernap", "read_from_replicas": True,
+                    "password": "secret"}
+        self.connect(settings)
+        self.connect(settings, read_only=True)
+
+        sentinel.assert_called_with([("s1", 26379)], sentinel_kwargs=None,
+                                    password="secret", decode_responses=True)
+        sentinel.return_value.master_for.assert_called_once_with(
+            "powernap", redis_class=helpers.DecodedRedis)
+        sentinel.return_value.slave_for.assert_called_once_with(
+            "powernap", redis_class=helpers.DecodedRedis)
+
+    @patch('powernap.redis_clients.InstrumentedRedisCluster')
+    def test_cluster(self, cluster):
+        """Should connect to the startup nodes, letting the cluster route reads."""
+        settings = {"mode": "cluster", "startup_nodes": [
+            {"host": "n1", "port": 7000}], "read_from_replicas": True}
+        client = self.connect(settings, db=0)
+
+        assert self.connect(settings, read_only=True) is client
+        kwargs = cluster.call_args[1]
+        assert [n.host for n in kwargs["startup_nodes"]] == ["n1"]
+        assert kwargs["read_from_replicas"] is True
+        assert "db" not in kwargs
+
+    def test_cluster_token_slots(self):
+        """Should keep a user's tokens and active set in one hash slot."""
+        self.app.config.update(
+            REDIS={"mode": "cluster"}, TOKEN_EXPIRE=60,
+            STORAGE_BACKEND="powernap.storage.MemoryStorage",
+            active_tokens_attr="id")
+        with self.app.app_context():
+            token = create_temp_token(User())
+            active = active_tokens_key(User())
+
+        assert token.startswith("{")
+        assert key_slot(token.encode()) == key_slot(active.encode())
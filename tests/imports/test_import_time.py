@@ -0,0 +1,54 @@
+import subprocess
+import sys
+import pytest
+
+
+# Imported by apps using powernap anyway, not counted.
+BASELINE = "import flask, flask_login, flask_sqlalchemy, sqlalchemy.orm"
+MARKER = "-- baseline --"
+
+# Optional subsystems imported on first use.
+LAZY = ("bleach", "flask_cors", "flask_graphql", "graphene", "graphql",
+        "pyarrow", "redis")
+
+# About 40 modules when this was written.  Raise the budget on purpose only.
+# Import time is not asserted, it depends on the machine and its load.
+MAX_MODULES = 50
+
+
+def import_times(statement):
+    """Return `{module: seconds}` of the modules `statement` imports after
+    the baseline, from `python -X importtime`.
+    """
+    code = "{}; import sys; sys.stderr.write({!r}); {}".format(
+        BASELINE, MARKER + "\n", statement)
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in stderr.split(MARKER, 1)[1].splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_us, _, module = line[len("import time:"):].split("|")
+            times[module.strip()] = int(self_us) / 10 ** 6
+    return times
+
+
+class TestImportTime(object):
+    """Imports powernap in a fresh interpreter for each test."""
+
+    @pytest.mark.parametrize("module", [
+        "powernap.architect.blueprints", "powernap.mixins",
+        "powernap.query.transformer", "powernap.storage"])
+    def test_optional_subsystems_are_lazy(self, module):
+        """Should not import optional subsystems with powernap."""
+        times = import_times("import " + module)
+
+        assert module in times
+        assert not [m for m in times if m.split(".")[0] in LAZY]
+
+    def test_import_cost(self):
+        """Should not import more modules than the budget."""
+        times = import_times(
+            "import powernap.architect.blueprints, powernap.mixins")
+
+        assert len(times) <= MAX_MODULES, sorted(times)
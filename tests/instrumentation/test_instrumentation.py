@@ -0,0 +1,70 @@
+from unittest.mock import Mock
+from flask import Flask
+from sqlalchemy import create_engine, text
+from powernap.instrumentation import (
+    MetricsSink,
+    current_metrics,
+    init_instrumentation,
+    redis_timer,
+    stage,
+)
+
+
+class TestInstrumentation(object):
+    """Creates a sample app with instrumentation and an in-memory database."""
+    app = Flask(__name__)
+    app.config['SERVER_TIMING'] = True
+    engine = create_engine('sqlite://')
+    sink = Mock(MetricsSink)
+    init_instrumentation(app, sink)
+
+    @app.route('/work')
+    def work():
+        with stage('outer'):
+            with stage('inner'):
+                with TestInstrumentation.engine.connect() as conn:
+                    conn.execute(text('SELECT 1'))
+                    conn.execute(text('SELECT 2'))
+            with redis_timer():
+                pass
+        return str(current_metrics().sql_count)
+
+    def test_server_timing_header(self):
+        """Should add stage, sql, and redis timings to the response."""
+        res = self.app.test_client().get('/work')
+        timing = res.headers['Server-Timing']
+
+        assert res.data == b'2'
+        assert 'outer;dur=' in timing
+        assert 'inner;dur=' in timing
+        assert 'sql;desc="2 queries"' in timing
+        assert 'redis;desc="1 commands"' in timing
+
+    def test_sink_receives_metrics(self):
+        """Should send counters and timings to the metrics sink."""
+        self.sink.reset_mock()
+        self.app.test_client().get('/work')
+        tags = {'endpoint': 'work', 'method': 'GET', 'status': 200}
+
+        self.sink.increment.assert_any_call('powernap.sql.count', 2, tags)
+        self.sink.increment.assert_any_call('powernap.redis.count', 1, tags)
+        names = [c[0][0] for c in self.sink.observe.call_args_list]
+        assert 'powernap.stage.inner' in names
+        assert 'powernap.request' in names
+
+    def test_stages_are_exclusive(self):
+        """Should not count a nested stage's time in its parent stage."""
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            metrics = current_metrics()
+            with stage('outer'):
+                with stage('inner'):
+                    sum(range(100000))
+
+            assert metrics.stages['outer'] < metrics.stages['inner']
+
+    def test_stage_without_instrumentation(self):
+        """Should be a no-op outside of an instrumented request."""
+        with stage('anything'):
+            pass
+        assert current_metrics() is None
@@ -0,0 +1,114 @@
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from flask_login import AnonymousUserMixin
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer, String, event
+from werkzeug.exceptions import NotFound
+from powernap.mixins import PowernapMixin
+
+
+class TestOwnerScopedFetch(object):
+    """Creates a sample app with an in-memory database for the tests."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_ENTRY_ATTR'] = 'user_id'
+    db = SQLAlchemy(app)
+
+    class Thing(PowernapMixin, db.Model):
+        id = Column(Integer, primary_key=True)
+        user_id = Column(Integer)
+        name = Column(String(255))
+
+    @pytest.fixture(autouse=True)
+    def things(self):
+        with self.app.app_context():
+            self.db.create_all()
+            self.db.session.add_all([
+                self.Thing(id=1, user_id=1, name="mine"),
+                self.Thing(id=2, user_id=2, name="theirs"),
+            ])
+            self.db.session.commit()
+            yield
+            self.db.session.remove()
+            self.db.drop_all()
+
+    def count_queries(self):
+        statements = []
+        event.listen(self.db.engine, 'before_cursor_execute',
+                     lambda *args: statements.append(args[2]))
+        return statements
+
+    @patch('flask_login.utils._get_user')
+    def test_owner_gets_instance(self, current_user):
+        """Should return the instance when the current_user owns it."""
+        with self.app.test_request_context():
+            current_user.id = 1
+            current_user.is_admin = False
+            current_user.return_value = current_user
+
+            assert self.Thing.get_owned_or_404(1).name == "mine"
+
+    @patch('flask_login.utils._get_user')
+    def test_non_owner_gets_404_in_one_query(self, current_user):
+        """Should raise a 404 with a single query when the user is not the owner."""
+        with self.app.test_request_context():
+            current_user.id = 1
+            current_user.is_admin = False
+            current_user.return_value = current_user
+            statements = self.count_queries()
+
+            with pytest.raises(NotFound):
+                self.Thing.get_owned_or_404(2)
+            assert len(statements) == 1
+            assert "user_id" in statements[0]
+
+    @patch('flask_login.utils._get_user')
+    def test_admin_is_not_scoped(self, current_user):
+        """Should return any instance to an admin."""
+        with self.app.test_request_context():
+            current_user.id = 1
+            current_user.is_admin = True
+            current_user.return_value = current_user
+
+            assert self.Thing.get_owned_or_404(2).name == "theirs"
+
+    @patch('flask_login.utils._get_user')
+    def test_safe_delete_is_scoped(self, current_user):
+        """Should not delete an instance the user does not own."""
+        with self.app.test_request_context():
+            current_user.id = 1
+            current_user.is_admin = False
+            current_user.return_value = current_user
+
+            with pytest.raises(NotFound):
+                self.Thing.safe_delete(2)
+            assert self.Thing.safe_delete(1)
+            assert self.Thing.query.count() == 1
+
+    @patch('flask_login.utils._get_user')
+    def test_anonymous_gets_404(self, current_user):
+        """Should not match any row for users without an id."""
+        with self.app.test_request_context():
+            current_user.return_value = AnonymousUserMixin()
+
+            with pytest.raises(NotFound):
+                self.Thing.get_owned_or_404(1)
+            with pytest.raises(NotFound):
+                self.Thing.safe_delete(1)
+            assert self.Thing.query.count() == 2
+
+    @patch('flask_login.utils._get_user')
+    def test_admin_writes_are_scoped(self, current_user):
+        """Should only let admins update or delete their own rows."""
+        with self.app.test_request_context():
+            current_user.id = 1
+            current_user.is_admin = True
+            current_user.return_value = current_user
+
+            with pytest.raises(NotFound):
+                self.Thing.get_owned_or_404(2, write=True)
+            with pytest.raises(NotFound):
+                self.Thing.safe_delete(2)
+            assert self.Thing.get_owned_or_404(1, write=True).name == "mine"
@@ -0,0 +1,197 @@
+import json
+import tempfile
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from flask_login import UserMixin
+from flask_sqlalchemy import BaseQuery, SQLAlchemy
+from sqlalchemy import (
+    Column, ForeignKey, Integer, String, UniqueConstraint, event)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship
+from powernap.architect.blueprints import Architect
+from powernap.mixins import PowernapFormMixin, PowernapMixin, unit_of_work
+
+
+class TestUnitOfWork(object):
+    """Creates a sample app with an in-memory database for the tests."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db = SQLAlchemy(app)
+
+    class Tag(PowernapMixin, db.Model):
+        __table_args__ = (UniqueConstraint('name'),)
+        id = Column(Integer, primary_key=True)
+        name = Column(String(255))
+
+    class Label(PowernapMixin, db.Model):
+        id = Column(Integer, primary_key=True)
+        tag_id = Column(Integer, ForeignKey('tag.id'))
+        tag = relationship('Tag')
+
+    @pytest.fixture(autouse=True)
+    def database(self):
+        with self.app.app_context():
+            self.db.create_all()
+            yield
+            self.db.session.remove()
+            self.db.drop_all()
+
+    def commits(self):
+        calls = []
+        event.listen(self.db.session(), 'after_commit', calls.append)
+        return calls
+
+    def test_creates_are_committed_once(self):
+        """Should commit all staged creates in a single commit."""
+        with self.app.test_request_context():
+            calls = self.commits()
+            with unit_of_work():
+                self.Tag.create(name="one")
+                self.Tag.create(name="two")
+                assert not calls
+            assert len(calls) == 1
+            assert self.Tag.query.count() == 2
+
+    def test_error_rolls_back(self):
+        """Should discard staged objects when the block raises."""
+        with self.app.test_request_context():
+            with pytest.raises(RuntimeError):
+                with unit_of_work():
+                    self.Tag.create(name="one")
+                    raise RuntimeError
+            assert self.Tag.query.count() == 0
+
+    def test_get_or_create(self):
+        """Should create the instance once and then return it."""
+        with self.app.test_request_context():
+            tag, created = self.Tag.get_or_create(name="one")
+            assert created and tag.id
+            same, created = self.Tag.get_or_create(name="one")
+            assert not created and same.id == tag.id
+
+    def test_get_or_create_on_conflict(self):
+        """Should return the existing row when a concurrent insert won."""
+        with self.app.test_request_context():
+            self.Tag.create(name="one")
+            with patch.object(BaseQuery, 'first', return_value=None):
+                tag, created = self.Tag.get_or_create(name="one")
+            assert not created and tag.name == "one"
+            assert self.Tag.query.count() == 1
+
+    def test_get_or_create_relationship(self):
+        """Should create with relationship kwargs through the ORM."""
+        with self.app.test_request_context():
+            tag = self.Tag.create(name="one")
+            label, created = self.Label.get_or_create(tag=tag)
+            assert created and label.tag_id == tag.id
+            same, created = self.Label.get_or_create(tag=tag)
+            assert not created and same.id == label.id
+
+    def test_failed_write_aborts(self):
+        """Should abort the unit of work when one of its writes fails."""
+        with self.app.test_request_context():
+            with pytest.raises(IntegrityError):
+                with unit_of_work():
+                    self.Tag.create(name="a")
+                    self.Tag.create(name="a")
+                    self.Tag.create(name="c")
+            assert self.Tag.query.count() == 0
+            assert self.Tag.create(name="a").id
+
+    def test_create_sets_id(self):
+        """Should flush staged creates so their ids are set."""
+        with self.app.test_request_context():
+            with unit_of_work():
+                tag = self.Tag.create(name="one")
+                assert tag.id is not None
+                same, created = self.Tag.get_or_create(name="one")
+                assert not created and same.id == tag.id
+
+
+
+class User(UserMixin):
+    id = 1
+    is_admin = False
+
+
+def load_user(token):
+    return User()
+
+
+db = SQLAlchemy()
+
+
+class Note(PowernapMixin, db.Model):
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer)
+    text = Column(String(255))
+
+    def api_response(self):
+        return {"id": self.id, "text": self.text}
+
+
+class NoteForm(PowernapFormMixin):
+    model = Note
+
+    def __init__(self, formdata):
+        self.data = {"text": formdata.get("text")}
+        self.errors = {}
+
+    def validate(self):
+        return True
+
+    def populate_obj(self, obj):
+        obj.text = self.data["text"]
+
+
+app = Flask(__name__)
+app.config.update(SQLALCHEMY_DATABASE_URI="sqlite://",
+                  SQLALCHEMY_TRACK_MODIFICATIONS=False, DEBUG=False,
+                  DB_ENTRY_ATTR="user_id", RATE_LIMIT_EXPIRATION=3600,
+                  REQUESTS_PER_HOUR=100, AUTHENTICATED_REQUESTS_PER_HOUR=100,
+                  STORAGE_BACKEND="powernap.storage.MemoryStorage")
+db.init_app(app)
+architect = Architect(
+    user_loader="test_mixin_unit_of_work.load_user",
+    base_dir=tempfile.mkdtemp(), prefix="/api/v{version}", decorators=[
+        "powernap.decorators.format_",
+        "powernap.decorators.safe",
+        "powernap.decorators.permission",
+        "powernap.decorators.login",
+        "powernap.decorators.public",
+    ],
+    before_request_funcs=[
+        "powernap.auth.rate_limit.check_rate_limit",
+        "powernap.mixins.begin_unit_of_work",
+    ],
+    after_request_funcs=["powernap.mixins.end_unit_of_work"])
+bp = architect.sub_blueprint("notes", url_prefix="/notes", public=True,
+                             import_name=__name__)
+bp.crudify("", Note, NoteForm)
+architect.login_manager.request_loader(lambda request: User())
+architect.init_app(app)
+
+
+class TestRequestUnitOfWork(object):
+    """Creates through crudify with a unit of work around each request."""
+
+    @pytest.fixture(autouse=True)
+    def database(self):
+        with app.app_context():
+            db.create_all()
+            yield
+            db.session.remove()
+            db.drop_all()
+
+    def test_post_returns_id(self):
+        """Should respond with the id of the staged create."""
+        res = app.test_client().post(
+            '/api/v1/notes', data=json.dumps({"text": "hi"}),
+            content_type='application/json')
+
+        assert res.status_code == 201
+        body = json.loads(res.data)
+        assert body["id"] is not None
+        assert Note.query.filter_by(id=body["id"]).one().text == "hi"
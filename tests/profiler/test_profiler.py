@@ -0,0 +1,66 @@
+import marshal
+import threading
+import time
+from flask import Flask
+from powernap.profiler import RequestProfiler, StackSampler
+
+
+def busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestStackSampler(object):
+    def test_samples_other_threads(self):
+        """Should collect collapsed stacks of running threads."""
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_worker, args=(stop,))
+        thread.start()
+        try:
+            sampler = StackSampler(interval=0.001)
+            sampler.sample(0.05)
+        finally:
+            stop.set()
+            thread.join()
+
+        collapsed = sampler.collapsed()
+        assert "busy_worker (test_profiler.py:" in collapsed
+        assert all(line.rsplit(" ", 1)[1].isdigit()
+                   for line in collapsed.splitlines())
+
+
+class TestRequestProfiler(object):
+    """Creates a sample app with the request profiler installed."""
+    app = Flask(__name__)
+    profiler = RequestProfiler()
+    profiler.init_app(app)
+
+    @app.route('/slow')
+    def slow():
+        time.sleep(0.001)
+        return 'slow'
+
+    @app.route('/other')
+    def other():
+        return 'other'
+
+    def test_profiles_next_requests_to_endpoint(self):
+        """Should only profile the armed endpoint, count times."""
+        self.profiler.arm('slow', 2)
+        client = self.app.test_client()
+        for url in ('/other', '/slow', '/slow', '/slow'):
+            client.get(url)
+
+        assert self.profiler.status() == {
+            "endpoint": "slow", "remaining": 0, "captured": 2}
+        stats = marshal.loads(self.profiler.dump())
+        assert any(func[2] == 'slow' for func in stats)
+        assert not any(func[2] == 'other' for func in stats)
+
+    def test_idle_profiler_does_nothing(self):
+        """Should not profile when nothing is armed."""
+        self.profiler.arm(None, 0)
+        self.app.test_client().get('/slow')
+
+        assert self.profiler.status()["captured"] == 0
+        assert marshal.loads(self.profiler.dump()) == {}
@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer, String
+from powernap.exceptions import InvalidFormError
+from powernap.mixins import PowernapMixin
+from powernap.query.transformer import construct_query
+
+
+class TestAggregate(object):
+    """Creates a sample app with an in-memory database for the tests."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['PAGINATION_PAGE'] = 'page'
+    app.config['PAGINATION_PER_PAGE'] = 'per_page'
+    app.config['DB_ENTRY_ATTR'] = 'user_id'
+    db = SQLAlchemy(app)
+
+    class Payment(PowernapMixin, db.Model):
+        exposed_fields = ["id", "user_id", "status", "amount"]
+        id = Column(Integer, primary_key=True)
+        user_id = Column(Integer)
+        status = Column(String(255))
+        amount = Column(Integer)
+        secret = Column(Integer)
+
+    @pytest.fixture(autouse=True)
+    def payments(self):
+        with self.app.app_context():
+            self.db.create_all()
+            self.db.session.add_all([
+                self.Payment(user_id=1, status="paid", amount=10),
+                self.Payment(user_id=1, status="paid", amount=30),
+                self.Payment(user_id=1, status="open", amount=5),
+                self.Payment(user_id=2, status="paid", amount=1000),
+            ])
+            self.db.session.commit()
+            yield
+            self.db.session.remove()
+            self.db.drop_all()
+
+    @pytest.fixture(autouse=True)
+    def current_user(self):
+        with patch('flask_login.utils._get_user') as current_user:
+            current_user.id = 1
+            current_user.is_admin = False
+            current_user.return_value = current_user
+            yield current_user
+
+    def query(self, args):
+        with self.app.test_request_context('/', query_string=args):
+            return construct_query(self.Payment)
+
+    def test_group_by(self):
+        """Should return the aggregates of each group of the user's rows."""
+        result = self.query({"$aggregate": "count,sum:amount,max:amount",
+                             "$group_by": "status"})
+
+        assert result.items == [
+            {"status": "open", "count": 1, "sum_amount": 5, "max_amount": 5},
+            {"status": "paid", "count": 2, "sum_amount": 40,
+             "max_amount": 30},
+        ]
+        assert result.total == 2
+
+    def test_aggregate_without_groups(self):
+        """Should return a single row for filtered queries."""
+        result = self.query({"$aggregate": "count,avg:amount",
+                             "status": "paid"})
+
+        assert result.items == [{"count": 2, "avg_amount": 20.0}]
+
+    def test_group_by_counts(self):
+        """Should count each group when no aggregate is given."""
+        result = self.query({"$group_by": "status"})
+
+        assert result.items == [{"status": "open", "count": 1},
+                                {"status": "paid", "count": 2}]
+
+    def test_order_by(self):
+        """Should order groups by aggregates and grouped fields."""
+        by_sum = self.query({"$aggregate": "sum:amount", "$group_by": "status",
+                             "$order_by": "-sum_amount"})
+        by_status = self.query({"$group_by": "status", "$order_by": "-status"})
+
+        assert [row["status"] for row in by_sum.items] == ["paid", "open"]
+        assert [row["status"] for row in by_status.items] == ["paid", "open"]
+
+    @pytest.mark.parametrize("args", [
+        {"$aggregate": "sum:secret"},
+        {"$aggregate": "count", "$group_by": "status", "$order_by": "amount"},
+        {"$aggregate": "count,sum:amount,count"},
+        {"$group_by": "status,status"},
+        {"$aggregate": "count", "$group_by": "secret"},
+        {"$aggregate": "median:amount"},
+        {"$aggregate": "sum"},
+    ])
+    def test_invalid_aggregates(self, args):
+        """Should only aggregate exposed fields with known functions."""
+        with pytest.raises(InvalidFormError):
+            self.query(args)
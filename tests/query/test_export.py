@@ -0,0 +1,140 @@
+import csv
+import io
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import patch
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, DateTime, Integer, Numeric, String
+from powernap.architect.responses import ApiResponse
+from powernap.exceptions import InvalidFormError
+from powernap.mixins import PowernapMixin
+from powernap.query.export import ExportResult
+from powernap.query.transformer import construct_query
+
+
+class TestExport(object):
+    """Creates a sample app with an in-memory database for the tests."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['PAGINATION_PAGE'] = 'page'
+    app.config['PAGINATION_PER_PAGE'] = 'per_page'
+    app.config['DB_ENTRY_ATTR'] = 'user_id'
+    app.config['EXPORT_CHUNK_SIZE'] = 2
+    db = SQLAlchemy(app)
+
+    class Order(PowernapMixin, db.Model):
+        exposed_fields = ["id", "user_id", "name", "total", "created"]
+        id = Column(Integer, primary_key=True)
+        user_id = Column(Integer)
+        name = Column(String(255))
+        total = Column(Numeric(10, 2))
+        created = Column(DateTime)
+        secret = Column(String(255))
+
+    @pytest.fixture(autouse=True)
+    def orders(self):
+        with self.app.app_context():
+            self.db.create_all()
+            self.db.session.add_all([
+                self.Order(id=id, user_id=user_id, name=name,
+                           total=Decimal(total), secret="x",
+                           created=datetime(2020, 1, id))
+                for id, user_id, name, total in [
+                    (1, 1, "a", "1.50"), (2, 1, "b, c", "2.25"),
+                    (3, 1, None, "3"), (4, 2, "d", "4")]])
+            self.db.session.commit()
+            yield
+            self.db.session.remove()
+            self.db.drop_all()
+
+    @pytest.fixture(autouse=True)
+    def current_user(self):
+        with patch('flask_login.utils._get_user') as current_user:
+            current_user.id = 1
+            current_user.is_admin = False
+            current_user.return_value = current_user
+            yield current_user
+
+    def export(self, accept, args=None):
+        with self.app.test_request_context(
+                '/', query_string=args or {}, headers={'Accept': accept}):
+            result = construct_query(self.Order, export=True)
+            if not isinstance(result, ExportResult):
+                return result
+            resp, _ = ApiResponse(result, 200).response
+            return resp.mimetype, resp.get_data()
+
+    def test_csv(self):
+        """Should stream the user's rows as CSV."""
+        mimetype, body = self.export('text/csv', {"$order_by": "id"})
+
+        assert mimetype == 'text/csv'
+        assert list(csv.reader(io.StringIO(body.decode()))) == [
+            ["id", "user_id", "name", "total", "created"],
+            ["1", "1", "a", "1.50", "2020-01-01 00:00:00"],
+            ["2", "1", "b, c", "2.25", "2020-01-02 00:00:00"],
+            ["3", "1", "", "3.00", "2020-01-03 00:00:00"],
+        ]
+
+    def test_arrow(self):
+        """Should stream record batches of the selected fields."""
+        pyarrow = pytest.importorskip('pyarrow')
+        mimetype, body = self.export(
+            'application/vnd.apache.arrow.stream',
+            {"$fields": "id,total,created", "$order_by": "id"})
+
+        reader = pyarrow.ipc.open_stream(body)
+        batches = list(reader)
+        assert mimetype == 'application/vnd.apache.arrow.stream'
+        assert [batch.num_rows for batch in batches] == [2, 1]
+        assert reader.schema.types == [
+            pyarrow.int64(), pyarrow.float64(), pyarrow.timestamp('us')]
+        assert pyarrow.Table.from_batches(batches).to_pydict() == {
+            "id": [1, 2, 3],
+            "total": [1.5, 2.25, 3.0],
+            "created": [datetime(2020, 1, i) for i in (1, 2, 3)],
+        }
+
+    def test_page(self):
+        """Should only export the requested page."""
+        _, body = self.export('text/csv', {
+            "$fields": "id", "$order_by": "id", "$page": 2, "$per_page": 2})
+
+        assert body.decode().split() == ["id", "3"]
+
+    @pytest.mark.parametrize("page, per_page", [(0, 2), (-1, 2), (1, -2)])
+    def test_invalid_page(self, page, per_page):
+        """Should reject pages under 1 before streaming."""
+        with pytest.raises(InvalidFormError):
+            self.export('text/csv', {"$page": page, "$per_page": per_page})
+
+    def test_csv_formulas(self):
+        """Should neutralize cells a spreadsheet would evaluate."""
+        with self.app.app_context():
+            self.db.session.add_all([
+                self.Order(id=5, user_id=1, name="=HYPERLINK(\"x\")"),
+                self.Order(id=6, user_id=1, name="@SUM(A1)"),
+                self.Order(id=7, user_id=1, name="-1+2")])
+            self.db.session.commit()
+        _, body = self.export('text/csv', {"$fields": "id,name",
+                                           "$order_by": "id"})
+
+        assert list(csv.reader(io.StringIO(body.decode())))[4:] == [
+            ["5", "'=HYPERLINK(\"x\")"], ["6", "'@SUM(A1)"], ["7", "'-1+2"]]
+
+    def test_json(self):
+        """Should return a page of JSON unless an export is preferred."""
+        for accept in ('application/json', '*/*', 'application/msgpack',
+                       'text/csv;q=0.5, application/json'):
+            result = self.export(accept)
+            assert not isinstance(result, tuple)
+            assert result.total == 3
+
+    @pytest.mark.parametrize("fields", ["secret", "id,nope", ""])
+    def test_invalid_fields(self, fields):
+        """Should only export exposed columns."""
+        with pytest.raises(InvalidFormError):
+            self.export('text/csv', {"$fields": fields})
@@ -0,0 +1,147 @@
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Index, Integer, String, event, func
+from sqlalchemy.dialects import postgresql
+from powernap.exceptions import InvalidFormError
+from powernap.mixins import PowernapMixin
+from powernap.query import methods
+
+
+class TestQueryMethods(object):
+    """Creates a sample app with an in-memory database for the tests."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db = SQLAlchemy(app)
+
+    class Post(PowernapMixin, db.Model):
+        searchable_fields = ["body"]
+        id = Column(Integer, primary_key=True)
+        title = Column(String(255), index=True)
+        slug = Column(String(255))
+        body = Column(String(255))
+
+    Index('ix_post_slug_lower', func.lower(Post.slug))
+
+    @pytest.fixture(autouse=True)
+    def posts(self):
+        with self.app.app_context():
+            self.db.create_all()
+            self.db.session.execute(
+                "CREATE VIRTUAL TABLE post_fts USING fts5(body)")
+            for id, title, body in [(1, "Hello world", "fast indexes"),
+                                    (2, "hello_there", "slow scans"),
+                                    (3, "50% off", "indexes are fast")]:
+                self.db.session.add(self.Post(
+                    id=id, title=title, slug=title.lower(), body=body))
+                self.db.session.execute(
+                    "INSERT INTO post_fts (rowid, body) VALUES (:id, :body)",
+                    {"id": id, "body": body})
+            self.db.session.commit()
+            yield
+            self.db.session.remove()
+            self.db.drop_all()
+            self.db.session.execute("DROP TABLE post_fts")
+
+    def ids(self, method, column, value):
+        query = self.Post.query.order_by(self.Post.id)
+        return [p.id for p in method(self.Post, query, column, value)]
+
+    def test_startswith(self):
+        """Should match a prefix with the wildcards escaped."""
+        with self.app.app_context():
+            assert self.ids(methods.startswith, "title", "hello") == [1, 2]
+            assert self.ids(methods.startswith, "title", "hello_") == [2]
+            assert self.ids(methods.startswith, "title", "50%") == [3]
+            assert self.ids(methods.startswith, "title", "%") == []
+
+    def test_startswith_sql(self):
+        """Should pick the operator the column's index can serve."""
+        with self.app.app_context():
+            statements = []
+            event.listen(self.db.engine, 'before_cursor_execute',
+                         lambda *args: statements.append(args[2]))
+            assert self.ids(methods.startswith, "slug", "HELLO") == [1, 2]
+            assert "LOWER(post.slug) LIKE ?" in statements[-1]
+
+            query = methods.startswith(
+                self.Post, self.Post.query, "title", "Hello")
+            sql = str(query.statement.compile(dialect=postgresql.dialect()))
+            assert "post.title LIKE %(title_1)s ESCAPE" in sql
+            assert query.statement.compile().params["title_1"] == "Hello%"
+
+            query = methods.startswith(
+                self.Post, self.Post.query, "body", "Fast")
+            sql = str(query.statement.compile(dialect=postgresql.dialect()))
+            assert "LOWER(post.body) LIKE %(LOWER_1)s ESCAPE" in sql
+            assert query.statement.compile().params["LOWER_1"] == "fast%"
+
+    def test_startswith_case(self):
+        """Should match a prefix with the column as is."""
+        with self.app.app_context():
+            assert self.ids(methods.startswith_case, "body", "fast") == [1]
+            query = methods.startswith_case(
+                self.Post, self.Post.query, "slug", "Hello")
+            sql = str(query.statement.compile(dialect=postgresql.dialect()))
+            assert "post.slug LIKE %(slug_1)s ESCAPE" in sql
+
+    def test_search_sqlite(self):
+        """Should search the FTS5 table on SQLite."""
+        with self.app.app_context():
+            assert self.ids(methods.search, "body", "fast indexes") == [1, 3]
+            assert self.ids(methods.search, "body", '"slow') == [2]
+
+    def test_search_postgres(self):
+        """Should use the text search functions on Postgres."""
+        with self.app.app_context(), \
+                patch.object(methods, '_dialect_name',
+                             return_value='postgresql'):
+            query = methods.search(self.Post, self.Post.query, "body", "fast")
+            sql = str(query.statement.compile(dialect=postgresql.dialect()))
+        assert "to_tsvector(%(to_tsvector_1)s, post.body) @@ " \
+            "plainto_tsquery(%(plainto_tsquery_1)s, %(plainto_tsquery_2)s)" in sql
+
+    def test_search_requires_searchable_field(self):
+        """Should raise when the column is not in `searchable_fields`."""
+        with self.app.app_context(), pytest.raises(InvalidFormError):
+            methods.search(self.Post, self.Post.query, "title", "hello")
+
+    def test_inside(self):
+        """Should bind the list as a single parameter on SQLite."""
+        with self.app.app_context():
+            statements = []
+            event.listen(self.db.engine, 'before_cursor_execute',
+                         lambda *args: statements.append(args[2:4]))
+            assert self.ids(methods.inside, "id", "[1, 3, 99]") == [1, 3]
+            assert self.ids(methods.not_inside, "id", "[1, 3]") == [2]
+            assert self.ids(methods.inside, "title", '["50% off"]') == [3]
+            assert self.ids(methods.inside, "id", "[1") == [1, 2, 3]
+
+            statement, parameters = statements[0]
+            assert "json_each(?)" in statement
+            assert parameters == ("[1, 3, 99]",)
+
+    def test_inside_postgres(self):
+        """Should compare to an array parameter on Postgres."""
+        with self.app.app_context(), \
+                patch.object(methods, '_dialect_name',
+                             return_value='postgresql'):
+            inside = methods.inside(self.Post, self.Post.query, "id", "[1, 2]")
+            not_inside = methods.not_inside(
+                self.Post, self.Post.query, "id", "[1, 2]")
+        dialect = postgresql.dialect()
+        assert "post.id = ANY (%(param_1)s::INTEGER[])" in \
+            str(inside.statement.compile(dialect=dialect))
+        assert "post.id != ALL (%(param_1)s::INTEGER[])" in \
+            str(not_inside.statement.compile(dialect=dialect))
+
+    def test_inside_max_length(self):
+        """Should reject lists longer than `INSIDE_MAX_LENGTH`."""
+        self.app.config['INSIDE_MAX_LENGTH'] = 2
+        try:
+            with self.app.app_context(), pytest.raises(InvalidFormError):
+                methods.inside(self.Post, self.Post.query, "id", "[1, 2, 3]")
+        finally:
+            del self.app.config['INSIDE_MAX_LENGTH']
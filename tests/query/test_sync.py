@@ -0,0 +1,136 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, DateTime, Integer, String
+from powernap.exceptions import InvalidFormError
+from powernap.mixins import PowernapMixin, TombstoneTableMixin
+from powernap.query.sync import decode_token, encode_token, sync_cutoff
+from powernap.query.transformer import construct_query
+
+
+class TestSync(object):
+    """Creates a sample app with an in-memory database for the tests."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['PAGINATION_PAGE'] = 'page'
+    app.config['PAGINATION_PER_PAGE'] = 'per_page'
+    app.config['DB_ENTRY_ATTR'] = 'user_id'
+    app.config['SYNC_LAG'] = 0
+    db = SQLAlchemy(app)
+
+    class Tombstone(TombstoneTableMixin, db.Model):
+        pass
+
+    class Thing(PowernapMixin, db.Model):
+        exposed_fields = ["id", "user_id", "name"]
+        sync_column = "version"
+        id = Column(Integer, primary_key=True)
+        user_id = Column(Integer)
+        name = Column(String(255))
+        version = Column(Integer, index=True)
+
+    Thing.tombstone_class = Tombstone
+
+    class Note(PowernapMixin, db.Model):
+        exposed_fields = ["id"]
+        id = Column(Integer, primary_key=True)
+
+    @pytest.fixture(autouse=True)
+    def things(self):
+        with self.app.app_context():
+            self.db.create_all()
+            self.db.session.add_all([
+                self.Thing(id=1, user_id=1, name="a", version=1),
+                self.Thing(id=2, user_id=1, name="b", version=1),
+                self.Thing(id=3, user_id=1, name="c", version=2),
+                self.Thing(id=4, user_id=2, name="d", version=3),
+            ])
+            self.db.session.commit()
+            yield
+            self.db.session.remove()
+            self.db.drop_all()
+
+    @pytest.fixture(autouse=True)
+    def current_user(self):
+        with patch('flask_login.utils._get_user') as current_user:
+            current_user.id = 1
+            current_user.is_admin = False
+            current_user.return_value = current_user
+            yield current_user
+
+    def sync(self, since, **args):
+        args["$since"] = since
+        with self.app.test_request_context('/', query_string=args):
+            result = construct_query(self.Thing).api_response()
+            result["items"] = [thing.id for thing in result["items"]]
+            return result
+
+    def test_pages(self):
+        """Should page through the user's rows in sync order."""
+        first = self.sync("", **{"$per_page": 2})
+        second = self.sync(first["since"], **{"$per_page": 2})
+        done = self.sync(second["since"])
+
+        assert (first["items"], first["more"]) == ([1, 2], True)
+        assert (second["items"], second["more"]) == ([3], False)
+        assert (done["items"], done["deleted"]) == ([], [])
+        assert done["since"] == second["since"]
+
+    def test_changes_and_deletes(self):
+        """Should return updated rows and tombstones of deleted rows."""
+        since = self.sync("")["since"]
+        with self.app.test_request_context():
+            thing = self.Thing.query.get(1)
+            thing.version = 5
+            thing.save()
+            self.Thing.query.get(2).delete()
+            self.Thing.query.get(4).delete()
+
+        result = self.sync(since)
+        assert result["items"] == [1]
+        assert result["deleted"] == [2]
+        assert self.sync(result["since"])["deleted"] == []
+
+    def test_lag(self):
+        """Should leave writes newer than `SYNC_LAG` for the next sync."""
+        since = self.sync("")["since"]
+        with self.app.test_request_context():
+            self.Thing.query.get(2).delete()
+        self.app.config['SYNC_LAG'] = 60
+        try:
+            held = self.sync(since)
+        finally:
+            self.app.config['SYNC_LAG'] = 0
+
+        assert held["deleted"] == [] and held["since"] == since
+        assert self.sync(since)["deleted"] == [2]
+
+    def test_cutoff(self):
+        """Should only bound `DateTime` sync columns."""
+        with self.app.app_context():
+            self.app.config['SYNC_LAG'] = 60
+            try:
+                cutoff = sync_cutoff(Column(DateTime))
+            finally:
+                self.app.config['SYNC_LAG'] = 0
+            assert sync_cutoff(Column(Integer)) is None
+        assert abs(datetime.utcnow() - timedelta(seconds=60) - cutoff) < \
+            timedelta(seconds=5)
+
+    def test_invalid_sync(self):
+        """Should reject bad tokens and models without `sync_column`."""
+        with pytest.raises(InvalidFormError):
+            self.sync("not a token")
+        with self.app.test_request_context('/?$since='), \
+                pytest.raises(InvalidFormError):
+            construct_query(self.Note)
+
+    def test_datetime_tokens(self):
+        """Should round trip datetime sync values."""
+        now = datetime(2020, 1, 2, 3, 4, 5, 6)
+        token = encode_token(now, 7, 8)
+
+        assert decode_token(token, Column(DateTime)) == (now, 7, 8)
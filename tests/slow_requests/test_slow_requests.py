@@ -0,0 +1,74 @@
+from flask import Flask
+from sqlalchemy import create_engine, text
+from powernap.instrumentation import note
+from powernap.slow_requests import SlowRequestLog, query_shape
+
+
+class TestSlowRequestLog(object):
+    """Creates a sample app with the slow request log installed."""
+    app = Flask(__name__)
+    app.config.update(SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_LOG_SIZE=2,
+                      SLOW_REQUEST_EXPLAIN=True, ENV='development')
+    engine = create_engine('sqlite://')
+    log = SlowRequestLog()
+    log.init_app(app)
+
+    @app.route('/items')
+    def items():
+        note('query_args', {'$name__icontains': 'a', '$order_by': '-id'})
+        note('rows', 1)
+        with TestSlowRequestLog.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+        return 'items'
+
+    def setup_method(self, method):
+        self.log.entries.clear()
+        self.log.window_count = 0
+        self.app.config['SLOW_REQUESTS_PER_MINUTE'] = 60
+
+    def test_records_slow_requests(self):
+        """Should record the query args, SQL, and plan of slow requests."""
+        self.app.test_client().get('/items')
+
+        entry, = self.log.api_response()
+        assert entry['endpoint'] == 'items'
+        assert entry['status'] == 200
+        assert entry['rows'] == 1
+        assert entry['query_shape'] == '$name__icontains&$order_by=-id'
+        assert entry['sql_count'] == 1
+        assert entry['sql'][0]['statement'] == 'SELECT 1'
+        assert entry['sql'][0]['explain']
+
+    def test_no_explain_without_env(self):
+        """Should not explain queries when `ENV` is unset."""
+        env = self.app.config.pop('ENV')
+        try:
+            self.app.test_client().get('/items')
+        finally:
+            self.app.config['ENV'] = env
+
+        entry, = self.log.api_response()
+        assert 'explain' not in entry['sql'][0]
+
+    def test_keeps_newest_entries(self):
+        """Should only keep `SLOW_REQUEST_LOG_SIZE` entries."""
+        client = self.app.test_client()
+        for _ in range(3):
+            client.get('/items')
+
+        assert len(self.log.api_response()) == 2
+
+    def test_rate_limited(self):
+        """Should not log more than `SLOW_REQUESTS_PER_MINUTE` requests."""
+        self.app.config['SLOW_REQUESTS_PER_MINUTE'] = 1
+        client = self.app.test_client()
+        client.get('/items')
+        client.get('/items')
+
+        assert len(self.log.api_response()) == 1
+
+
+def test_query_shape():
+    """Should drop filter values but keep the ordering."""
+    shape = query_shape({'$value__gte': 10, '$order_by': 'name', '$page': 2})
+    assert shape == '$order_by=name&$page&$value__gte'
@@ -0,0 +1,98 @@
+import sqlite3
+import time
+import pytest
+from unittest.mock import patch
+from flask import Flask
+from powernap.auth.token import TempToken, create_temp_token
+from powernap.storage import MemoryStorage, SQLiteStorage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStorage()
+    return SQLiteStorage(path=str(tmp_path / "storage.db"))
+
+
+class TestStorage(object):
+    """Runs every test against the in-process and SQLite backends."""
+
+    def test_hit(self, backend):
+        """Should count with the TTL of the first hit."""
+        assert backend.hit("ip", 60) == (1, 60)
+        assert backend.hit("ip", 30, amount=4) == (5, 60)
+        assert backend.get("ip") == "5"
+        assert backend.counter("ip") == 5
+        assert backend.counter("missing") is None
+        assert backend.ttl("missing") == -2
+
+    def test_expiry(self, backend):
+        """Should drop keys once they expire."""
+        backend.hit("ip", 60)
+        backend.hset("token", {"id": 1})
+        backend.expire("token", 10)
+
+        with patch("powernap.storage.time.time", return_value=time.time() + 30):
+            assert backend.get("ip") == "1"
+            assert backend.hgetall("token") == {}
+            assert backend.hit("token", 60) == (1, 60)
+
+    def test_hashes_and_sets(self, backend):
+        """Should store hashes and sets like Redis."""
+        backend.hset("token", {"id": 1})
+        backend.hset("token", {"name": "a"})
+        backend.sadd("active", "a", "b")
+        backend.srem("active", "a")
+
+        assert backend.hgetall("token") == {"id": "1", "name": "a"}
+        assert backend.smembers("active") == {"b"}
+        backend.delete("token")
+        assert backend.hgetall("token") == {}
+
+
+class TestSQLiteStorage(object):
+    """Runs SQLite specific tests against a file in `tmp_path`."""
+
+    def test_reads_do_not_lock(self, tmp_path):
+        """Should read while another worker holds the write lock."""
+        path = str(tmp_path / "storage.db")
+        backend = SQLiteStorage(path=path)
+        backend.hset("token", {"id": 1})
+        writer = sqlite3.connect(path, isolation_level=None)
+        writer.execute("BEGIN IMMEDIATE")
+        try:
+            backend.local.conn.execute("PRAGMA busy_timeout = 0")
+            assert backend.hgetall("token") == {"id": "1"}
+            assert backend.ttl("token") == -1
+        finally:
+            writer.execute("ROLLBACK")
+
+    def test_sweep(self, tmp_path):
+        """Should delete expired keys on writes."""
+        backend = SQLiteStorage(path=str(tmp_path / "storage.db"))
+        backend.hit("old", 10)
+        later = time.time() + backend.SWEEP_INTERVAL + 30
+        with patch("powernap.storage.time.time", return_value=later):
+            backend.expire("old", 60)
+            backend.hit("new", 10)
+
+        rows = backend.local.conn.execute(
+            "SELECT key FROM powernap_storage").fetchall()
+        assert rows == [("new",)]
+
+
+class User(object):
+    id = 7
+
+
+def test_temp_token():
+    """Should create and retrieve tokens without Redis."""
+    app = Flask(__name__)
+    app.config.update(STORAGE_BACKEND="powernap.storage.MemoryStorage",
+                      TOKEN_EXPIRE=60, active_tokens_attr="id")
+    with app.app_context():
+        token = create_temp_token(User())
+
+        assert TempToken.retrieve(token).id == "7"
+        assert TempToken().storage.smembers("active:7") == {token}
+        assert TempToken().storage.ttl(token) == 60